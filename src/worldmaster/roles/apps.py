@@ -6,4 +6,4 @@ class RolesConfig(AppConfig):
     name = "worldmaster.roles"
 
     def ready(self):
-        from . import signals # noqa
+        from . import cache, permission_cache, signals, tree # noqa
@@ -0,0 +1,122 @@
+"""Request-scoped caching of effective roles.
+
+A RoleCache is activated with the role_cache() context manager, usually by
+RoleCacheMiddleware for the length of a request.  While it is active,
+RoleTarget.user_is_role answers from memory, loading roles in bulk the first
+time a target is seen.  Any write to roles clears it.
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Role, roles_changed
+from .permission_cache import role_types
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+    from django.contrib.auth.models import AbstractUser, AnonymousUser
+
+_current: ContextVar[RoleCache | None] = ContextVar("role_cache", default=None)
+
+class RoleCache:
+    """The effective role types of users on role targets.
+
+    The types for a user on a target include the types of the NULL user, so a
+    lookup answers exactly what RoleTarget.user_is_role would.
+    """
+
+    __slots__ = (
+        "_types",
+        "hits",
+        "misses",
+    )
+
+    # Maps (user_id, target_id) to the role types, where the user_id is None
+    # for anonymous users.
+    _types: dict[tuple[int | None, int], frozenset[Role.Type]]
+    hits: int
+    misses: int
+
+    def __init__(self) -> None:
+        """Create an empty cache."""
+        self._types = {}
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, user: AbstractUser | AnonymousUser, target_ids: Iterable[int]) -> None:
+        """Load the roles for all the given targets that aren't cached yet.
+
+        These come from the cross-request permission cache, and whatever is not
+        in there is loaded in one query.
+        """
+        user_id = user.id if user.is_authenticated else None
+        missing = {id for id in target_ids if (user_id, id) not in self._types}
+        if not missing:
+            return
+
+        for target_id, types in role_types(user, missing).items():
+            self._types[(user_id, target_id)] = types
+
+    def types(self, user: AbstractUser | AnonymousUser, target_id: int) -> frozenset[Role.Type]:
+        """Get the role types the user has on the target."""
+        user_id = user.id if user.is_authenticated else None
+        key = (user_id, target_id)
+        if key in self._types:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.prefetch(user, (target_id,))
+        return self._types[key]
+
+    def types_many(
+        self,
+        user: AbstractUser | AnonymousUser,
+        target_ids: Iterable[int],
+    ) -> dict[int, frozenset[Role.Type]]:
+        """Get the role types the user has on each target, loading all misses at once."""
+        user_id = user.id if user.is_authenticated else None
+        target_ids = set(target_ids)
+        misses = sum((user_id, id) not in self._types for id in target_ids)
+        self.misses += misses
+        self.hits += len(target_ids) - misses
+        self.prefetch(user, target_ids)
+        return {id: self._types[(user_id, id)] for id in target_ids}
+
+    def invalidate(self) -> None:
+        """Forget all cached roles."""
+        self._types.clear()
+
+@contextmanager
+def role_cache() -> Iterator[RoleCache]:
+    """Activate a fresh RoleCache for the duration of the block."""
+    cache = RoleCache()
+    token = _current.set(cache)
+    try:
+        yield cache
+    finally:
+        _current.reset(token)
+
+def current_role_cache() -> RoleCache | None:
+    """Get the active RoleCache, if there is one."""
+    return _current.get()
+
+def prefetch_roles(user: AbstractUser | AnonymousUser, target_ids: Iterable[int]) -> None:
+    """Prefetch roles into the active RoleCache, if there is one."""
+    cache = _current.get()
+    if cache is not None:
+        cache.prefetch(user, target_ids)
+
+@receiver(roles_changed)
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def invalidate_role_cache(sender: Any, **kwargs: Any) -> None:
+    """Clear the active RoleCache whenever roles are written."""
+    cache = _current.get()
+    if cache is not None:
+        cache.invalidate()
@@ -0,0 +1,161 @@
+"""Deferral of implicit role propagation to the end of a transaction.
+
+Inside deferred_role_rebuild(), RoleTarget._propagate_roles only records which
+subtrees and users are dirty.  When the block exits successfully, one merged
+propagation is scheduled with transaction.on_commit, so a subtree that was
+dirtied several times in one request is only recalculated once.
+
+Implicit roles and EffectiveRole masks are stale until that propagation runs.
+Explicit roles are written immediately, and within the block, role checks on
+the dirty subtrees are answered from the explicit roles on their ancestors, so
+that a MASTER grant followed by an edit under the same world sees the grant.
+
+Similarly, inside deferred_role_target_deletion(), the role targets of deleted
+RoleTargetBase objects are collected and deleted together when the block exits.
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+from django.db import transaction
+from django.db.models import ProtectedError
+
+if TYPE_CHECKING:
+    from collections.abc import Collection, Iterator
+
+# Maps dirty subtree root ids to the users that need recalculating there, with
+# None meaning all users.
+_Pending = dict[int, set[int | None] | None]
+
+_pending: ContextVar[_Pending | None] = ContextVar("deferred_role_rebuild", default=None)
+
+_doomed: ContextVar[set[int] | None] = ContextVar("deferred_role_target_deletion", default=None)
+
+@contextmanager
+def deferred_role_rebuild() -> Iterator[None]:
+    """Defer implicit role propagation until the current transaction commits.
+
+    This may also be used as a decorator.  Nested uses are merged into the
+    outermost one.
+    """
+    if _pending.get() is not None:
+        yield
+        return
+
+    pending: _Pending = {}
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+
+    if pending:
+        transaction.on_commit(lambda: _flush(pending))
+
+def defer_propagation(target_id: int, user_ids: Collection[int | None] | None) -> bool:
+    """Record a dirty subtree if propagation is being deferred.
+
+    Returns False if nothing is being deferred, and the caller should propagate
+    right away.
+    """
+    pending = _pending.get()
+    if pending is None:
+        return False
+
+    if user_ids is None:
+        pending[target_id] = None
+    elif target_id not in pending:
+        pending[target_id] = set(user_ids)
+    else:
+        users = pending[target_id]
+        if users is not None:
+            users.update(user_ids)
+    return True
+
+def deferred_target_ids() -> frozenset[int]:
+    """Get the roots of the subtrees whose propagation is currently deferred."""
+    pending = _pending.get()
+    return frozenset() if pending is None else frozenset(pending)
+
+@contextmanager
+def deferred_role_target_deletion() -> Iterator[None]:
+    """Delete the role targets of deleted objects together, at the end of the block.
+
+    Targets that are still in use by something else are left alone, like when
+    they are deleted one at a time.
+    """
+    if _doomed.get() is not None:
+        yield
+        return
+
+    doomed: set[int] = set()
+    token = _doomed.set(doomed)
+    try:
+        yield
+    finally:
+        _doomed.reset(token)
+
+    if doomed:
+        _delete_role_targets(doomed)
+
+def defer_role_target_deletion(target_id: int) -> bool:
+    """Record a role target to delete if deletion is being deferred.
+
+    Returns False if nothing is being deferred, and the caller should delete
+    right away.
+    """
+    doomed = _doomed.get()
+    if doomed is None:
+        return False
+    doomed.add(target_id)
+    return True
+
+def _delete_role_targets(ids: set[int]) -> None:
+    # Imported here because .models imports this module.
+    from .models import RoleTarget  # noqa: PLC0415
+
+    try:
+        RoleTarget.bulk_delete(ids)
+    except ProtectedError:
+        # Fall back to one at a time, leaving the ones that are in use.
+        for id in ids:
+            with suppress(ProtectedError):
+                RoleTarget.bulk_delete((id,))
+
+def _flush(pending: _Pending) -> None:
+    """Propagate every dirty subtree once.
+
+    A dirty target under another dirty target is folded into the outermost one,
+    since propagating a user over the larger subtree covers the smaller one.
+    Targets that have been deleted since are skipped.
+    """
+    # Imported here because .models imports this module.
+    from .models import RoleTarget, RoleTargetAncestor  # noqa: PLC0415
+
+    outermost: dict[int, int] = {id: id for id in pending}
+    depths: dict[int, int] = {}
+    for descendant_id, ancestor_id, depth in RoleTargetAncestor.objects.filter(
+        descendant_id__in=pending.keys(),
+        ancestor_id__in=pending.keys(),
+    ).exclude(depth=0).values_list("descendant_id", "ancestor_id", "depth"):
+        if depth > depths.get(descendant_id, 0):
+            depths[descendant_id] = depth
+            outermost[descendant_id] = ancestor_id
+
+    merged: _Pending = {}
+    for id, users in pending.items():
+        root_id = outermost[id]
+        if root_id not in merged:
+            merged[root_id] = None if users is None else set(users)
+        else:
+            merged_users = merged[root_id]
+            if users is None:
+                merged[root_id] = None
+            elif merged_users is not None:
+                merged_users.update(users)
+
+    with transaction.atomic():
+        for target in RoleTarget.objects.filter(id__in=merged.keys()):
+            target._propagate_roles(merged[target.id])
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import json
+import statistics
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, cast
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from worldmaster.roles.deferred import deferred_role_rebuild
+from worldmaster.roles.models import Role
+from worldmaster.roles.tree import role_tree
+from worldmaster.wiki.models import Section
+from worldmaster.wiki.ordering import generate_n_keys_between
+from worldmaster.worlds.models import Entity, Plane, World
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+    from worldmaster.worldmaster import models as worldmaster
+
+User = cast(type["worldmaster.User"], get_user_model())
+
+# The permission cache is cleared before every measurement, so the benchmark
+# gives it a cache of its own rather than wiping one that is shared.
+_CACHE = "benchmark_roles"
+
+class Command(BaseCommand):
+    help = (
+        "Time role operations and count their queries on synthetic worlds, and write"
+        " the results as JSON.  Everything runs in a throwaway test database."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--worlds", type=int, default=1, help="How many worlds to build.")
+        parser.add_argument("--planes", type=int, default=10, help="How many planes each world has.")
+        parser.add_argument("--entities", type=int, default=10, help="How many entities each world has.")
+        parser.add_argument("--sections", type=int, default=5, help="How many sections each article has.")
+        parser.add_argument("--users", type=int, default=50, help="How many users view each world.")
+        parser.add_argument("--repeat", type=int, default=5, help="How many times each operation is timed.")
+        parser.add_argument("--output", default="-", help="The file to write JSON to, or - for stdout.")
+
+    def handle(self, *args: Any, repeat: int, output: str, **options: Any) -> None:
+        shape = {name: options[name] for name in ("worlds", "planes", "entities", "sections", "users")}
+        caches_setting = {
+            **settings.CACHES,
+            _CACHE: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": _CACHE},
+        }
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(CACHES=caches_setting, WORLDMASTER_ROLE_CACHE=_CACHE):
+                start = time.perf_counter()
+                world = self._build(**shape)
+                self.stderr.write(f"Built {shape['worlds']} worlds in {time.perf_counter() - start:.1f}s")
+                results = self._run(world, repeat)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = json.dumps(
+            {
+                "shape": shape,
+                "repeat": repeat,
+                "database": connection.vendor,
+                "operations": results,
+            },
+            indent=2,
+        )
+        if output == "-":
+            self.stdout.write(report)
+        else:
+            Path(output).write_text(report + "\n")
+
+    @staticmethod
+    @transaction.atomic
+    @deferred_role_rebuild()
+    def _build(*, worlds: int, planes: int, entities: int, sections: int, users: int) -> World:
+        """Build the synthetic worlds, and return the first one."""
+        viewers = User.objects.bulk_create(User(username=f"user-{i}") for i in range(users))
+
+        built: list[World] = []
+        for i in range(worlds):
+            world = World.objects.create(slug=f"world-{i}", name=f"World {i}")
+            built.append(world)
+            children: list[Plane | Entity] = [
+                *(world.plane_set.create(slug=f"plane-{j}", name=f"Plane {j}") for j in range(planes)),
+                *(world.entity_set.create(slug=f"entity-{j}", name=f"Entity {j}") for j in range(entities)),
+            ]
+            for article in (world.article, *(child.article for child in children)):
+                for key in generate_n_keys_between(None, None, sections):
+                    article.sections.create(body=[], key=key)
+
+            for user in viewers:
+                world.role_target.roles.create(user=user, type=Role.Type.VIEWER)
+
+        return built[0]
+
+    def _run(self, world: World, repeat: int) -> dict[str, dict[str, Any]]:
+        user = User.objects.create(username="benchmark")
+        # The deepest section there is, under a plane if possible.
+        plane = world.plane_set.first()
+        article = plane.article if plane is not None else world.article
+        section = article.sections.first()
+        if section is None:
+            msg = "The benchmark needs at least one section"
+            raise CommandError(msg)
+
+        results: dict[str, dict[str, Any]] = {}
+
+        @contextmanager
+        def measure(name: str) -> Iterator[None]:
+            caches[_CACHE].clear()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                yield
+                seconds = time.perf_counter() - start
+            result = results.setdefault(name, {"seconds": [], "queries": []})
+            result["seconds"].append(seconds)
+            result["queries"].append(len(queries))
+
+        def grant_and_revoke(name: str, target: Any, type: Role.Type) -> Callable[[], None]:
+            def run() -> None:
+                with measure(f"grant_{name}"):
+                    role = target.roles.create(user=user, type=type)
+                with measure(f"revoke_{name}"):
+                    role.delete()
+            return run
+
+        operations = [
+            grant_and_revoke("world_master", world.role_target, Role.Type.MASTER),
+            grant_and_revoke("world_editor", world.role_target, Role.Type.EDITOR),
+            grant_and_revoke("section_master", section.role_target, Role.Type.MASTER),
+            grant_and_revoke("section_editor", section.role_target, Role.Type.EDITOR),
+        ]
+
+        def rebuild() -> None:
+            with measure("rebuild"):
+                Role.rebuild()
+
+        def delete_user() -> None:
+            doomed = User.objects.create(username="doomed")
+            # Explicit roles can't be granted where they are already implicit.
+            section.role_target.roles.create(user=doomed, type=Role.Type.EDITOR)
+            world.role_target.roles.create(user=doomed, type=Role.Type.MASTER)
+            with measure("delete_user"):
+                doomed.delete()
+
+        def visible_to() -> None:
+            with measure("visible_to"):
+                list(Plane.objects.visible_to(user))
+                list(Section.objects.visible_to(user))
+
+        def tree_checks() -> None:
+            with measure("role_tree"):
+                tree = role_tree(world.role_target)
+                for target_id in tree.index:
+                    tree.user_is_viewer(user, target_id)
+
+        operations += [rebuild, delete_user, visible_to, tree_checks]
+
+        for _ in range(repeat):
+            for operation in operations:
+                operation()
+
+        for name, result in results.items():
+            seconds = result["seconds"]
+            self.stderr.write(f"{name}: {statistics.median(seconds) * 1000:.1f}ms, {max(result['queries'])} queries")
+            result["median_seconds"] = statistics.median(seconds)
+            result["min_seconds"] = min(seconds)
+        return results
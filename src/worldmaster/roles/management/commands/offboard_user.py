@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import transaction
+
+from worldmaster.roles.offboarding import remove_user_roles
+
+
+class Command(BaseCommand):
+    help = "Remove all of a user's roles in bulk, and optionally delete the user."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("username", help="The username of the user to offboard.")
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            help="Delete the user as well.",
+        )
+
+    def handle(self, *args: Any, username: str, delete: bool, **options: Any) -> None:
+        User = get_user_model()
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist as e:
+            msg = f"No user named {username!r}"
+            raise CommandError(msg) from e
+
+        with transaction.atomic():
+            removed = remove_user_roles(user)
+            if delete:
+                user.delete()
+
+        self.stdout.write(f"Removed {removed}")
+        if removed.root_ids:
+            self.stdout.write(f"Affected root RoleTargets: {', '.join(map(str, sorted(removed.root_ids)))}")
+        if delete:
+            self.stdout.write(f"Deleted user {username!r}")
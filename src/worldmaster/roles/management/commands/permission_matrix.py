@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from worldmaster.roles.matrix import permission_matrix
+from worldmaster.roles.models import Role, RoleTarget
+
+
+class Command(BaseCommand):
+    help = (
+        "Export who has which roles on every target in the tree of a RoleTarget,"
+        " like a world's role_target_id."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("target", type=int, help="The id of any RoleTarget in the tree.")
+        parser.add_argument(
+            "--format",
+            choices=("csv", "ndjson"),
+            default="csv",
+            help="The export format.",
+        )
+        parser.add_argument("--output", default="-", help="The file to write to, or - for stdout.")
+        parser.add_argument(
+            "--public-not",
+            type=int,
+            metavar="USER_ID",
+            help="Instead of exporting, list the targets the public can view but this user has no own VIEWER role on.",
+        )
+
+    def handle(self, *args: Any, target: int, format: str, output: str, public_not: int | None, **options: Any) -> None:
+        if not RoleTarget.objects.filter(id=target).exists():
+            msg = f"No RoleTarget {target}"
+            raise CommandError(msg)
+
+        start = time.monotonic()
+        matrix = permission_matrix(target)
+        self.stderr.write(
+            f"Built a {len(matrix.user_ids)} users by {len(matrix.tree.index)} targets matrix"
+            f" in {time.monotonic() - start:.2f}s",
+        )
+
+        if public_not is not None:
+            bits = matrix.bits(None, Role.Type.VIEWER) & ~matrix.bits(public_not, Role.Type.VIEWER)
+            for target_id in matrix.target_ids(bits):
+                self.stdout.write(str(target_id))
+            return
+
+        if output == "-":
+            getattr(matrix, f"write_{format}")(self.stdout)
+        else:
+            with Path(output).open("w", newline="") as file:
+                getattr(matrix, f"write_{format}")(file)
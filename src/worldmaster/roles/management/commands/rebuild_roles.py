@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+
+from worldmaster.roles.models import RoleRebuildCheckpoint, RoleTarget, RoleTargetAncestor
+
+def _rebuild_root(run: str, root_id: int) -> int:
+    """Rebuild the roles under a root and checkpoint it, in one transaction.
+
+    Returns how many targets are under the root.
+    """
+    with transaction.atomic():
+        root = RoleTarget.objects.get(id=root_id)
+        root._propagate_roles_now(None)
+        RoleRebuildCheckpoint.objects.create(run=run, target=root)
+    return RoleTargetAncestor.objects.filter(ancestor_id=root_id).count()
+
+class Command(BaseCommand):
+    help = (
+        "Recalculate all implicit roles, one root RoleTarget at a time.  Each root is"
+        " diffed in its own transaction and checkpointed, so an interrupted run can be"
+        " resumed by running it again with the same --run.  Roots are rebuilt one after"
+        " another in this process.  Running several rebuilds at once doesn't help on"
+        " SQLite, which allows only one writer at a time."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--run",
+            default="default",
+            help="The name of the run to checkpoint into and resume from.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Forget the checkpoints of an interrupted run and rebuild every root.",
+        )
+
+    def handle(self, *args: Any, run: str, restart: bool, **options: Any) -> None:
+        checkpoints = RoleRebuildCheckpoint.objects.filter(run=run)
+        if restart:
+            checkpoints.delete()
+
+        root_ids = list(
+            RoleTarget.objects.filter(parent=None)
+            .exclude(rebuild_checkpoint__run=run)
+            .order_by("id")
+            .values_list("id", flat=True),
+        )
+        skipped = checkpoints.count()
+        if skipped:
+            self.stdout.write(f"Resuming run {run!r}, skipping {skipped} finished roots")
+
+        start = time.monotonic()
+        targets = 0
+        for done, root_id in enumerate(root_ids, 1):
+            count = _rebuild_root(run, root_id)
+            targets += count
+            elapsed = time.monotonic() - start
+            self.stdout.write(
+                f"[{done}/{len(root_ids)}] RoleTarget {root_id}: {count} targets"
+                f" ({done / elapsed:.1f} roots/s, {targets / elapsed:.1f} targets/s)",
+            )
+
+        checkpoints.delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt roles under {len(root_ids)} roots in {time.monotonic() - start:.1f}s",
+        ))
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from worldmaster.roles.verify import verify_roles
+
+
+class Command(BaseCommand):
+    help = "Check that the implicit roles and effective role masks match what the explicit roles imply."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Fix only the rows that differ.",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=20,
+            help="How many discrepancies of each kind to list.",
+        )
+
+    def handle(self, *args: Any, repair: bool, limit: int, **options: Any) -> None:
+        start = time.monotonic()
+        discrepancies = verify_roles(repair=repair)
+        self.stdout.write(f"Verified roles in {time.monotonic() - start:.1f}s")
+
+        for target_id, user_id, type in discrepancies.missing_roles[:limit]:
+            self.stdout.write(f"Missing: user {user_id} {type.label} on RoleTarget {target_id}")
+        for id, target_id, user_id, type in discrepancies.extra_roles[:limit]:
+            self.stdout.write(f"Extra: Role {id}, user {user_id} {type.label} on RoleTarget {target_id}")
+        for _, target_id, user_id, expected, actual in discrepancies.masks[:limit]:
+            self.stdout.write(f"Mask: user {user_id} on RoleTarget {target_id} is {actual}, expected {expected}")
+
+        summary = (
+            f"{len(discrepancies.missing_roles)} missing roles, {len(discrepancies.extra_roles)} extra roles,"
+            f" {len(discrepancies.masks)} wrong masks"
+        )
+        if not discrepancies:
+            self.stdout.write(self.style.SUCCESS("Roles are consistent"))
+        elif repair:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {summary}"))
+        else:
+            msg = f"Found {summary}"
+            raise CommandError(msg)
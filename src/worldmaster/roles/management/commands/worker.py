@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import os
+import socket
+import time
+from datetime import timedelta
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from worldmaster.roles.models import RolePropagationJob
+
+
+class Command(BaseCommand):
+    help = "Run queued role propagation jobs.  Only needed with WORLDMASTER_ASYNC_ROLE_PROPAGATION."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when the queue is empty instead of waiting for more jobs.",
+        )
+        parser.add_argument(
+            "--poll",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before checking an empty queue again.",
+        )
+        parser.add_argument(
+            "--lease",
+            type=float,
+            default=600.0,
+            help="Seconds after which a running job is assumed abandoned and may be claimed again.",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=3,
+            help="How many times a job is tried before it is marked failed.",
+        )
+
+    def handle(self, *args: Any, once: bool, poll: float, lease: float, max_attempts: int, **options: Any) -> None:
+        name = f"{socket.gethostname()}:{os.getpid()}"
+        lease_delta = timedelta(seconds=lease)
+
+        while True:
+            job = RolePropagationJob.claim(name, lease_delta)
+            if job is None:
+                if once:
+                    return
+                time.sleep(poll)
+                continue
+
+            if job.run(max_attempts):
+                self.stdout.write(f"Propagated roles under RoleTarget {job.target_id}")
+            else:
+                self.stderr.write(f"Propagation under RoleTarget {job.target_id} failed: {job.error}")
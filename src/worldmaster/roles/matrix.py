@@ -0,0 +1,122 @@
+"""Whole-tree permission reports as packed bitsets.
+
+A PermissionMatrix holds, for every user with roles in one RoleTarget tree and
+for the NULL user, one Python int per role type with a bit set for every target
+where that user has that type.  Bits are in RoleTree position order, so set
+operations across users are single big-integer operations, and a question like
+"what can the public see that this player can't" is one expression:
+
+    matrix.target_ids(matrix.bits(None, VIEWER) & ~matrix.bits(player.id, VIEWER))
+"""
+from __future__ import annotations
+
+import csv
+import json
+from typing import TYPE_CHECKING, TextIO
+
+from .models import EffectiveRole, Role, RoleTarget
+from .tree import RoleTree, role_tree
+
+if TYPE_CHECKING:
+    from array import array
+    from collections.abc import Iterator
+
+# Translates a byte of mask into the ASCII digit of one type's bit.
+_DIGITS = {
+    type: bytes.maketrans(
+        bytes(range(256)),
+        bytes(ord("1") if mask & (1 << type) else ord("0") for mask in range(256)),
+    )
+    for type in Role.Type
+}
+
+def _bitset(masks: array[int], type: Role.Type) -> int:
+    """Pack one type's bit of every mask into an int, with position 0 lowest."""
+    digits = masks.tobytes().translate(_DIGITS[type])
+    return int(digits[::-1], 2) if digits else 0
+
+class PermissionMatrix:
+    """The effective role types of every user on every target of one tree."""
+
+    __slots__ = (
+        "_bits",
+        "_target_ids",
+        "tree",
+    )
+
+    tree: RoleTree
+    # The target ids in position order.
+    _target_ids: list[int]
+    # Maps (user_id, type) to the bitset of the user's own roles, with None for
+    # the NULL user.
+    _bits: dict[tuple[int | None, Role.Type], int]
+
+    def __init__(self, tree: RoleTree) -> None:
+        """Pack the roles of every user in the tree."""
+        self.tree = tree
+        self._target_ids = list(tree.index)
+        self._bits = {}
+        for user_id in tree.user_ids:
+            masks = tree.masks(user_id)
+            if masks is not None:
+                for type in Role.Type:
+                    self._bits[(user_id, type)] = _bitset(masks, type)
+
+    @property
+    def user_ids(self) -> list[int | None]:
+        """The users with any roles in the tree, with None for the NULL user."""
+        return self.tree.user_ids
+
+    def bits(self, user_id: int | None, type: Role.Type, *, include_public: bool = False) -> int:
+        """Get the bitset of targets where the user has a role type.
+
+        By default these are only the user's own roles.  With include_public,
+        the NULL user's are added, which is what user_is_role checks.
+        """
+        bits = self._bits.get((user_id, type), 0)
+        if include_public:
+            bits |= self._bits.get((None, type), 0)
+        return bits
+
+    def target_ids(self, bits: int) -> list[int]:
+        """Get the target ids of the set bits."""
+        return [
+            self._target_ids[position]
+            for position, digit in enumerate(bin(bits)[:1:-1])
+            if digit == "1"
+        ]
+
+    def rows(self) -> Iterator[tuple[int, int | None, frozenset[Role.Type]]]:
+        """Yield (target_id, user_id, types) for every user's own roles on every target."""
+        for user_id in self.user_ids:
+            masks = self.tree.masks(user_id)
+            if masks is None:
+                continue
+            for target_id, mask in zip(self._target_ids, masks, strict=True):
+                if mask:
+                    yield target_id, user_id, EffectiveRole.unpack(mask)
+
+    def write_csv(self, file: TextIO) -> None:
+        """Write one row per target and user, with a column per role type."""
+        writer = csv.writer(file)
+        types = list(Role.Type)
+        writer.writerow(["target_id", "user_id", *(type.name.lower() for type in types)])
+        for target_id, user_id, row_types in self.rows():
+            writer.writerow([
+                target_id,
+                "" if user_id is None else user_id,
+                *(int(type in row_types) for type in types),
+            ])
+
+    def write_ndjson(self, file: TextIO) -> None:
+        """Write one JSON object per target and user."""
+        for target_id, user_id, types in self.rows():
+            file.write(json.dumps({
+                "target_id": target_id,
+                "user_id": user_id,
+                "roles": sorted(type.name.lower() for type in types),
+            }) + "\n")
+
+def permission_matrix(target: RoleTarget | int) -> PermissionMatrix:
+    """Build the permission matrix of the whole tree that a target is in."""
+    return PermissionMatrix(role_tree(target))
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from .cache import role_cache
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from django.http import HttpRequest, HttpResponse
+
+
+class RoleCacheMiddleware:
+    """Answer role checks for the length of a request from a RoleCache.
+
+    The cache is available as request.role_cache, so its hit and miss counters
+    can be inspected.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        """Wrap the next handler in the chain."""
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        with role_cache() as cache:
+            request.role_cache = cache  # type: ignore[attr-defined]
+            return self.get_response(request)
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_ancestors(apps, schema_editor):
+    RoleTarget = apps.get_model('roles', 'RoleTarget')
+    RoleTargetAncestor = apps.get_model('roles', 'RoleTargetAncestor')
+
+    parents = dict(RoleTarget.objects.values_list('id', 'parent_id'))
+    links = []
+    for id in parents:
+        ancestor_id = id
+        depth = 0
+        while ancestor_id is not None:
+            links.append(RoleTargetAncestor(ancestor_id=ancestor_id, descendant_id=id, depth=depth))
+            ancestor_id = parents[ancestor_id]
+            depth += 1
+    RoleTargetAncestor.objects.bulk_create(links, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roles', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoleTargetAncestor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField(help_text='The number of parent steps from the descendant to the ancestor')),
+                ('ancestor', models.ForeignKey(db_index=False, help_text='The ancestor, or the descendant itself when depth is 0', on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', related_query_name='descendant_link', to='roles.roletarget')),
+                ('descendant', models.ForeignKey(db_index=False, help_text='The descendant', on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', related_query_name='ancestor_link', to='roles.roletarget')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='role_target_descendant_depth')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='roletargetancestor',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_role_target_ancestor_descendant'),
+        ),
+        migrations.RunPython(backfill_ancestors, migrations.RunPython.noop),
+    ]
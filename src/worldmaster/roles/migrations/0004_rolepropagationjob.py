@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roles', '0003_roletargetancestor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RolePropagationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_ids', models.JSONField(blank=True, default=None, help_text='The ids of the users to propagate, with null for the anonymous user.  If null, all users.', null=True)),
+                ('state', models.PositiveSmallIntegerField(choices=[(1, 'Pending'), (2, 'Running'), (3, 'Failed')], default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_at', models.DateTimeField(blank=True, default=None, help_text='When a worker last claimed this job', null=True)),
+                ('claimed_by', models.CharField(blank=True, default='', help_text='The name of the worker that last claimed this job', max_length=256)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='', help_text='The error from the last failed attempt')),
+                ('target', models.ForeignKey(help_text='The root of the subtree to propagate', on_delete=django.db.models.deletion.CASCADE, related_name='propagation_jobs', related_query_name='propagation_job', to='roles.roletarget')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['state', 'id'], name='role_propagation_job_state')],
+            },
+        ),
+    ]
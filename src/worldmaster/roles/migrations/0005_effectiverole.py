@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_effective_roles(apps, schema_editor):
+    Role = apps.get_model('roles', 'Role')
+    EffectiveRole = apps.get_model('roles', 'EffectiveRole')
+
+    # Role already has a row for every explicit and implicit type.
+    masks = {}
+    for target_id, user_id, type in Role.objects.values_list('target_id', 'user_id', 'type').iterator():
+        masks[(target_id, user_id)] = masks.get((target_id, user_id), 0) | (1 << type)
+    EffectiveRole.objects.bulk_create(
+        [
+            EffectiveRole(target_id=target_id, user_id=user_id, mask=mask)
+            for (target_id, user_id), mask in masks.items()
+        ],
+        batch_size=500,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('roles', '0004_rolepropagationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectiveRole',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mask', models.PositiveSmallIntegerField(help_text='A bitmask of 1 << type for every effective role type')),
+                ('target', models.ForeignKey(db_index=False, help_text='The target for these roles', on_delete=django.db.models.deletion.CASCADE, related_name='effective_roles', related_query_name='effective_role', to='roles.roletarget')),
+                ('user', models.ForeignKey(blank=True, help_text='The user with these roles.  If NULL, these are the anonymous roles.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='effective_roles', related_query_name='effective_role', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='effectiverole',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('target', 'user'), name='unique_effective_role_target_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='effectiverole',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('target',), name='unique_effective_role_target_anonymous'),
+        ),
+        migrations.RunPython(backfill_effective_roles, migrations.RunPython.noop),
+    ]
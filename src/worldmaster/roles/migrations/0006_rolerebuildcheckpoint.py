@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roles', '0005_effectiverole'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoleRebuildCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run', models.CharField(help_text='The name of the rebuild_roles run', max_length=64)),
+                ('completed_at', models.DateTimeField(auto_now_add=True)),
+                ('target', models.ForeignKey(db_index=False, help_text='The root whose roles were rebuilt', on_delete=django.db.models.deletion.CASCADE, related_name='rebuild_checkpoints', related_query_name='rebuild_checkpoint', to='roles.roletarget')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='rolerebuildcheckpoint',
+            constraint=models.UniqueConstraint(fields=('target', 'run'), name='unique_role_rebuild_checkpoint_target_run'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('roles', '0006_rolerebuildcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='role',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, help_text='The user with this role.  If NULL, allows anonymous access to the role.', null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='roles', related_query_name='role', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roles', '0007_role_user_do_nothing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='effectiverole',
+            index=models.Index(fields=['target'], name='effective_role_target'),
+        ),
+        migrations.AddIndex(
+            model_name='role',
+            index=models.Index(fields=['target', 'explicit'], name='role_target_explicit'),
+        ),
+    ]
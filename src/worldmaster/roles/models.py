@@ -1,14 +1,21 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Generic, Self, TypeVar
+import itertools
+from typing import TYPE_CHECKING, Generic, Self, TypeVar, cast
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.dispatch import Signal
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .deferred import defer_propagation, deferred_target_ids
+
 if TYPE_CHECKING:
-    from collections.abc import Mapping
+    from collections.abc import Collection, Iterable, Iterator, Mapping, Sequence
+    from datetime import timedelta
 
     from django.contrib.auth.models import AbstractUser, AnonymousUser
     from django.db.models.manager import RelatedManager
@@ -16,6 +23,18 @@ if TYPE_CHECKING:
 else:
     User = get_user_model()
 
+_T = TypeVar("_T")
+_QuerySet = TypeVar("_QuerySet", bound=models.QuerySet)
+
+# Sent after implicit roles have been written.  target is the root of the
+# subtree whose roles changed, or None if roles may have changed anywhere.
+roles_changed = Signal()
+
+# Sent after a RoleTarget was moved to a different parent.  target is the moved
+# target, previous_parent_id its old parent's id, and descendant_ids the ids of
+# target and everything under it.
+ancestry_changed = Signal()
+
 class RoleTarget(models.Model):
     """A hierarchical role target.
 
@@ -26,6 +45,13 @@ class RoleTarget(models.Model):
     reference this.
     """
 
+    __slots__ = (
+        "_loaded_parent_id",
+    )
+
+    # The parent_id as loaded or last saved, to detect moves.
+    _loaded_parent_id: int | None
+
     id: int | None
 
     parent: models.ForeignKey[RoleTarget | None, RoleTarget | None] = models.ForeignKey(
@@ -50,25 +76,146 @@ class RoleTarget(models.Model):
 
     roles: RelatedManager[Role]
 
+    ancestor_links: RelatedManager[RoleTargetAncestor]
+    descendant_links: RelatedManager[RoleTargetAncestor]
+
+    def ancestors(self) -> models.QuerySet[RoleTarget]:
+        """Return this target and all its ancestors, nearest first, in a single query."""
+        return RoleTarget.objects.filter(
+            descendant_link__descendant=self,
+        ).order_by("descendant_link__depth")
+
+    def descendants(self) -> models.QuerySet[RoleTarget]:
+        """Return this target and all its descendants, in a single query."""
+        return RoleTarget.objects.filter(ancestor_link__ancestor=self)
+
+    def is_descendant_of(self, other: RoleTarget) -> bool:
+        """Return True if this is other or somewhere in its subtree."""
+        return self.ancestor_links.filter(ancestor=other).exists()
+
     def user_is_role(self, user: AbstractUser | AnonymousUser, type: Role.Type) -> bool:
         """Return True if the user counts as this role.
 
         This is true if this user or the NULL user has the role on this target,
         or if the user is a superuser.
+
+        Answers come from the request's RoleCache if one is active, and
+        otherwise from the cross-request permission cache.
+        """
+        return type in RoleTarget.roles_for(user, (self,))[cast(int, self.id)]
+
+    @staticmethod
+    def roles_for(
+        user: AbstractUser | AnonymousUser,
+        targets: Iterable[RoleTarget | int],
+    ) -> dict[int, set[Role.Type]]:
+        """Get the role types the user counts as on each of the targets.
+
+        targets may be RoleTargets or their ids.  Like user_is_role, this counts
+        the NULL user's roles and gives superusers every role.  Everything that
+        isn't cached is loaded in a single query.
+
+        Targets whose implicit roles may be stale are instead answered from the
+        explicit roles on their ancestors.  Those are the targets in a subtree
+        whose propagation is deferred by the current deferred_role_rebuild(),
+        and with WORLDMASTER_ASYNC_ROLE_PROPAGATION, the targets with a
+        propagation job pending on them or an ancestor.
         """
-        # Superuser is always all roles
+        ids = {target if isinstance(target, int) else cast(int, target.id) for target in targets}
+
         if user.is_superuser:
-            return True
+            return {id: set(Role.Type) for id in ids}
 
-        user_check = models.Q(user=None)
+        # Imported here because both modules import this one.
+        from .cache import current_role_cache  # noqa: PLC0415
+        from .permission_cache import role_types  # noqa: PLC0415
 
+        roles: dict[int, set[Role.Type]] = {}
+        stale = _stale_target_ids(ids)
+        if stale:
+            roles.update(RoleTarget._explicit_roles_for(user, stale))
+            ids -= stale
+
+        cache = current_role_cache()
+        if cache is not None:
+            roles.update((id, set(types)) for id, types in cache.types_many(user, ids).items())
+        else:
+            roles.update((id, set(types)) for id, types in role_types(user, ids).items())
+        return roles
+
+    @staticmethod
+    def _explicit_roles_for(
+        user: AbstractUser | AnonymousUser,
+        target_ids: Collection[int],
+    ) -> dict[int, set[Role.Type]]:
+        """Work out the role types on each target from explicit roles alone.
+
+        This walks the ancestors of every target in one query, so it gives the
+        right answer even while the materialized implicit roles are stale.
+        """
+        user_check = models.Q(ancestor__role__user=None)
         if user.is_authenticated:
-            user_check |= models.Q(user=user)
+            user_check |= models.Q(ancestor__role__user=user)
 
-        return self.roles.filter(
+        # Maps descendant ids to the explicit role types at each depth.
+        explicit: dict[int, dict[int, set[Role.Type]]] = {id: {} for id in target_ids}
+        for descendant_id, depth, type in RoleTargetAncestor.objects.filter(
             user_check,
-            type=type,
-        ).exists()
+            descendant_id__in=target_ids,
+            ancestor__role__explicit=True,
+        ).values_list("descendant_id", "depth", "ancestor__role__type"):
+            explicit[descendant_id].setdefault(depth, set()).add(type)
+
+        return {id: _resolve_chain(depths) for id, depths in explicit.items()}
+
+    @staticmethod
+    def _inherited_roles(target_ids: Collection[int]) -> dict[int, dict[int | None, set[Role.Type]]]:
+        """Work out what every user passes down to children of each target.
+
+        Like _explicit_roles_for, this only reads explicit roles, in one query,
+        so it is right even while implicit roles are stale.
+        """
+        # Maps target ids to the explicit role types of each user at each depth.
+        explicit: dict[int, dict[int | None, dict[int, set[Role.Type]]]] = {id: {} for id in target_ids}
+        for descendant_id, depth, user_id, type in RoleTargetAncestor.objects.filter(
+            descendant_id__in=target_ids,
+            ancestor__role__explicit=True,
+        ).values_list("descendant_id", "depth", "ancestor__role__user_id", "ancestor__role__type"):
+            explicit[descendant_id].setdefault(user_id, {}).setdefault(depth, set()).add(type)
+
+        inherited: dict[int, dict[int | None, set[Role.Type]]] = {}
+        for id, users in explicit.items():
+            inherited[id] = {}
+            for user_id, depths in users.items():
+                types = Role._INHERITED.intersection(_resolve_chain(depths))
+                if types:
+                    inherited[id][user_id] = types
+        return inherited
+
+    def move_to(self, new_parent: RoleTarget | None) -> None:
+        """Move this target and its subtree under new_parent, or make it a root.
+
+        Only users whose inherited roles differ between the old and the new
+        ancestors have their implicit roles recalculated.  Raises ValueError if
+        new_parent is inside this subtree.
+        """
+        self.parent = new_parent
+        self.save(update_fields=("parent",))
+
+    def _parent_changed(self, previous_parent_id: int | None) -> None:
+        """Propagate the users whose inherited roles changed with the parent."""
+        parent_ids = [id for id in (previous_parent_id, self.parent_id) if id is not None]
+        inherited = RoleTarget._inherited_roles(parent_ids)
+        previous = inherited.get(previous_parent_id, {}) if previous_parent_id is not None else {}
+        current = inherited.get(self.parent_id, {}) if self.parent_id is not None else {}
+
+        user_ids = {
+            user_id
+            for user_id in previous.keys() | current.keys()
+            if previous.get(user_id) != current.get(user_id)
+        }
+        if user_ids:
+            self._propagate_roles(user_ids)
 
     def user_is_master(self, user: AbstractUser | AnonymousUser) -> bool:
         """Return True if the user has the MASTER role on this or any ancestor."""
@@ -82,68 +229,371 @@ class RoleTarget(models.Model):
         """If the user has VIEWER on this."""
         return self.user_is_role(user, Role.Type.VIEWER)
 
-    def _rebuild_roles(self) -> None:
-        self._delete_implicit_roles()
-        self._setup_implicit_roles()
+    def _subtree_levels(self) -> list[list[tuple[int, int | None]]]:
+        """Return the (id, parent_id) pairs of this target and its descendants.
 
-    def _delete_implicit_roles(self) -> None:
-        """Delete the implicit roles for this role target recursively.
+        The pairs are grouped by depth, so every parent appears in an earlier
+        level than its children.  This is a single query on the ancestry table.
         """
-        self.roles.filter(explicit=False).delete()
+        levels: list[list[tuple[int, int | None]]] = []
+        for id, parent_id, depth in self.descendant_links.values_list(
+            "descendant_id",
+            "descendant__parent_id",
+            "depth",
+        ).order_by("depth"):
+            if depth == len(levels):
+                levels.append([])
+            levels[depth].append((id, parent_id))
+        return levels
 
-        for child in self.children.all():
-            child._delete_implicit_roles()
+    @classmethod
+    def bulk_create_children(cls, parent: RoleTarget, count: int) -> list[RoleTarget]:
+        """Create count new children of parent, with their ancestry, in a few queries.
 
-    def _setup_implicit_roles(self) -> None:
-        """Set up implicit roles for a role target.
+        No signals are sent, so roles are not propagated.  Once the new targets'
+        explicit roles are in place, propagate the parent once.
         """
-        parent = self.parent
+        targets = cls.objects.bulk_create([cls(parent=parent) for _ in range(count)], batch_size=_BATCH_SIZE)
+        ancestors = list(RoleTargetAncestor.objects.filter(
+            descendant=parent,
+        ).values_list("ancestor_id", "depth"))
+        RoleTargetAncestor.objects.bulk_create(
+            [
+                RoleTargetAncestor(ancestor_id=ancestor_id, descendant=target, depth=depth)
+                for target in targets
+                for ancestor_id, depth in ((target.id, 0), *((id, depth + 1) for id, depth in ancestors))
+            ],
+            batch_size=_BATCH_SIZE,
+        )
+        return targets
 
-        user_id: int
-        type: Role.Type
+    @classmethod
+    def bulk_delete(cls, ids: Collection[int]) -> None:
+        """Delete targets and their subtrees without any per-role signals.
 
-        # Inherited roles first.
-        if parent is not None:
-            for user_id, type in parent.roles.filter(
-                type__in=Role._INHERITED,
-            ).values_list("user_id", "type"):
-                self.roles.get_or_create(
-                    type=type,
+        Deleting a subtree never changes the roles of anything outside of it, so
+        nothing needs to be propagated, and its roles can go in one statement.
+        """
+        with transaction.atomic():
+            subtree = RoleTargetAncestor.objects.filter(ancestor_id__in=ids).values("descendant_id")
+            Role.objects.filter(target_id__in=subtree)._raw_delete(Role.objects.db)
+            cls.objects.filter(id__in=ids).delete()
+
+    def _update_ancestry(self, created: bool) -> int | None:
+        """Keep the RoleTargetAncestor rows in line with this target's parent.
+
+        A newly-created target gets its own rows.  A target whose parent changed
+        has its whole subtree detached from the old ancestors and attached to the
+        new ones.  Deletion is handled by the cascade.
+
+        Returns the previous parent id, which is the current one if nothing moved.
+        """
+        if created:
+            links = [RoleTargetAncestor(ancestor=self, descendant=self, depth=0)]
+            if self.parent_id is not None:
+                links.extend(
+                    RoleTargetAncestor(
+                        ancestor_id=ancestor_id,
+                        descendant=self,
+                        depth=depth + 1,
+                    )
+                    for ancestor_id, depth in RoleTargetAncestor.objects.filter(
+                        descendant_id=self.parent_id,
+                    ).values_list("ancestor_id", "depth")
+                )
+            RoleTargetAncestor.objects.bulk_create(links)
+            return self.parent_id
+
+        previous_parent_id = self.ancestor_links.filter(
+            depth=1,
+        ).values_list("ancestor_id", flat=True).first()
+
+        if previous_parent_id == self.parent_id:
+            return previous_parent_id
+
+        subtree = list(self.descendant_links.values_list("descendant_id", "depth"))
+        subtree_ids = [id for id, _ in subtree]
+
+        new_ancestors: list[tuple[int, int]] = []
+        if self.parent_id is not None:
+            new_ancestors = list(RoleTargetAncestor.objects.filter(
+                descendant_id=self.parent_id,
+            ).values_list("ancestor_id", "depth"))
+
+        # Links from outside the subtree into it are exactly the links whose
+        # ancestor is a strict ancestor of this target.
+        for chunk in _chunked(subtree_ids):
+            RoleTargetAncestor.objects.filter(
+                descendant_id__in=chunk,
+            ).exclude(
+                ancestor_id__in=self.descendant_links.values("descendant_id"),
+            ).delete()
+
+        RoleTargetAncestor.objects.bulk_create(
+            [
+                RoleTargetAncestor(
+                    ancestor_id=ancestor_id,
+                    descendant_id=descendant_id,
+                    depth=ancestor_depth + 1 + descendant_depth,
+                )
+                for ancestor_id, ancestor_depth in new_ancestors
+                for descendant_id, descendant_depth in subtree
+            ],
+            batch_size=_BATCH_SIZE,
+        )
+
+        ancestry_changed.send(
+            sender=RoleTarget,
+            target=self,
+            previous_parent_id=previous_parent_id,
+            descendant_ids=subtree_ids,
+        )
+        return previous_parent_id
+
+    def _rebuild_roles(self) -> None:
+        """Bring the implicit roles of this target and its subtree up to date for all users."""
+        self._propagate_roles()
+
+    def _propagate_roles(self, user_ids: Collection[int | None] | None = None) -> None:
+        """Bring the implicit roles of this subtree up to date for some users.
+
+        This works out which implicit roles the explicit roles in this subtree
+        and the inherited roles of the parent imply, compares that to the
+        implicit roles that are currently materialized, and only inserts and
+        deletes the difference.  If user_ids is None, all users are considered.
+
+        Only roles of users in user_ids are touched, so a change to one user's
+        explicit role only needs that user passed in.
+
+        Inside deferred_role_rebuild(), this only marks the subtree as dirty.
+        With WORLDMASTER_ASYNC_ROLE_PROPAGATION, this enqueues a
+        RolePropagationJob for the worker instead.
+        """
+        if defer_propagation(cast(int, self.id), user_ids):
+            return
+
+        if _async_propagation():
+            RolePropagationJob.objects.create(
+                target=self,
+                user_ids=None if user_ids is None else list(user_ids),
+            )
+            return
+
+        self._propagate_roles_now(user_ids)
+
+    def _propagate_roles_now(self, user_ids: Collection[int | None] | None = None) -> None:
+        """Propagate like _propagate_roles, but always immediately."""
+        levels = self._subtree_levels()
+        ids = [id for level in levels for id, _ in level]
+
+        inherited: dict[int, dict[int | None, set[Role.Type]]] = {}
+        if self.parent_id is not None:
+            parent_roles: dict[int | None, set[Role.Type]] = {}
+            for user_id, mask in _filter_users(
+                EffectiveRole.objects.filter(target_id=self.parent_id),
+                user_ids,
+            ).values_list("user_id", "mask"):
+                types = Role._INHERITED.intersection(EffectiveRole.unpack(mask))
+                if types:
+                    parent_roles[user_id] = set(types)
+            inherited[self.parent_id] = parent_roles
+
+        explicit: dict[int, dict[int | None, set[Role.Type]]] = {}
+        # Currently materialized implicit roles, mapped to their ids.
+        existing: dict[tuple[int, int | None, Role.Type], int] = {}
+        for chunk in _chunked(ids):
+            for id, target_id, user_id, type, is_explicit in _filter_users(
+                Role.objects.filter(target_id__in=chunk),
+                user_ids,
+            ).values_list("id", "target_id", "user_id", "type", "explicit"):
+                if is_explicit:
+                    explicit.setdefault(target_id, {}).setdefault(user_id, set()).add(type)
+                else:
+                    existing[(target_id, user_id, type)] = id
+
+        expected: set[tuple[int, int | None, Role.Type]] = set()
+        masks: dict[tuple[int, int | None], int] = {}
+        for target_id, user_id, types, explicit_types in _effective_roles(levels, explicit, inherited):
+            masks[(target_id, user_id)] = EffectiveRole.pack(types)
+            expected.update((target_id, user_id, Role.Type(type)) for type in types.difference(explicit_types))
+
+        stale = [id for key, id in existing.items() if key not in expected]
+        for chunk in _chunked(stale):
+            Role.objects.filter(id__in=chunk).delete()
+
+        Role.objects.bulk_create(
+            [
+                Role(
+                    target_id=target_id,
                     user_id=user_id,
-                    defaults={
-                        "explicit": False,
-                    },
+                    type=type,
+                    explicit=False,
                 )
+                for target_id, user_id, type in expected
+                if (target_id, user_id, type) not in existing
+            ],
+            batch_size=_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
 
-        # Then sub-roles.
-        # We do these in order, because later ones can depend on prior ones.
-        for key, subtypes in Role._SUB.items():
-            for user_id, in self.roles.filter(
-                type=key,
-            ).values_list(
-                "user_id",
-            ):
-                Role.objects.bulk_create(
-                    [Role(
-                        target=self,
-                        type=subtype,
-                        user_id=user_id,
-                        explicit=False,
-                    ) for subtype in subtypes],
-                    ignore_conflicts=True,
+        EffectiveRole._apply(ids, user_ids, masks)
+
+        roles_changed.send(sender=RoleTarget, target=self)
+
+def _async_propagation() -> bool:
+    """Whether implicit role propagation is handed off to the worker."""
+    return getattr(settings, "WORLDMASTER_ASYNC_ROLE_PROPAGATION", False)
+
+def _stale_ancestors() -> models.Q | None:
+    """Build a RoleTargetAncestor condition for ancestors whose subtree's implicit roles may be stale.
+
+    Those are the ancestors whose propagation is deferred by the current
+    deferred_role_rebuild(), and with WORLDMASTER_ASYNC_ROLE_PROPAGATION, the
+    ones with an unfinished RolePropagationJob.  Returns None if nothing can be
+    stale.
+    """
+    check = models.Q()
+    deferred = deferred_target_ids()
+    if deferred:
+        check |= models.Q(ancestor_id__in=deferred)
+    if _async_propagation():
+        check |= models.Q(ancestor__propagation_job__isnull=False)
+    return check or None
+
+def _stale_target_ids(target_ids: Collection[int]) -> set[int]:
+    """Get the targets whose implicit roles may be stale, in at most one query."""
+    stale = _stale_ancestors()
+    if stale is None:
+        return set()
+    return set(RoleTargetAncestor.objects.filter(
+        stale,
+        descendant_id__in=target_ids,
+    ).values_list("descendant_id", flat=True))
+
+# Number of rows fetched at a time when streaming large tables.
+_STREAM_SIZE = 2000
+
+# Maximum number of parameters to put into a single IN clause or INSERT batch.
+# This stays below SQLite's historical limit of 999 bound variables.
+_BATCH_SIZE = 500
+
+def _chunked(values: Sequence[_T], size: int = _BATCH_SIZE) -> Iterator[Sequence[_T]]:
+    """Split a sequence into chunks of at most size elements."""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def _levels(pairs: Iterable[tuple[int, int | None]]) -> list[list[tuple[int, int | None]]]:
+    """Group (id, parent_id) pairs of whole trees into levels by depth.
+
+    Roots make up the first level, and every other pair is in the level after
+    its parent's.
+    """
+    children: dict[int | None, list[int]] = {}
+    for id, parent_id in pairs:
+        children.setdefault(parent_id, []).append(id)
+
+    levels: list[list[tuple[int, int | None]]] = []
+    level: list[tuple[int, int | None]] = [(id, None) for id in children.pop(None, ())]
+    while level:
+        levels.append(level)
+        level = [
+            (child_id, id)
+            for id, _ in level
+            for child_id in children.pop(id, ())
+        ]
+    return levels
+
+def _filter_users(
+    queryset: _QuerySet,
+    user_ids: Collection[int | None] | None,
+) -> _QuerySet:
+    """Filter a Role or EffectiveRole queryset to the given user ids, which may include None for the anonymous user.
+
+    If user_ids is None, the queryset is returned unfiltered.
+    """
+    if user_ids is None:
+        return queryset
+
+    user_check = models.Q(user_id__in=[id for id in user_ids if id is not None])
+    if None in user_ids:
+        user_check |= models.Q(user__isnull=True)
+    return queryset.filter(user_check)
+
+def _implied_types(types: Iterable[Role.Type]) -> set[Role.Type]:
+    """Return the given role types along with all the sub-roles they imply."""
+    implied = set(types)
+    pending = list(implied)
+    while pending:
+        for subtype in Role._SUB[pending.pop()]:
+            if subtype not in implied:
+                implied.add(subtype)
+                pending.append(subtype)
+    return implied
+
+def _resolve_chain(depths: Mapping[int, Collection[Role.Type]]) -> set[Role.Type]:
+    """Resolve one user's explicit role types at each depth above a target.
+
+    Depth 0 is the target itself.  Returns the effective types on the target.
+    """
+    types: set[Role.Type] = set()
+    for depth in range(max(depths, default=0), -1, -1):
+        types = _implied_types(itertools.chain(
+            depths.get(depth, ()),
+            Role._INHERITED.intersection(types),
+        ))
+    return {Role.Type(type) for type in types}
+
+def _effective_roles(
+    levels: Iterable[Iterable[tuple[int, int | None]]],
+    explicit: Mapping[int, Mapping[int | None, Collection[Role.Type]]],
+    inherited: Mapping[int, Mapping[int | None, Collection[Role.Type]]],
+) -> Iterator[tuple[int, int | None, set[Role.Type], Collection[Role.Type]]]:
+    """Compute the effective roles implied by explicit and inherited roles.
+
+    levels are (id, parent_id) pairs grouped so that parents always come in an
+    earlier level than their children.  explicit maps target ids to the explicit
+    roles of each user on that target.  inherited maps the ids of parents that
+    are outside of levels to the roles of each user on them.
+
+    This yields (target_id, user_id, effective types, explicit types) for every
+    user that has any role on a target.  Only the previous level's effective
+    roles are kept in memory at any time.
+    """
+    previous: Mapping[int, Mapping[int | None, Collection[Role.Type]]] = inherited
+
+    for level in levels:
+        current: dict[int, dict[int | None, set[Role.Type]]] = {}
+        for id, parent_id in level:
+            target_explicit = explicit.get(id, {})
+            parent_roles = previous.get(parent_id, {}) if parent_id is not None else {}
+
+            effective: dict[int | None, set[Role.Type]] = {}
+            for user_id in target_explicit.keys() | parent_roles.keys():
+                explicit_types = target_explicit.get(user_id, ())
+                types = _implied_types(
+                    itertools.chain(
+                        explicit_types,
+                        Role._INHERITED.intersection(parent_roles.get(user_id, ())),
+                    ),
                 )
+                if types:
+                    effective[user_id] = types
+                    yield id, user_id, types, explicit_types
 
-        for child in self.children.all():
-            child._setup_implicit_roles()
+            current[id] = effective
+        previous = current
 
 class Role(models.Model):
     """A role, giving a user specific privileges on a specific target."""
 
     __slots__ = (
-        "_previous_target",
+        "_previous_target_id",
+        "_previous_user_id",
     )
 
-    _previous_target: None | RoleTarget
+    # The target and user as loaded or last saved, or None for a new role.
+    _previous_target_id: int | None
+    _previous_user_id: int | None
 
     class Type(models.IntegerChoices):
         # Admin permission on the item.  This is not called "owner", because
@@ -194,7 +644,9 @@ class Role(models.Model):
     )
     user: models.ForeignKey[User, User] = models.ForeignKey(
         User,
-        on_delete=models.CASCADE,
+        # Deleted in bulk by remove_user_roles, from a User pre_delete receiver,
+        # rather than one by one with their signals.
+        on_delete=models.DO_NOTHING,
         help_text="The user with this role.  If NULL, allows anonymous access to the role.",
         blank=True,
         null=True,
@@ -233,6 +685,12 @@ class Role(models.Model):
             ),
         ]
         indexes = [
+            # The unique constraints are partial, so they can't serve lookups by
+            # target alone.
+            models.Index(
+                fields=("target", "explicit"),
+                name="role_target_explicit",
+            ),
             models.Index(
                 fields=("user", "type"),
                 name="role_user_type",
@@ -250,12 +708,50 @@ class Role(models.Model):
     @classmethod
     def rebuild(cls: type[Self]) -> None:
         """Rebuild all implicit roles.
+
+        The RoleTarget parent map and the explicit roles are each loaded in a
+        single streamed query, the implicit roles are computed level by level
+        in memory, and then written back with batched inserts, along with the
+        EffectiveRole masks.
         """
-        cls.objects.filter(explicit=False).delete()
-        # This is a naive implementation.  We could probably do better by
-        # Sharing some implementation between the signals and this.
-        for role in cls.objects.filter(explicit=True).all():
-            role.save()
+        levels = _levels(
+            RoleTarget.objects.values_list("id", "parent_id").iterator(chunk_size=_STREAM_SIZE),
+        )
+
+        explicit: dict[int, dict[int | None, set[Role.Type]]] = {}
+        for target_id, user_id, type in cls.objects.filter(
+            explicit=True,
+        ).values_list("target_id", "user_id", "type").iterator(chunk_size=_STREAM_SIZE):
+            explicit.setdefault(target_id, {}).setdefault(user_id, set()).add(type)
+
+        with transaction.atomic():
+            # Implicit roles have no signal behavior, so there is no need to
+            # have the collector load and delete them one by one.
+            cls.objects.filter(explicit=False)._raw_delete(cls.objects.db)
+            EffectiveRole.objects.all()._raw_delete(EffectiveRole.objects.db)
+
+            effective = _effective_roles(levels, explicit, {})
+            while batch := list(itertools.islice(effective, _BATCH_SIZE)):
+                cls.objects.bulk_create([
+                    cls(
+                        target_id=target_id,
+                        user_id=user_id,
+                        type=type,
+                        explicit=False,
+                    )
+                    for target_id, user_id, types, explicit_types in batch
+                    for type in types.difference(explicit_types)
+                ])
+                EffectiveRole.objects.bulk_create([
+                    EffectiveRole(
+                        target_id=target_id,
+                        user_id=user_id,
+                        mask=EffectiveRole.pack(types),
+                    )
+                    for target_id, user_id, types, _ in batch
+                ])
+
+        roles_changed.send(sender=cls, target=None)
 
     def clean(self):
         if self.id is not None and not self.explicit:
@@ -268,36 +764,504 @@ class Role(models.Model):
     __repr__ = __str__
 
 
+class RoleTargetAncestor(models.Model):
+    """A closure table row, linking a RoleTarget to one of its ancestors.
+
+    Every RoleTarget is also linked to itself with a depth of 0, so that
+    subtree and ancestor lookups are each a single indexed join.
+    """
+
+    id: int | None
+
+    ancestor: models.ForeignKey[RoleTarget, RoleTarget] = models.ForeignKey(
+        RoleTarget,
+        on_delete=models.CASCADE,
+        help_text="The ancestor, or the descendant itself when depth is 0",
+        related_name="descendant_links",
+        related_query_name="descendant_link",
+        # Covered by the unique constraint.
+        db_index=False,
+    )
+
+    descendant: models.ForeignKey[RoleTarget, RoleTarget] = models.ForeignKey(
+        RoleTarget,
+        on_delete=models.CASCADE,
+        help_text="The descendant",
+        related_name="ancestor_links",
+        related_query_name="ancestor_link",
+        # Covered by the multicolumn index.
+        db_index=False,
+    )
+
+    depth: models.PositiveSmallIntegerField[int, int] = models.PositiveSmallIntegerField(
+        help_text="The number of parent steps from the descendant to the ancestor",
+        blank=False,
+        null=False,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("ancestor", "descendant"),
+                name="unique_role_target_ancestor_descendant",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=("descendant", "depth"),
+                name="role_target_descendant_depth",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"<RoleTargetAncestor: {self.ancestor_id} -> {self.descendant_id} ({self.depth})>"
+
+    __repr__ = __str__
+
+    @classmethod
+    def rebuild(cls: type[Self]) -> None:
+        """Rebuild the whole ancestry table from the RoleTarget parents."""
+        levels = _levels(
+            RoleTarget.objects.values_list("id", "parent_id").iterator(chunk_size=_STREAM_SIZE),
+        )
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+
+            # Ancestors of the previous level, from nearest to the root.
+            previous: dict[int, list[int]] = {}
+            for level in levels:
+                current: dict[int, list[int]] = {}
+                for id, parent_id in level:
+                    ancestors = [id]
+                    if parent_id is not None:
+                        ancestors.extend(previous[parent_id])
+                    current[id] = ancestors
+                cls.objects.bulk_create(
+                    [
+                        cls(ancestor_id=ancestor_id, descendant_id=id, depth=depth)
+                        for id, ancestors in current.items()
+                        for depth, ancestor_id in enumerate(ancestors)
+                    ],
+                    batch_size=_BATCH_SIZE,
+                )
+                previous = current
+
+class EffectiveRole(models.Model):
+    """All the role types a user effectively has on a target, as one bitmask.
+
+    Bit 1 << type is set for every Role.Type the user has there, explicitly or
+    implicitly.  This is maintained from the explicit roles alongside the
+    implicit Role rows, and is what role checks and propagation read.
+
+    The implicit Role rows are still written because they are part of Role's
+    interface: target.roles lists every role a user has on a target, and an
+    implicit role is made explicit by setting explicit on its row.  Nothing
+    reads them to decide permissions, and verify_roles checks both tables.
+    """
+
+    id: int | None
+
+    target: models.ForeignKey[RoleTarget, RoleTarget] = models.ForeignKey(
+        RoleTarget,
+        on_delete=models.CASCADE,
+        help_text="The target for these roles",
+        related_name="effective_roles",
+        related_query_name="effective_role",
+        # Covered by the Unique constraints.
+        db_index=False,
+    )
+    user: models.ForeignKey[User, User] = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        help_text="The user with these roles.  If NULL, these are the anonymous roles.",
+        blank=True,
+        null=True,
+        related_name="effective_roles",
+        related_query_name="effective_role",
+    )
+
+    mask: models.PositiveSmallIntegerField[int, int] = models.PositiveSmallIntegerField(
+        help_text="A bitmask of 1 << type for every effective role type",
+        blank=False,
+        null=False,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("target", "user"),
+                name="unique_effective_role_target_user",
+                condition=models.Q(user__isnull=False),
+            ),
+            models.UniqueConstraint(
+                fields=("target",),
+                name="unique_effective_role_target_anonymous",
+                condition=models.Q(user__isnull=True),
+            ),
+        ]
+        indexes = [
+            # The unique constraints are partial, so they can't serve lookups by
+            # target alone.
+            models.Index(
+                fields=("target",),
+                name="effective_role_target",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        types = ", ".join(type.label for type in sorted(self.types))
+        return f"<EffectiveRole: {self.user_id} [{types}] {self.target_id}>"
+
+    __repr__ = __str__
+
+    @property
+    def types(self) -> frozenset[Role.Type]:
+        return self.unpack(self.mask)
+
+    @staticmethod
+    def pack(types: Iterable[int]) -> int:
+        """Pack role types into a mask."""
+        mask = 0
+        for type in types:
+            mask |= 1 << type
+        return mask
+
+    @staticmethod
+    def unpack(mask: int) -> frozenset[Role.Type]:
+        """Unpack a mask into role types."""
+        return frozenset(type for type in Role.Type if mask & (1 << type))
+
+    @classmethod
+    def _apply(
+        cls: type[Self],
+        target_ids: Sequence[int],
+        user_ids: Collection[int | None] | None,
+        masks: Mapping[tuple[int, int | None], int],
+    ) -> None:
+        """Bring the masks of some users on some targets in line with masks.
+
+        Rows missing from masks are deleted, and only changed rows are written.
+        """
+        existing: dict[tuple[int, int | None], cls] = {}
+        for chunk in _chunked(target_ids):
+            for effective_role in _filter_users(cls.objects.filter(target_id__in=chunk), user_ids):
+                existing[(effective_role.target_id, effective_role.user_id)] = effective_role
+
+        stale = [effective_role.id for key, effective_role in existing.items() if key not in masks]
+        for chunk in _chunked(stale):
+            cls.objects.filter(id__in=chunk).delete()
+
+        changed = []
+        for key, mask in masks.items():
+            effective_role = existing.get(key)
+            if effective_role is not None and effective_role.mask != mask:
+                effective_role.mask = mask
+                changed.append(effective_role)
+        cls.objects.bulk_update(changed, ("mask",), batch_size=_BATCH_SIZE)
+
+        cls.objects.bulk_create(
+            [
+                cls(target_id=target_id, user_id=user_id, mask=mask)
+                for (target_id, user_id), mask in masks.items()
+                if (target_id, user_id) not in existing
+            ],
+            batch_size=_BATCH_SIZE,
+        )
+
+class RolePropagationJob(models.Model):
+    """A queued implicit role propagation, run by the worker management command.
+
+    Jobs are deleted once they complete.  While one is pending on a target or
+    any of its ancestors, role checks on that target fall back to the explicit
+    roles.
+    """
+
+    class State(models.IntegerChoices):
+        PENDING = 1, _("Pending")
+        RUNNING = 2, _("Running")
+        FAILED = 3, _("Failed")
+
+    id: int | None
+
+    target: models.ForeignKey[RoleTarget, RoleTarget] = models.ForeignKey(
+        RoleTarget,
+        on_delete=models.CASCADE,
+        help_text="The root of the subtree to propagate",
+        related_name="propagation_jobs",
+        related_query_name="propagation_job",
+    )
+
+    user_ids: models.JSONField = models.JSONField(
+        help_text="The ids of the users to propagate, with null for the anonymous user.  If null, all users.",
+        blank=True,
+        null=True,
+        default=None,
+    )
+
+    state: models.PositiveSmallIntegerField[State, State] = models.PositiveSmallIntegerField(
+        choices=State.choices,
+        default=State.PENDING,
+        blank=False,
+        null=False,
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    claimed_at = models.DateTimeField(
+        help_text="When a worker last claimed this job",
+        blank=True,
+        null=True,
+        default=None,
+    )
+
+    claimed_by = models.CharField(
+        help_text="The name of the worker that last claimed this job",
+        max_length=256,
+        blank=True,
+        default="",
+    )
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    error = models.TextField(
+        help_text="The error from the last failed attempt",
+        blank=True,
+        default="",
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=("state", "id"),
+                name="role_propagation_job_state",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"<RolePropagationJob: {self.target_id} {RolePropagationJob.State(self.state).label}>"
+
+    __repr__ = __str__
+
+    @classmethod
+    def claim(cls: type[Self], worker: str, lease: timedelta) -> Self | None:
+        """Claim the oldest runnable job for a worker.
+
+        A job is runnable if it is pending, or if it has been running for longer
+        than the lease, because its worker probably died.  The claim is a single
+        conditional UPDATE, so two workers can never claim the same job, even on
+        SQLite.
+        """
+        while True:
+            runnable = models.Q(state=cls.State.PENDING) | models.Q(
+                state=cls.State.RUNNING,
+                claimed_at__lt=timezone.now() - lease,
+            )
+            id = cls.objects.filter(runnable).order_by("id").values_list("id", flat=True).first()
+            if id is None:
+                return None
+
+            if cls.objects.filter(runnable, id=id).update(
+                state=cls.State.RUNNING,
+                claimed_at=timezone.now(),
+                claimed_by=worker,
+                attempts=models.F("attempts") + 1,
+            ):
+                return cls.objects.select_related("target").get(id=id)
+
+    def run(self, max_attempts: int) -> bool:
+        """Run a claimed job, and delete it if it succeeds.
+
+        A failed job goes back to pending, unless it has used up max_attempts,
+        in which case it is marked as failed.  Returns True on success.
+        """
+        try:
+            with transaction.atomic():
+                self.target._propagate_roles_now(self.user_ids)
+                self.delete()
+        except Exception as e:
+            self.state = self.State.FAILED if self.attempts >= max_attempts else self.State.PENDING
+            self.error = repr(e)
+            self.save(update_fields=("state", "error"))
+            return False
+        return True
+
+class RoleRebuildCheckpoint(models.Model):
+    """A root whose roles have been rebuilt by a rebuild_roles run.
+
+    A run that is interrupted leaves its checkpoints behind, so running it again
+    skips the roots that were already finished.  They are deleted when the run
+    completes.
+    """
+
+    id: int | None
+
+    run = models.CharField(
+        help_text="The name of the rebuild_roles run",
+        max_length=64,
+    )
+
+    target: models.ForeignKey[RoleTarget, RoleTarget] = models.ForeignKey(
+        RoleTarget,
+        on_delete=models.CASCADE,
+        help_text="The root whose roles were rebuilt",
+        related_name="rebuild_checkpoints",
+        related_query_name="rebuild_checkpoint",
+        # Covered by the Unique constraint.
+        db_index=False,
+    )
+
+    completed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("target", "run"),
+                name="unique_role_rebuild_checkpoint_target_run",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"<RoleRebuildCheckpoint: {self.run} {self.target_id}>"
+
+    __repr__ = __str__
+
 Model = TypeVar("Model", bound="RoleTargetBase")
 
-class RoleTargetManager(models.Manager, Generic[Model]):
+def _has_role(user: AbstractUser | AnonymousUser, type: Role.Type) -> models.Q:
+    """Build a condition that the row's role_target has the role for the user or the NULL user.
+
+    Each user is checked with its own correlated EXISTS against the one
+    EffectiveRole row that a partial unique index finds, so a row never matches
+    more than once.
+
+    Rows whose role_target's implicit roles may be stale, because of deferred
+    or pending propagation, are instead checked against the explicit roles on
+    their ancestors, like RoleTarget.roles_for does.
+    """
+    user_check = models.Q(user=None)
+    if user.is_authenticated:
+        user_check |= models.Q(user=user)
+
+    checks = models.Q()
+    for check in user_check.children:
+        checks |= models.Q(models.Exists(EffectiveRole.objects.filter(
+            models.Q(check),
+            target=models.OuterRef("role_target"),
+        ).alias(
+            has_role=models.F("mask").bitand(1 << type),
+        ).filter(
+            has_role__gt=0,
+        )))
+
+    stale = _stale_ancestors()
+    if stale is None:
+        return checks
+
+    pending = models.Exists(RoleTargetAncestor.objects.filter(
+        stale,
+        descendant=models.OuterRef("role_target"),
+    ))
+    # The explicit types that give the role on their own target, and the ones
+    # that pass it down from an ancestor.
+    granting = [other for other in Role.Type if type in _resolve_chain({0: (other,)})]
+    inheriting = [other for other in Role.Type if type in _resolve_chain({1: (other,)})]
+    explicit_user_check = models.Q(ancestor__role__user=None)
+    if user.is_authenticated:
+        explicit_user_check |= models.Q(ancestor__role__user=user)
+    explicit = models.Exists(RoleTargetAncestor.objects.filter(
+        explicit_user_check,
+        models.Q(depth=0, ancestor__role__type__in=granting) | models.Q(ancestor__role__type__in=inheriting),
+        descendant=models.OuterRef("role_target"),
+        ancestor__role__explicit=True,
+    ))
+    return (~models.Q(pending) & checks) | (models.Q(pending) & models.Q(explicit))
+
+class RoleTargetQuerySet(models.QuerySet[Model], Generic[Model]):
     def with_role(
-        self: RoleTargetManager[Model],
+        self: RoleTargetQuerySet[Model],
         user: AbstractUser | AnonymousUser,
         type: Role.Type,
-    ) -> models.QuerySet[Model]:
+    ) -> RoleTargetQuerySet[Model]:
         if user.is_superuser:
             return self.all()
 
-        user_check = models.Q(role_target__role__user=None)
-
-        if user.is_authenticated:
-            user_check |= models.Q(role_target__role__user=user)
+        return self.filter(_has_role(user, type))
 
-        return self.filter(
-            user_check,
-            role_target__role__type=type,
-        )
+    def under(self: RoleTargetQuerySet[Model], target: RoleTarget) -> RoleTargetQuerySet[Model]:
+        """Get the objects whose role target is target or anywhere in its subtree."""
+        return self.filter(role_target__ancestor_link__ancestor=target)
 
-    def mastered_by(self: RoleTargetManager[Model], user: AbstractUser | AnonymousUser) -> models.QuerySet[Model]:
+    def mastered_by(self: RoleTargetQuerySet[Model], user: AbstractUser | AnonymousUser) -> RoleTargetQuerySet[Model]:
         return self.with_role(user, Role.Type.MASTER)
 
-    def editable_by(self: RoleTargetManager[Model], user: AbstractUser | AnonymousUser) -> models.QuerySet[Model]:
+    def editable_by(self: RoleTargetQuerySet[Model], user: AbstractUser | AnonymousUser) -> RoleTargetQuerySet[Model]:
         return self.with_role(user, Role.Type.EDITOR)
 
-    def visible_to(self: RoleTargetManager[Model], user: AbstractUser | AnonymousUser) -> models.QuerySet[Model]:
+    def visible_to(self: RoleTargetQuerySet[Model], user: AbstractUser | AnonymousUser) -> RoleTargetQuerySet[Model]:
         return self.with_role(user, Role.Type.VIEWER)
 
+    def annotate_roles(
+        self: RoleTargetQuerySet[Model],
+        user: AbstractUser | AnonymousUser,
+        *types: Role.Type,
+    ) -> RoleTargetQuerySet[Model]:
+        """Annotate is_master, is_editor, and is_viewer booleans for the user.
+
+        This lets permission-dependent pages render without a query per row.
+        If types are given, only their booleans are annotated, which saves a
+        subquery per type left out.
+        """
+        names = {
+            Role.Type.MASTER: "is_master",
+            Role.Type.EDITOR: "is_editor",
+            Role.Type.VIEWER: "is_viewer",
+        }
+        if types:
+            names = {type: names[type] for type in types}
+
+        if user.is_superuser:
+            return self.annotate(**{
+                name: models.Value(True, output_field=models.BooleanField())
+                for name in names.values()
+            })
+
+        return self.annotate(**{
+            name: models.ExpressionWrapper(_has_role(user, type), output_field=models.BooleanField())
+            for type, name in names.items()
+        })
+
+class RoleTargetManager(models.Manager, Generic[Model]):
+    def get_queryset(self: RoleTargetManager[Model]) -> RoleTargetQuerySet[Model]:
+        return RoleTargetQuerySet(self.model, using=self._db)
+
+    def with_role(
+        self: RoleTargetManager[Model],
+        user: AbstractUser | AnonymousUser,
+        type: Role.Type,
+    ) -> RoleTargetQuerySet[Model]:
+        return self.get_queryset().with_role(user, type)
+
+    def under(self: RoleTargetManager[Model], target: RoleTarget) -> RoleTargetQuerySet[Model]:
+        """Get the objects whose role target is target or anywhere in its subtree."""
+        return self.get_queryset().under(target)
+
+    def mastered_by(self: RoleTargetManager[Model], user: AbstractUser | AnonymousUser) -> RoleTargetQuerySet[Model]:
+        return self.get_queryset().mastered_by(user)
+
+    def editable_by(self: RoleTargetManager[Model], user: AbstractUser | AnonymousUser) -> RoleTargetQuerySet[Model]:
+        return self.get_queryset().editable_by(user)
+
+    def visible_to(self: RoleTargetManager[Model], user: AbstractUser | AnonymousUser) -> RoleTargetQuerySet[Model]:
+        return self.get_queryset().visible_to(user)
+
+    def annotate_roles(
+        self: RoleTargetManager[Model],
+        user: AbstractUser | AnonymousUser,
+        *types: Role.Type,
+    ) -> RoleTargetQuerySet[Model]:
+        return self.get_queryset().annotate_roles(user, *types)
+
 class RoleTargetBase(models.Model):
     """An abstract base that gives a role_target field to a model."""
 
@@ -311,5 +1275,7 @@ class RoleTargetBase(models.Model):
         related_name="+",
     )
 
+    role_target_id: int
+
     class Meta:
         abstract = True
@@ -0,0 +1,70 @@
+"""Bulk removal of all of a user's roles.
+
+A user's implicit roles only ever come from their own explicit roles, so when
+all of them go at once there is nothing to propagate: every Role and
+EffectiveRole row of the user can be deleted with one statement each, and only
+the caches of the affected trees need to be told.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from django.db import transaction
+
+from .models import EffectiveRole, Role, RoleTarget, roles_changed
+from .permission_cache import root_ids
+
+if TYPE_CHECKING:
+    from django.contrib.auth.models import AbstractUser
+
+class RemovedRoles:
+    """What remove_user_roles deleted."""
+
+    __slots__ = (
+        "effective",
+        "explicit",
+        "implicit",
+        "root_ids",
+    )
+
+    explicit: int
+    implicit: int
+    effective: int
+    # The roots of the trees the user had roles in.
+    root_ids: set[int]
+
+    def __init__(self, explicit: int, implicit: int, effective: int, root_ids: set[int]) -> None:
+        """Record the counts of deleted rows and the affected roots."""
+        self.explicit = explicit
+        self.implicit = implicit
+        self.effective = effective
+        self.root_ids = root_ids
+
+    def __str__(self) -> str:
+        return (
+            f"{self.explicit} explicit roles, {self.implicit} implicit roles and"
+            f" {self.effective} effective roles in {len(self.root_ids)} trees"
+        )
+
+def remove_user_roles(user: AbstractUser) -> RemovedRoles:
+    """Delete every role of a user in bulk.
+
+    No per-role signals are sent and nothing is propagated.  roles_changed is
+    sent once for the root of each affected tree.
+    """
+    with transaction.atomic():
+        roles = Role.objects.filter(user=user)
+        target_ids = set(roles.filter(explicit=True).values_list("target_id", flat=True))
+
+        # Nothing depends on Role or EffectiveRole rows, so the collector and
+        # its per-row signals can be skipped.
+        implicit = roles.filter(explicit=False)._raw_delete(Role.objects.db)
+        explicit = roles._raw_delete(Role.objects.db)
+        effective_roles = EffectiveRole.objects.filter(user=user)
+        effective = effective_roles._raw_delete(EffectiveRole.objects.db)
+
+        roots = set(root_ids(target_ids).values())
+        for root in RoleTarget.objects.filter(id__in=roots):
+            roles_changed.send(sender=Role, target=root)
+
+    return RemovedRoles(explicit, implicit, effective, roots)
@@ -0,0 +1,218 @@
+"""Cross-request caching of effective roles on Django's cache framework.
+
+Entries are keyed by the user, the target, the root of the target's tree, and a
+generation counter for that root.  Whenever roles change anywhere under a root,
+its generation is bumped, so every entry for that tree is skipped from then on
+and eventually expires.  Other roots keep their generation, so a role change in
+one world never forces recomputation for users of other worlds.
+
+Roots and generations are kept in the cache too, so a cached answer costs no
+queries at all.  Generations are bumped with the cache's incr() as soon as
+roles change, and again when the transaction commits, in case another process
+cached the old roles under the new generation before the change was visible to
+it.
+
+That only holds when every process that changes or checks roles uses the same
+cache, and when its incr() is atomic, so two bumps never end up on the same
+generation.  Multi-process deployments must point WORLDMASTER_ROLE_CACHE at a
+shared backend like Memcached or Redis.  With a per-process cache like the
+default LocMemCache, other processes, like the worker or other web workers,
+keep answering from their own entries until WORLDMASTER_ROLE_CACHE_TIMEOUT
+expires them.
+"""
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Any
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models, transaction
+from django.dispatch import receiver
+
+from .models import EffectiveRole, Role, RoleTargetAncestor, ancestry_changed, roles_changed
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from django.contrib.auth.models import AbstractUser, AnonymousUser
+    from django.core.cache.backends.base import BaseCache
+
+_PREFIX = "worldmaster:roles"
+
+# Bumped when roles may have changed anywhere, like after Role.rebuild().
+_EVERY_TREE_GENERATION_KEY = f"{_PREFIX}:generation"
+
+def _cache() -> BaseCache:
+    return caches[getattr(settings, "WORLDMASTER_ROLE_CACHE", "default")]
+
+def _timeout() -> int | None:
+    return getattr(settings, "WORLDMASTER_ROLE_CACHE_TIMEOUT", 60 * 60)
+
+def _root_key(target_id: int) -> str:
+    return f"{_PREFIX}:root:{target_id}"
+
+def _generation_key(root_id: int) -> str:
+    return f"{_PREFIX}:generation:{root_id}"
+
+def _new_generation() -> int:
+    # Start from the clock rather than 0, so that a generation that was evicted
+    # and recreated can't collide with one whose entries are still cached.
+    return time.time_ns()
+
+def root_ids(target_ids: Iterable[int]) -> dict[int, int]:
+    """Map each target id to the id of the root of its tree.
+
+    Roots are cached, and the uncached ones are loaded in a single query.
+    Targets that are missing from the ancestry table count as their own root.
+    """
+    cache = _cache()
+    target_ids = set(target_ids)
+    cached: dict[str, int] = cache.get_many([_root_key(id) for id in target_ids])
+    roots = {id: cached[_root_key(id)] for id in target_ids if _root_key(id) in cached}
+
+    missing = target_ids - roots.keys()
+    if missing:
+        loaded = dict(RoleTargetAncestor.objects.filter(
+            descendant_id__in=missing,
+            ancestor__parent=None,
+        ).values_list("descendant_id", "ancestor_id"))
+        cache.set_many({_root_key(id): root_id for id, root_id in loaded.items()}, _timeout())
+        roots.update(loaded)
+        roots.update((id, id) for id in missing - loaded.keys())
+
+    return roots
+
+def _generations(keys: Iterable[str]) -> dict[str, int]:
+    cache = _cache()
+    keys = set(keys)
+    generations = cache.get_many(keys)
+
+    for key in keys - generations.keys():
+        # add() leaves a generation alone if another process just created it.
+        generation = _new_generation()
+        cache.add(key, generation, None)
+        generations[key] = cache.get(key, generation)
+
+    return generations
+
+def tree_generations(target_ids: Iterable[int]) -> dict[int, tuple[int, tuple[int, int]]]:
+    """Map each target id to its root id and a token for the root's tree.
+
+    The token changes whenever roles may have changed in the tree.  This costs
+    no queries once the roots of the targets are cached.
+    """
+    roots = root_ids(target_ids)
+    generations = _generations([
+        _EVERY_TREE_GENERATION_KEY,
+        *(_generation_key(root_id) for root_id in roots.values()),
+    ])
+    every_tree = generations[_EVERY_TREE_GENERATION_KEY]
+    return {
+        id: (root_id, (every_tree, generations[_generation_key(root_id)]))
+        for id, root_id in roots.items()
+    }
+
+def _bump_one(cache: BaseCache, key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The generation was evicted.  If another process recreated it in the
+        # meantime, bump that one instead.
+        if not cache.add(key, _new_generation(), None):
+            cache.incr(key)
+
+def _bump(keys: Iterable[str]) -> None:
+    cache = _cache()
+    for key in set(keys):
+        _bump_one(cache, key)
+
+def bump_generation(target_ids: Iterable[int] | None) -> None:
+    """Invalidate cached roles for the trees of the given targets.
+
+    If target_ids is None, cached roles are invalidated everywhere.
+    """
+    if target_ids is None:
+        _bump((_EVERY_TREE_GENERATION_KEY,))
+    else:
+        _bump(_generation_key(root_id) for root_id in root_ids(target_ids).values())
+
+def role_types(
+    user: AbstractUser | AnonymousUser,
+    target_ids: Iterable[int],
+) -> dict[int, frozenset[Role.Type]]:
+    """Get the role types the user or the NULL user has on each target.
+
+    Cached answers are used where possible, and everything else is loaded in
+    one query and cached.
+    """
+    cache = _cache()
+    user_id = user.id if user.is_authenticated else None
+    # The generations are read before the roles, so that roles are never
+    # cached under a generation newer than they are.
+    generations = tree_generations(target_ids)
+
+    keys = {
+        f"{_PREFIX}:types:{every_tree}:{root_id}:{generation}:{user_id}:{id}": id
+        for id, (root_id, (every_tree, generation)) in generations.items()
+    }
+    types = {
+        keys[key]: frozenset(Role.Type(type) for type in cached)
+        for key, cached in cache.get_many(keys).items()
+    }
+
+    missing = generations.keys() - types.keys()
+    if missing:
+        user_check = models.Q(user=None)
+        if user_id is not None:
+            user_check |= models.Q(user_id=user_id)
+
+        masks: dict[int, int] = dict.fromkeys(missing, 0)
+        for target_id, mask in EffectiveRole.objects.filter(
+            user_check,
+            target_id__in=missing,
+        ).values_list("target_id", "mask"):
+            masks[target_id] |= mask
+        loaded = {id: EffectiveRole.unpack(mask) for id, mask in masks.items()}
+
+        cache.set_many(
+            {
+                key: sorted(loaded[id])
+                for key, id in keys.items()
+                if id in loaded
+            },
+            _timeout(),
+        )
+        types.update(loaded)
+
+    return types
+
+@receiver(roles_changed)
+def bump_changed_generation(sender: Any, target: Any, **kwargs: Any) -> None:
+    """Bump the generation of the tree whose roles changed, now and on commit."""
+    target_ids = None if target is None else (target.id,)
+    bump_generation(target_ids)
+    transaction.on_commit(lambda: bump_generation(target_ids))
+
+@receiver(ancestry_changed)
+def forget_moved_roots(
+    sender: Any,
+    target: Any,
+    previous_parent_id: int | None,
+    descendant_ids: list[int],
+    **kwargs: Any,
+) -> None:
+    """Forget the cached roots of a moved subtree, and bump its old and new tree.
+
+    The new tree is bumped too, because its roles are only propagated when some
+    user's inherited roles differ between the two.  All of this is done again
+    on commit, in case another process cached the old roots in the meantime.
+    """
+    old_root_id = target.id if previous_parent_id is None else root_ids((previous_parent_id,))[previous_parent_id]
+
+    def forget() -> None:
+        _cache().delete_many([_root_key(id) for id in descendant_ids])
+        _bump((_generation_key(old_root_id), _generation_key(root_ids((target.id,))[target.id])))
+
+    forget()
+    transaction.on_commit(forget)
@@ -4,28 +4,57 @@ from contextlib import suppress
 from typing import Any
 
 from django.db import models
-from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 
-from .models import Role, RoleTarget, RoleTargetBase
+from .deferred import defer_role_target_deletion
+from .models import Role, RoleTarget, RoleTargetAncestor, RoleTargetBase, User
+from .offboarding import remove_user_roles
 
 
-def _set_previous_target(role: Role) -> None:
-    """Set _previous_target if explicit."""
+def _rebuild_role_targets(role: Role) -> None:
+    """Propagate the role's user on its target, and on its previous target if explicit.
+
+    Only the implicit roles of the affected users are recalculated.
+    """
     if role.explicit:
-        if role.id is None:
-            role._previous_target = None
+        previous_target_id = role._previous_target_id
+        previous_user_id = role._previous_user_id
+        if previous_target_id == role.target_id:
+            role.target._propagate_roles({previous_user_id, role.user_id})
         else:
-            role._previous_target = Role.objects.get(id=role.id).target
+            if previous_target_id is not None:
+                previous_target = RoleTarget.objects.filter(id=previous_target_id).first()
+                if previous_target is not None:
+                    previous_target._propagate_roles((previous_user_id,))
+            role.target._propagate_roles((role.user_id,))
 
-def _rebuild_role_targets(role: Role) -> None:
-    """Rebuild target and _previous_target if explicit."""
-    if role.explicit:
-        previous_target = role._previous_target
-        target = role.target
-        if previous_target is not None and previous_target != target:
-            previous_target._rebuild_roles()
-        target._rebuild_roles()
+@receiver(post_init, sender=RoleTarget)
+def role_target_post_init(
+    sender: type[models.Model],
+    instance: RoleTarget,
+    **kwargs: Any,
+) -> None:
+    """Remember the parent, so that saves can tell whether it changed."""
+    instance._loaded_parent_id = instance.__dict__.get("parent_id")
+
+@receiver(pre_save, sender=RoleTarget)
+def role_target_pre_save(
+    sender: type[models.Model],
+    instance: RoleTarget,
+    raw: bool,
+    **kwargs: Any,
+) -> None:
+    """Refuse to move a target under its own subtree, before anything is written."""
+    if (
+        not raw
+        and instance.pk is not None
+        and instance.parent_id is not None
+        and instance.parent_id != instance._loaded_parent_id
+        and RoleTargetAncestor.objects.filter(ancestor=instance, descendant_id=instance.parent_id).exists()
+    ):
+        msg = "A RoleTarget may not be moved under its own subtree"
+        raise ValueError(msg)
 
 @receiver(post_save, sender=RoleTarget)
 def role_target_post_save(
@@ -35,41 +64,40 @@ def role_target_post_save(
     created: bool,
     **kwargs: Any,
 ) -> None:
-    """Inherit roles
+    """Maintain the ancestry table and inherit roles.
 
-    This is applied when this role is saved, because the parent may have been
-    changed.
+    New targets inherit the roles of their parent.  Saves that change the
+    parent move the subtree and recalculate the users whose inherited roles
+    differ.  Other saves do nothing.
     """
-    if not raw:
+    if raw:
+        return
+
+    if created:
+        instance._update_ancestry(created)
         instance._rebuild_roles()
+    elif instance.parent_id != instance._loaded_parent_id:
+        previous_parent_id = instance._update_ancestry(created)
+        if previous_parent_id != instance.parent_id:
+            instance._parent_changed(previous_parent_id)
+    instance._loaded_parent_id = instance.parent_id
 
-@receiver(pre_save, sender=Role)
-def role_pre_save(
+@receiver(post_init, sender=Role)
+def role_post_init(
     sender: type[models.Model],
     instance: Role,
-    raw: bool,
     **kwargs: Any,
 ) -> None:
-    """Delete all implicit roles for the target so they can be recalculated, unless this is a new record.
-    """
-    # This could be redundant or wasteful, but it's the easiest way to ensure
-    # that we always get consistent roles after a role is moved, deleted, or its
-    # type is changed.
-    # We could do some logic that crawls implicit roles and only deletes ones
-    # that are necessary, but it's not a problem right now, especially for a
-    # read-heavy setup.
-    if not raw:
-        _set_previous_target(instance)
+    """Remember the target and user, so they can be recalculated after a move.
 
-@receiver(pre_delete, sender=Role)
-def role_pre_delete(
-    sender: type[models.Model],
-    instance: Role,
-    **kwargs: Any,
-) -> None:
-    """Delete all implicit roles for the target so they can be recalculated.
+    This avoids reloading the role before every save or delete.
     """
-    _set_previous_target(instance)
+    if instance.pk is None:
+        instance._previous_target_id = None
+        instance._previous_user_id = None
+    else:
+        instance._previous_target_id = instance.__dict__.get("target_id")
+        instance._previous_user_id = instance.__dict__.get("user_id")
 
 @receiver(post_save, sender=Role)
 def role_post_save(
@@ -79,10 +107,11 @@ def role_post_save(
     created: bool,
     **kwargs: Any,
 ) -> None:
-    """Rebuild roles for the target and the previous target.
-    """
+    """Rebuild roles for the target and the previous target."""
     if not raw:
         _rebuild_role_targets(instance)
+        instance._previous_target_id = instance.target_id
+        instance._previous_user_id = instance.user_id
 
 @receiver(post_delete, sender=Role)
 def role_post_delete(
@@ -90,10 +119,18 @@ def role_post_delete(
     instance: Role,
     **kwargs: Any,
 ) -> None:
-    """Rebuild roles for the target.
-    """
+    """Rebuild roles for the target."""
     _rebuild_role_targets(instance)
 
+@receiver(pre_delete, sender=User)
+def user_pre_delete(
+    sender: type[models.Model],
+    instance: User,
+    **kwargs: Any,
+) -> None:
+    """Remove all of the user's roles in bulk, instead of cascading to each one."""
+    remove_user_roles(instance)
+
 # Automatically set up roletarget deletion signals.
 # This will not catch any classes that do not exist before this signal is
 # registered, or role_targets that are manually set up without using RoleTargetBase.
@@ -103,6 +140,9 @@ def delete_role_target(
     **kwargs: Any,
 ) -> None:
     """Delete the role_target where appropriate and possible."""
+    if defer_role_target_deletion(instance.role_target_id):
+        return
+
     # Something else may be using the role_target.
     with suppress(models.ProtectedError):
         if instance.role_target.id is not None:
@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from django import template
+
+from worldmaster.roles.models import Role, RoleTarget
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from django.contrib.auth.models import AbstractUser, AnonymousUser
+
+    from worldmaster.roles.models import RoleTargetBase
+
+register = template.Library()
+
+@register.simple_tag
+def editable_target_ids(user: AbstractUser | AnonymousUser, objects: Iterable[RoleTargetBase]) -> set[int]:
+    """Get the role_target ids of the objects the user can edit, all at once."""
+    return {
+        id
+        for id, types in RoleTarget.roles_for(user, (object.role_target_id for object in objects)).items()
+        if Role.Type.EDITOR in types
+    }
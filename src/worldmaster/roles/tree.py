@@ -0,0 +1,196 @@
+"""An in-memory resolver for the roles in one RoleTarget tree.
+
+A RoleTree loads a whole tree, usually a world, in two queries: the parent of
+every target as an array of positions, and the explicit roles as per-user
+bitmasks in the same layout as EffectiveRole.mask.  Inheritance is resolved in
+memory, one array pass per user, and the result is kept, so after the first
+check for a user every further check is an array lookup.
+
+Trees are cached per process and keyed by the tree's permission_cache
+generation, so they are reloaded whenever roles change in the tree, in this
+process or any other that shares the role cache.
+"""
+from __future__ import annotations
+
+from array import array
+from typing import TYPE_CHECKING, Any
+
+from django.dispatch import receiver
+
+from .models import EffectiveRole, Role, RoleTarget, RoleTargetAncestor, _implied_types, roles_changed
+from .permission_cache import root_ids, tree_generations
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from django.contrib.auth.models import AbstractUser, AnonymousUser
+
+_ALL = EffectiveRole.pack(Role.Type)
+_INHERITED = EffectiveRole.pack(Role._INHERITED)
+
+# Maps every mask of explicit types to the mask of all the types they imply.
+_IMPLIED = tuple(
+    EffectiveRole.pack(_implied_types(EffectiveRole.unpack(mask)))
+    for mask in range(_ALL + 1)
+)
+
+class RoleTree:
+    """The explicit roles of one RoleTarget tree, with inheritance resolved on demand."""
+
+    __slots__ = (
+        "_effective",
+        "_explicit",
+        "_parents",
+        "index",
+        "root_id",
+    )
+
+    root_id: int
+    # Maps target ids to their position.  Parents come before their children.
+    index: dict[int, int]
+    # The position of each target's parent, or -1 for the root.
+    _parents: array[int]
+    # Maps user ids, with None for the NULL user, to the masks of their
+    # explicit types at each position where they have any.
+    _explicit: dict[int | None, dict[int, int]]
+    # The effective masks of each user at every position, filled in lazily.
+    _effective: dict[int | None, array[int]]
+
+    def __init__(
+        self,
+        root_id: int,
+        index: dict[int, int],
+        parents: array[int],
+        explicit: dict[int | None, dict[int, int]],
+    ) -> None:
+        """Create a tree from already loaded parts.  Use load() instead."""
+        self.root_id = root_id
+        self.index = index
+        self._parents = parents
+        self._explicit = explicit
+        self._effective = {}
+
+    @classmethod
+    def load(cls, root_id: int) -> RoleTree:
+        """Load the tree under a root in two queries."""
+        index: dict[int, int] = {}
+        parents = array("q")
+        # Ordering by depth puts every parent before its children.
+        for id, parent_id in RoleTargetAncestor.objects.filter(
+            ancestor_id=root_id,
+        ).order_by("depth").values_list("descendant_id", "descendant__parent_id"):
+            index[id] = len(parents)
+            parents.append(-1 if id == root_id else index[parent_id])
+
+        explicit: dict[int | None, dict[int, int]] = {}
+        for target_id, user_id, type in Role.objects.filter(
+            explicit=True,
+            target__ancestor_link__ancestor_id=root_id,
+        ).values_list("target_id", "user_id", "type"):
+            masks = explicit.setdefault(user_id, {})
+            position = index[target_id]
+            masks[position] = masks.get(position, 0) | (1 << type)
+
+        return cls(root_id, index, parents, explicit)
+
+    @property
+    def user_ids(self) -> list[int | None]:
+        """The users with explicit roles in this tree, with None for the NULL user."""
+        return list(self._explicit)
+
+    def masks(self, user_id: int | None) -> array[int] | None:
+        """Get the effective masks of one user at every position, or None if they have no roles here.
+
+        These are only the user's own roles, without the NULL user's.
+        """
+        effective = self._effective.get(user_id)
+        if effective is not None:
+            return effective
+
+        explicit = self._explicit.get(user_id)
+        if explicit is None:
+            return None
+
+        effective = array("B", bytes(len(self._parents)))
+        for position, parent in enumerate(self._parents):
+            mask = explicit.get(position, 0)
+            if parent >= 0:
+                mask |= effective[parent] & _INHERITED
+            effective[position] = _IMPLIED[mask]
+        self._effective[user_id] = effective
+        return effective
+
+    def mask(self, user: AbstractUser | AnonymousUser, target: RoleTarget | int) -> int:
+        """Get the mask of the role types the user counts as on a target.
+
+        Like RoleTarget.user_is_role, this counts the NULL user's roles and
+        gives superusers every role.
+        """
+        if user.is_superuser:
+            return _ALL
+
+        position = self.index[target if isinstance(target, int) else target.id]
+        mask = 0
+        user_ids: tuple[int | None, ...] = (None, user.id) if user.is_authenticated else (None,)
+        for user_id in user_ids:
+            masks = self.masks(user_id)
+            if masks is not None:
+                mask |= masks[position]
+        return mask
+
+    def types(self, user: AbstractUser | AnonymousUser, target: RoleTarget | int) -> frozenset[Role.Type]:
+        """Get the role types the user counts as on a target."""
+        return EffectiveRole.unpack(self.mask(user, target))
+
+    def user_is_role(self, user: AbstractUser | AnonymousUser, target: RoleTarget | int, type: Role.Type) -> bool:
+        """Return True if the user counts as this role on the target."""
+        return bool(self.mask(user, target) & (1 << type))
+
+    def user_is_master(self, user: AbstractUser | AnonymousUser, target: RoleTarget | int) -> bool:
+        return self.user_is_role(user, target, Role.Type.MASTER)
+
+    def user_is_editor(self, user: AbstractUser | AnonymousUser, target: RoleTarget | int) -> bool:
+        return self.user_is_role(user, target, Role.Type.EDITOR)
+
+    def user_is_viewer(self, user: AbstractUser | AnonymousUser, target: RoleTarget | int) -> bool:
+        return self.user_is_role(user, target, Role.Type.VIEWER)
+
+# Maps root ids to their generation and tree.
+_trees: dict[int, tuple[tuple[int, int], RoleTree]] = {}
+
+def role_tree(target: RoleTarget | int) -> RoleTree:
+    """Get the current RoleTree of the tree that a target is in."""
+    target_id = target if isinstance(target, int) else target.id
+    root_id, generation = tree_generations((target_id,))[target_id]
+
+    cached = _trees.get(root_id)
+    if cached is not None and cached[0] == generation and target_id in cached[1].index:
+        return cached[1]
+
+    tree = RoleTree.load(root_id)
+    _trees[root_id] = (generation, tree)
+    return tree
+
+@receiver(roles_changed)
+def forget_changed_trees(sender: Any, target: Any, **kwargs: Any) -> None:
+    """Drop the cached trees of this process as soon as their roles change.
+
+    Other processes notice through the tree generation instead.
+    """
+    if target is None:
+        _trees.clear()
+    else:
+        _trees.pop(root_ids((target.id,))[target.id], None)
+
+def verify_tree(tree: RoleTree, users: Iterable[AbstractUser | AnonymousUser]) -> list[tuple[int, int | None]]:
+    """Compare a tree against the database for some users.
+
+    Returns the (target_id, user_id) pairs where the tree and
+    RoleTarget.roles_for disagree.
+    """
+    mismatches: list[tuple[int, int | None]] = []
+    for user in users:
+        for target_id, types in RoleTarget.roles_for(user, tree.index.keys()).items():
+            if tree.types(user, target_id) != types:
+                mismatches.append((target_id, user.id if user.is_authenticated else None))
+    return mismatches
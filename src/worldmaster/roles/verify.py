@@ -0,0 +1,155 @@
+"""Verification of the materialized implicit roles and effective role masks.
+
+verify_roles() recomputes what the explicit roles imply, entirely in memory,
+and compares it against the stored Role and EffectiveRole rows without writing
+anything unless asked to repair them.  Expected rows are packed into single
+integers, so the expected set costs far less memory than the model instances
+or tuples would, and the stored rows are streamed past it.
+
+Concurrent role writes can show up as discrepancies, so repair should only be
+run while roles are not being changed.
+"""
+from __future__ import annotations
+
+from django.db import models, transaction
+
+from .models import (
+    _BATCH_SIZE,
+    _STREAM_SIZE,
+    EffectiveRole,
+    Role,
+    RoleTarget,
+    _chunked,
+    _effective_roles,
+    _levels,
+    roles_changed,
+)
+
+_TYPE_BITS = max(Role.Type).bit_length()
+
+class RoleDiscrepancies:
+    """The differences between the stored and the expected roles."""
+
+    __slots__ = (
+        "extra_roles",
+        "masks",
+        "missing_roles",
+    )
+
+    # (target_id, user_id, type) of implicit roles that should exist but don't.
+    missing_roles: list[tuple[int, int | None, Role.Type]]
+    # (id, target_id, user_id, type) of implicit roles that exist but shouldn't.
+    extra_roles: list[tuple[int, int, int | None, Role.Type]]
+    # (id, target_id, user_id, expected, actual) of wrong EffectiveRole masks.
+    # id is None for missing rows, and a mask is 0 where there is no row.
+    masks: list[tuple[int | None, int, int | None, int, int]]
+
+    def __init__(self) -> None:
+        """Create an empty set of discrepancies."""
+        self.missing_roles = []
+        self.extra_roles = []
+        self.masks = []
+
+    def __bool__(self) -> bool:
+        return bool(self.missing_roles or self.extra_roles or self.masks)
+
+def verify_roles(*, repair: bool = False) -> RoleDiscrepancies:
+    """Compare the stored implicit roles and masks against the explicit roles.
+
+    If repair is True, only the discrepancies are fixed, in one transaction.
+    """
+    levels = _levels(
+        RoleTarget.objects.values_list("id", "parent_id").iterator(chunk_size=_STREAM_SIZE),
+    )
+
+    explicit: dict[int, dict[int | None, set[Role.Type]]] = {}
+    for target_id, user_id, type in Role.objects.filter(
+        explicit=True,
+    ).values_list("target_id", "user_id", "type").iterator(chunk_size=_STREAM_SIZE):
+        explicit.setdefault(target_id, {}).setdefault(user_id, set()).add(type)
+
+    # Users are packed after the target, with 0 for the anonymous user.
+    stride = max(
+        model.objects.aggregate(max=models.Max("user_id"))["max"] or 0
+        for model in (Role, EffectiveRole)
+    ) + 2
+
+    def key(target_id: int, user_id: int | None) -> int:
+        return target_id * stride + (0 if user_id is None else user_id + 1)
+
+    def unkey(key: int) -> tuple[int, int | None]:
+        target_id, user_key = divmod(key, stride)
+        return target_id, None if user_key == 0 else user_key - 1
+
+    expected_roles: set[int] = set()
+    expected_masks: dict[int, int] = {}
+    for target_id, user_id, types, explicit_types in _effective_roles(levels, explicit, {}):
+        target_user = key(target_id, user_id)
+        expected_masks[target_user] = EffectiveRole.pack(types)
+        for type in types.difference(explicit_types):
+            expected_roles.add(target_user << _TYPE_BITS | type)
+    del levels, explicit
+
+    discrepancies = RoleDiscrepancies()
+
+    for id, target_id, user_id, type in Role.objects.filter(
+        explicit=False,
+    ).values_list("id", "target_id", "user_id", "type").iterator(chunk_size=_STREAM_SIZE):
+        role = key(target_id, user_id) << _TYPE_BITS | type
+        if role in expected_roles:
+            expected_roles.remove(role)
+        else:
+            discrepancies.extra_roles.append((id, target_id, user_id, Role.Type(type)))
+
+    for role in sorted(expected_roles):
+        type = role & ((1 << _TYPE_BITS) - 1)
+        discrepancies.missing_roles.append((*unkey(role >> _TYPE_BITS), Role.Type(type)))
+
+    for id, target_id, user_id, mask in EffectiveRole.objects.values_list(
+        "id",
+        "target_id",
+        "user_id",
+        "mask",
+    ).iterator(chunk_size=_STREAM_SIZE):
+        expected = expected_masks.pop(key(target_id, user_id), 0)
+        if expected != mask:
+            discrepancies.masks.append((id, target_id, user_id, expected, mask))
+
+    for target_user, expected in sorted(expected_masks.items()):
+        discrepancies.masks.append((None, *unkey(target_user), expected, 0))
+
+    if repair and discrepancies:
+        _repair(discrepancies)
+
+    return discrepancies
+
+def _repair(discrepancies: RoleDiscrepancies) -> None:
+    """Write only the rows that differ."""
+    with transaction.atomic():
+        for chunk in _chunked([id for id, *_ in discrepancies.extra_roles]):
+            Role.objects.filter(id__in=chunk).delete()
+        Role.objects.bulk_create(
+            [
+                Role(target_id=target_id, user_id=user_id, type=type, explicit=False)
+                for target_id, user_id, type in discrepancies.missing_roles
+            ],
+            batch_size=_BATCH_SIZE,
+        )
+
+        stale: list[int] = []
+        changed: list[EffectiveRole] = []
+        created: list[EffectiveRole] = []
+        for id, target_id, user_id, expected, _ in discrepancies.masks:
+            effective_role = EffectiveRole(id=id, target_id=target_id, user_id=user_id, mask=expected)
+            if id is None:
+                created.append(effective_role)
+            elif expected == 0:
+                stale.append(id)
+            else:
+                changed.append(effective_role)
+        for chunk in _chunked(stale):
+            EffectiveRole.objects.filter(id__in=chunk).delete()
+        EffectiveRole.objects.bulk_update(changed, ("mask",), batch_size=_BATCH_SIZE)
+        EffectiveRole.objects.bulk_create(created, batch_size=_BATCH_SIZE)
+
+    roles_changed.send(sender=Role, target=None)
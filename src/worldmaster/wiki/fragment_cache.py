@@ -0,0 +1,60 @@
+"""Cross-request caching of rendered articles on Django's cache framework.
+
+A rendered article is keyed by the article, its version, and a hash of the ids
+of the sections the viewer can see, so viewers who can see the same sections
+share one entry.  Article.version is bumped in the database whenever any of its
+sections are written, in the same transaction, so every process sees a write
+together with its new version, whichever cache backend is configured.
+
+The visible sections are worked out on every hit with RoleTarget.roles_for,
+which is itself cached and invalidated by role changes, so a permission change
+can only ever select a different entry, never a stale one.
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+
+from worldmaster.roles.models import Role, RoleTarget
+
+from .models import Article
+
+if TYPE_CHECKING:
+    from django.contrib.auth.models import AbstractUser, AnonymousUser
+    from django.core.cache.backends.base import BaseCache
+
+_PREFIX = "worldmaster:wiki"
+
+def _cache() -> BaseCache:
+    return caches[getattr(settings, "WORLDMASTER_WIKI_CACHE", "default")]
+
+def _timeout() -> int | None:
+    return getattr(settings, "WORLDMASTER_WIKI_CACHE_TIMEOUT", 60 * 60)
+
+def rendered_article(user: AbstractUser | AnonymousUser, article: Article) -> str:
+    """Render the sections of an article that the user can see, using the cache where possible."""
+    cache = _cache()
+    version = Article.objects.filter(id=article.id).values_list("version", flat=True).get()
+
+    sections_key = f"{_PREFIX}:sections:{article.id}:{version}"
+    sections: list[tuple[int, int]] | None = cache.get(sections_key)
+    if sections is None:
+        sections = list(article.sections.values_list("id", "role_target_id"))
+        cache.set(sections_key, sections, _timeout())
+
+    roles = RoleTarget.roles_for(user, (role_target_id for _, role_target_id in sections))
+    visible = sorted(id for id, role_target_id in sections if Role.Type.VIEWER in roles[role_target_id])
+    digest = hashlib.sha256(",".join(map(str, visible)).encode()).hexdigest()
+
+    key = f"{_PREFIX}:article:{article.id}:{version}:{digest}"
+    html: str | None = cache.get(key)
+    if html is None:
+        html = render_to_string("wiki/article/_sections.html", {
+            "sections": article.sections.filter(id__in=visible),
+        })
+        cache.set(key, html, _timeout())
+    return html
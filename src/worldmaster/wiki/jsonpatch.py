@@ -0,0 +1,114 @@
+"""A minimal JSON Patch (RFC 6902) implementation for section revisions.
+
+diff produces only add, remove and replace operations, and apply accepts only
+those.  Lists are diffed by trimming their common start and end and comparing
+what is left position by position, which keeps the patch for a typical edit,
+like inserting, removing or changing a few paragraphs, about the size of the
+edit itself.
+"""
+from __future__ import annotations
+
+import copy
+from typing import Any
+
+
+def _escape(token: str) -> str:
+    return token.replace("~", "~0").replace("/", "~1")
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+def _same(a: Any, b: Any) -> bool:
+    """Compare JSON values, without treating True as 1 like == does."""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(value, b[key]) for key, value in a.items())
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b, strict=True))
+    return a == b
+
+def diff(a: Any, b: Any, path: str = "") -> list[dict[str, Any]]:
+    """Get a patch that turns the JSON value a into b."""
+    if _same(a, b):
+        return []
+
+    if isinstance(a, dict) and isinstance(b, dict):
+        patch: list[dict[str, Any]] = [
+            {"op": "remove", "path": f"{path}/{_escape(key)}"}
+            for key in a
+            if key not in b
+        ]
+        for key, value in b.items():
+            if key in a:
+                patch.extend(diff(a[key], value, f"{path}/{_escape(key)}"))
+            else:
+                patch.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+        return patch
+
+    if isinstance(a, list) and isinstance(b, list):
+        return _diff_lists(a, b, path)
+
+    return [{"op": "replace", "path": path, "value": b}]
+
+def _diff_lists(a: list[Any], b: list[Any], path: str) -> list[dict[str, Any]]:
+    shortest = min(len(a), len(b))
+    start = 0
+    while start < shortest and _same(a[start], b[start]):
+        start += 1
+    end = 0
+    while end < shortest - start and _same(a[-1 - end], b[-1 - end]):
+        end += 1
+    a_middle = a[start:len(a) - end]
+    b_middle = b[start:len(b) - end]
+
+    patch: list[dict[str, Any]] = []
+    common = min(len(a_middle), len(b_middle))
+    for i in range(common):
+        patch.extend(diff(a_middle[i], b_middle[i], f"{path}/{start + i}"))
+    # Removals go from the end, so that earlier indexes stay valid.
+    patch.extend(
+        {"op": "remove", "path": f"{path}/{start + i}"}
+        for i in reversed(range(common, len(a_middle)))
+    )
+    patch.extend(
+        {"op": "add", "path": f"{path}/{start + i}", "value": b_middle[i]}
+        for i in range(common, len(b_middle))
+    )
+    return patch
+
+def apply(document: Any, patch: list[dict[str, Any]]) -> Any:
+    """Apply a patch to a JSON value, and return the result.
+
+    The document itself is left unchanged.
+    """
+    document = copy.deepcopy(document)
+    for operation in patch:
+        op = operation["op"]
+        if op not in ("add", "remove", "replace"):
+            msg = f"Unsupported JSON Patch operation {op!r}"
+            raise ValueError(msg)
+
+        path: str = operation["path"]
+        if not path:
+            document = None if op == "remove" else copy.deepcopy(operation["value"])
+            continue
+
+        *parents, last = (_unescape(token) for token in path.split("/")[1:])
+        parent = document
+        for token in parents:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+
+        if isinstance(parent, list):
+            index = len(parent) if last == "-" else int(last)
+            if op == "add":
+                parent.insert(index, copy.deepcopy(operation["value"]))
+            elif op == "remove":
+                del parent[index]
+            else:
+                parent[index] = copy.deepcopy(operation["value"])
+        elif op == "remove":
+            del parent[last]
+        else:
+            parent[last] = copy.deepcopy(operation["value"])
+    return document
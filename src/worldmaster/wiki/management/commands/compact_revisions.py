@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.utils import timezone
+
+from worldmaster.wiki.revisions import compact_revisions
+
+
+class Command(BaseCommand):
+    help = "Merge the deltas of old wiki section revisions, keeping every snapshot."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--days",
+            type=float,
+            default=30.0,
+            help="Only revisions older than this many days are merged.",
+        )
+
+    def handle(self, *args: Any, days: float, **options: Any) -> None:
+        removed = compact_revisions(timezone.now() - timedelta(days=days))
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} revisions"))
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from worldmaster.wiki.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Reindex the text of every wiki section for search."
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        start = time.monotonic()
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} sections in {time.monotonic() - start:.1f}s"))
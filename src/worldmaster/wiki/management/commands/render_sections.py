@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from worldmaster.wiki.models import Article, Section
+from worldmaster.wiki.rendering import render_html
+
+# How many sections are read and written per query.
+_BATCH_SIZE = 500
+
+class Command(BaseCommand):
+    help = "Render the HTML of every wiki section again, such as after the renderer changes."
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        start = time.monotonic()
+        count = 0
+        changed: list[Section] = []
+        with transaction.atomic():
+            for section in Section.objects.only("article_id", "body", "html").iterator(chunk_size=_BATCH_SIZE):
+                count += 1
+                html = render_html(section.body)
+                if html != section.html:
+                    section.html = html
+                    changed.append(section)
+            # Bulk writes send no signals, so invalidate the rendered articles
+            # here.
+            Section.objects.bulk_update(changed, ("html",), batch_size=_BATCH_SIZE)
+            Article.bump_versions(section.article_id for section in changed)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {count} sections, {len(changed)} changed, in {time.monotonic() - start:.1f}s",
+        ))
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:30
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def content_hash(body, order):
+    # A frozen copy of wiki.models.content_hash as it was when this migration
+    # was written, hashing the float order rather than the later key.
+    canonical = json.dumps(
+        {'body': body, 'order': float(order)},
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def backfill_content_hashes(apps, schema_editor):
+    Section = apps.get_model('wiki', 'Section')
+
+    sections = list(Section.objects.only('body', 'order'))
+    for section in sections:
+        section.content_hash = content_hash(section.body, section.order)
+    Section.objects.bulk_update(sections, ('content_hash',), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0003_alter_article_role_target_alter_section_role_target'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text="The sha256 of the section's canonical JSON body and order.", max_length=64),
+        ),
+        migrations.RunPython(backfill_content_hashes, migrations.RunPython.noop),
+    ]
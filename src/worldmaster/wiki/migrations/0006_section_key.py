@@ -0,0 +1,94 @@
+# Generated by Django 4.2.30 on 2026-10-17 22:10
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+# Frozen copies of wiki.models.content_hash and of
+# wiki.ordering.generate_n_keys_between(None, None, n) as they were when this
+# migration was written, so that later changes to either don't change it.
+
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+def content_hash(body, key):
+    canonical = json.dumps(
+        {'body': body, 'key': key},
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def generate_n_keys_between(n):
+    # Keys for an empty list count up from a0: a0 to az, then b00 to bzz, then
+    # c000, and so on.
+    keys = []
+    head, length, number = 'a', 1, 0
+    for _ in range(n):
+        digits = ''
+        remaining = number
+        for _ in range(length):
+            remaining, digit = divmod(remaining, len(DIGITS))
+            digits = DIGITS[digit] + digits
+        keys.append(head + digits)
+        number += 1
+        if number == len(DIGITS) ** length:
+            head, length, number = chr(ord(head) + 1), length + 1, 0
+    return keys
+
+
+def assign_keys(apps, schema_editor):
+    Section = apps.get_model('wiki', 'Section')
+
+    # Keys are spread evenly in the old float order, one article at a time.
+    sections = list(Section.objects.only('article_id', 'body', 'order').order_by('article_id', 'order', 'id'))
+    by_article = {}
+    for section in sections:
+        by_article.setdefault(section.article_id, []).append(section)
+    for article_sections in by_article.values():
+        keys = generate_n_keys_between(len(article_sections))
+        for section, key in zip(article_sections, keys):
+            section.key = key
+            section.content_hash = content_hash(section.body, key)
+    Section.objects.bulk_update(sections, ('key', 'content_hash'), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0005_section_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='key',
+            field=models.CharField(default='', help_text='Section ordering key in its article.', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='section',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text="The sha256 of the section's canonical JSON body and key.", max_length=64),
+        ),
+        migrations.RunPython(assign_keys, migrations.RunPython.noop),
+        migrations.AlterModelOptions(
+            name='section',
+            options={'ordering': ('article', 'key')},
+        ),
+        migrations.RemoveIndex(
+            model_name='section',
+            name='wiki_sectio_article_719adc_idx',
+        ),
+        migrations.RemoveField(
+            model_name='section',
+            name='order',
+        ),
+        migrations.AddIndex(
+            model_name='section',
+            index=models.Index(fields=['article', 'key'], name='wiki_sectio_article_a306e0_idx'),
+        ),
+    ]
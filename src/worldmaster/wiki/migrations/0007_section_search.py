@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-17 22:40
+
+from django.db import migrations
+
+
+# A frozen copy of wiki.search.section_text as it was when this migration was
+# written, so that later changes to it don't change what this migration writes.
+# The rebuild_search_index command indexes with the current one.
+def section_text(body):
+    parts = []
+    _collect_text(body, parts)
+    return ''.join(parts).strip()
+
+
+def _collect_text(node, parts):
+    if not isinstance(node, dict):
+        return
+    type = node.get('type')
+    if type == 'text':
+        parts.append(str(node.get('text', '')))
+    elif type == 'hardBreak':
+        parts.append('\n')
+    else:
+        for child in node.get('content') or ():
+            _collect_text(child, parts)
+        parts.append('\n')
+
+
+def index_sections(apps, schema_editor):
+    Section = apps.get_model('wiki', 'Section')
+
+    rows = [(id, section_text(body)) for id, body in Section.objects.values_list('id', 'body')]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany('INSERT INTO wiki_section_search (rowid, text) VALUES (%s, %s)', rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0006_section_key'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE VIRTUAL TABLE wiki_section_search USING fts5(text, tokenize='unicode61 remove_diacritics 2')",
+            "DROP TABLE wiki_section_search",
+        ),
+        migrations.RunPython(index_sections, migrations.RunPython.noop),
+    ]
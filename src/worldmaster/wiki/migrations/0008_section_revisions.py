@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def snapshot_sections(apps, schema_editor):
+    Section = apps.get_model('wiki', 'Section')
+    SectionRevision = apps.get_model('wiki', 'SectionRevision')
+
+    # Existing sections start their history with a snapshot of their body.
+    SectionRevision.objects.bulk_create(
+        (
+            SectionRevision(section_id=id, number=0, snapshot=body)
+            for id, body in Section.objects.values_list('id', 'body').iterator()
+        ),
+        batch_size=500,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wiki', '0007_section_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SectionRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(help_text='The revision number, counting from 0 for each section.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('snapshot', models.JSONField(blank=True, default=None, help_text='The whole body, for snapshot revisions.', null=True)),
+                ('delta', models.JSONField(blank=True, default=None, help_text="A JSON Patch from the previous revision's body, for delta revisions.", null=True)),
+                ('section', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', related_query_name='revision', to='wiki.section')),
+                ('user', models.ForeignKey(blank=True, help_text='The user who made the revision, if known.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('section', 'number'),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sectionrevision',
+            constraint=models.UniqueConstraint(fields=('section', 'number'), name='unique_section_revision_number'),
+        ),
+        migrations.RunPython(snapshot_sections, migrations.RunPython.noop),
+    ]
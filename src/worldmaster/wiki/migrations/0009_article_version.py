@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0008_section_revisions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text="Bumped whenever any of the article's sections are written."),
+        ),
+    ]
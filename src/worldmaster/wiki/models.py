@@ -1,26 +1,122 @@
 from __future__ import annotations
 
+import hashlib
 import json
+from bisect import bisect_right
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import TYPE_CHECKING, Any, cast
 
 from django.contrib.auth import get_user_model
 from django.core.exceptions import PermissionDenied
 from django.db import models
-from django.shortcuts import get_object_or_404
-from worldmaster.roles.models import Role, RoleTargetBase, RoleTargetManager
+from django.http import Http404
+
+from worldmaster.roles.deferred import deferred_role_rebuild, deferred_role_target_deletion
+from worldmaster.roles.models import Role, RoleTarget, RoleTargetBase, RoleTargetManager
+
+from .ordering import generate_key_between, generate_n_keys_between, validate_key
+from .rendering import render_html
+from .revisions import SectionRevision, record_revisions  # noqa: F401 (re-exported with the other models)
+from .search import index_sections, unindex_sections
 
 if TYPE_CHECKING:
+    from collections.abc import Collection, Iterable, Iterator, Sequence
+
     from django.contrib.auth.models import AbstractUser, AnonymousUser
     from django.http import QueryDict
 
+    from worldmaster.roles.models import RoleTargetQuerySet
+
 User = get_user_model()
 
+# How many sections are written per query.
+_BATCH_SIZE = 500
+
+# Keys grow as sections are put again and again into the same gap, so an
+# article's keys are rebalanced once any is longer than this.  This is well
+# under the key's max_length, which the next key can't exceed by much.
+_REBALANCE_KEY_LENGTH = 128
+
+def content_hash(body: Any, key: str) -> str:
+    """Hash a section's content, in a form that doesn't depend on JSON formatting.
+
+    This is the sha256 of the canonical JSON of the body and ordering key.
+    """
+    canonical = json.dumps(
+        {"body": body, "key": key},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+# Set while update_sections deletes sections, so that the post_delete receivers
+# leave the search index and rendered article to it, for all of them at once.
+_deleting_in_bulk: ContextVar[bool] = ContextVar("wiki_deleting_in_bulk", default=False)
+
+@contextmanager
+def _bulk_section_deletion() -> Iterator[None]:
+    token = _deleting_in_bulk.set(True)
+    try:
+        yield
+    finally:
+        _deleting_in_bulk.reset(token)
+
+def deleting_in_bulk() -> bool:
+    """Return True while update_sections is deleting sections."""
+    return _deleting_in_bulk.get()
+
 def _load_int(value: str) -> int | None:
     """Load an integer if the string is not empty, otherwise None."""
     if value:
         return int(value)
     return None
 
+def _keeps_key(key: str, previous: str | None, max_length: int) -> bool:
+    """Return True if a posted key is valid, short enough, and after the previous one."""
+    try:
+        validate_key(key)
+    except ValueError:
+        return False
+    # Shorter than the limit, so that keys generated next to it still fit.
+    return len(key) < max_length and (previous is None or key > previous)
+
+def _fill_keys(keys: Sequence[str], article_keys: list[str]) -> list[str]:
+    """Keep the usable posted ordering keys, and generate new ones for the rest.
+
+    Posted keys are kept as long as they are valid and ascending.  Each run of
+    sections posted without a key, or with an invalid or out of order one, gets
+    keys between the key kept before it and the next key in the article or the
+    post, so they land where they were posted without any other section being
+    renumbered.  article_keys must be sorted.
+    """
+    max_length = cast(int, Section._meta.get_field("key").max_length)
+    filled = list(keys)
+    previous: str | None = None
+    run: list[int] = []
+
+    def fill_run(next_key: str | None) -> None:
+        index = 0 if previous is None else bisect_right(article_keys, previous)
+        upper = article_keys[index] if index < len(article_keys) else None
+        if next_key is not None and (upper is None or next_key < upper):
+            upper = next_key
+        for i, key in zip(run, generate_n_keys_between(previous, upper, len(run)), strict=True):
+            filled[i] = key
+        run.clear()
+
+    for i, key in enumerate(keys):
+        if not _keeps_key(key, previous, max_length):
+            run.append(i)
+            continue
+        if run:
+            fill_run(key)
+        previous = key
+    if run:
+        fill_run(None)
+
+    return filled
+
 class Article(RoleTargetBase, models.Model):
     """Represents a Wiki article."""
 
@@ -28,59 +124,200 @@ class Article(RoleTargetBase, models.Model):
 
     sections: models.Manager[Section]
 
+    # Kept in the database rather than the cache, so that every process sees a
+    # bump together with the write that caused it.
+    version = models.PositiveBigIntegerField(
+        default=0,
+        editable=False,
+        help_text="Bumped whenever any of the article's sections are written.",
+    )
+
     objects: RoleTargetManager[Article] = RoleTargetManager()
 
+    @classmethod
+    def bump_versions(cls, ids: Iterable[int]) -> None:
+        """Invalidate the cached renders of the articles with the given ids."""
+        cls.objects.filter(id__in=set(ids)).update(version=models.F("version") + 1)
+
+    def rebalance_keys(self) -> None:
+        """Give this article's sections the shortest keys in their current order."""
+        sections = list(self.sections.only("id", "body", "key"))
+        for section, key in zip(sections, generate_n_keys_between(None, None, len(sections)), strict=True):
+            section.key = key
+            section.content_hash = content_hash(section.body, key)
+        Section.objects.bulk_update(sections, ("key", "content_hash"), batch_size=_BATCH_SIZE)
+        Article.bump_versions((self.id,))
+
+    def _rebalance_long_keys(self, keys: Iterable[str]) -> bool:
+        """Rebalance this article's keys if any of the given ones is too long, and return whether it was."""
+        if any(len(key) > _REBALANCE_KEY_LENGTH for key in keys):
+            self.rebalance_keys()
+            return True
+        return False
+
+    def sections_for(self, user: AbstractUser | AnonymousUser) -> RoleTargetQuerySet[Section]:
+        """Get the sections of this article that the user can see, in order.
+
+        Each section is annotated with is_editor, so a page can show them all
+        with their permissions in one query.
+        """
+        return Section.objects.filter(article=self).visible_to(user).annotate_roles(user, Role.Type.EDITOR)
+
+    @deferred_role_rebuild()
     def update_sections(self, user: AbstractUser | AnonymousUser, data: QueryDict):
-        """Update this article's sections using a POST dictionary."""
-        if not self.role_target.user_is_editor(user):
+        """Update this article's sections using a POST dictionary.
+
+        Existing sections are loaded in one query and written with one
+        bulk_update, new sections are created in bulk along with their role
+        targets and EDITOR roles, and removed sections are deleted together.
+        Posted sections whose content hash hasn't changed are skipped entirely.
+
+        Sections posted with an invalid, overlong or out of order key get a new
+        key where they were posted, like new sections do.
+        """
+        article_roles = RoleTarget.roles_for(user, (self.role_target_id,))[self.role_target_id]
+        if Role.Type.EDITOR not in article_roles:
             msg = "User can not edit wiki"
             raise PermissionDenied(msg)
 
         # Not a set or dict because None may appear multiple times
         section_ids = tuple(map(_load_int, data.getlist("wiki-section-id")))
 
-        section_orders = map(float, data.getlist("wiki-section-order"))
+        section_keys = data.getlist("wiki-section-key")
         sections = map(json.loads, data.getlist("wiki-section-body"))
 
         # Get the present IDs so we can delete absent sections (which have been
         # deleted)
         present_ids = {id for id in section_ids if id is not None}
 
-        section_set = self.sections.all()
+        # Every posted section and every section of this article is loaded at
+        # once.
+        existing: dict[int, Section] = {
+            section.id: section
+            for section in Section.objects.filter(models.Q(article=self) | models.Q(id__in=present_ids))
+            if section.id is not None
+        }
+        if not present_ids <= existing.keys():
+            msg = "No Section matches the given query."
+            raise Http404(msg)
+
+        section_keys = _fill_keys(
+            section_keys,
+            sorted(section.key for section in existing.values() if section.article_id == self.id),
+        )
 
-        for id, order, body in zip(section_ids, section_orders, sections, strict=True):
-            section: Section
+        created: list[Section] = []
+        changed: dict[int, tuple[Section, str, Any, str]] = {}
+        for id, key, body in zip(section_ids, section_keys, sections, strict=True):
+            digest = content_hash(body, key)
             if id is None:
-                section = section_set.create(
-                    order=order,
+                created.append(Section(
+                    key=key,
                     body=body,
                     article=self,
-                )
+                    content_hash=digest,
+                    html=render_html(body),
+                ))
+            elif existing[id].content_hash != digest:
+                changed[id] = (existing[id], key, body, digest)
+            else:
+                # An unchanged copy later in the post still wins.
+                changed.pop(id, None)
 
-                kwargs = {
-                    "user": user,
-                    "type": Role.Type.EDITOR,
-                    "target": section.role_target,
-                }
-                if not Role.objects.filter(**kwargs).exists():
-                    Role.objects.create(**kwargs)
+        # Only sections that would be written or deleted need checking.
+        removed = [
+            section
+            for id, section in existing.items()
+            if section.article_id == self.id and id not in present_ids
+        ]
+        editable = {
+            id
+            for id, types in RoleTarget.roles_for(
+                user,
+                {section.role_target_id for section in (*removed, *(section for section, *_ in changed.values()))},
+            ).items()
+            if Role.Type.EDITOR in types
+        }
 
-                present_ids.add(cast(Any, section).id)
-            else:
-                section = get_object_or_404(Section, id=id)
-                if section.role_target.user_is_editor(user):
-                    section.body = body
-                    section.order = order
-                    section.save()
+        updated: list[Section] = []
+        previous_bodies: dict[int, Any] = {}
+        for id, (section, key, body, digest) in changed.items():
+            if section.role_target_id in editable:
+                previous_bodies[id] = section.body
+                section.body = body
+                section.key = key
+                section.content_hash = digest
+                section.html = render_html(body)
+                updated.append(section)
+
+        Section.objects.bulk_update(updated, ("body", "key", "content_hash", "html"), batch_size=_BATCH_SIZE)
+
+        if created:
+            self._create_sections(user, created, article_roles)
 
         # Delete removed sections, if the user can delete them.
-        for section in section_set.exclude(id__in=present_ids):
-            if section.role_target.user_is_editor(user):
-                section.delete()
+        removed_ids = [cast(int, section.id) for section in removed if section.role_target_id in editable]
+        if removed_ids:
+            with deferred_role_target_deletion(), _bulk_section_deletion():
+                Section.objects.filter(id__in=removed_ids).delete()
+            unindex_sections(removed_ids)
+
+        # Bulk writes send no signals, and the receivers skip bulk deletions,
+        # so invalidate the rendered article, reindex, and record revisions
+        # here.
+        if updated or created or removed_ids:
+            Article.bump_versions((self.id,))
+        if updated or created:
+            index_sections((cast(int, section.id), section.body) for section in (*updated, *created))
+            record_revisions(
+                (
+                    *((section, previous_bodies[cast(int, section.id)]) for section in updated),
+                    *((section, None) for section in created),
+                ),
+                user,
+            )
+
+        self._rebalance_long_keys(section.key for section in (*updated, *created))
+
+    def _create_sections(
+        self,
+        user: AbstractUser | AnonymousUser,
+        sections: list[Section],
+        article_roles: Collection[Role.Type],
+    ) -> None:
+        """Create new sections in bulk, with their role targets and an EDITOR role for the user.
+
+        article_roles are the user's roles on this article.  A MASTER of the
+        article inherits EDITOR on the new sections, so it gets no explicit role
+        that would outlive its MASTER role.  Superusers have no roles to inherit,
+        so they still get one.
+        """
+        role_targets = RoleTarget.bulk_create_children(self.role_target, len(sections))
+        for section, role_target in zip(sections, role_targets, strict=True):
+            section.role_target = role_target
+        Section.objects.bulk_create(sections, batch_size=_BATCH_SIZE)
+
+        if user.is_authenticated and (user.is_superuser or Role.Type.MASTER not in article_roles):
+            Role.objects.bulk_create(
+                [
+                    Role(user=user, type=Role.Type.EDITOR, target=role_target)
+                    for role_target in role_targets
+                ],
+                batch_size=_BATCH_SIZE,
+            )
+        self.role_target._propagate_roles()
 
 class Section(RoleTargetBase, models.Model):
     """Represents a part of a Wiki article."""
 
+    __slots__ = (
+        "_loaded_content",
+    )
+
+    # The content_hash, key and body as loaded or last saved, to detect body
+    # changes, or None if they weren't all loaded.
+    _loaded_content: tuple[str, str, Any] | None
+
     id: int | None
 
     article: models.ForeignKey[Article, Article] = models.ForeignKey(
@@ -99,10 +336,35 @@ class Section(RoleTargetBase, models.Model):
         default=list,
     )
 
-    # Order is in a range from 0 to the number of sections on the article.
-    # Clients might not be able to see all the sections, but can still do
-    # alright at preventing totally mangling an article as they edit it.
-    order = models.FloatField(help_text="Section order in its article.", blank=False, null=False, default=0.0)
+    # A fractional index from wiki.ordering, so a section can be put between
+    # any two others by writing only its own key.  Clients might not be able
+    # to see all the sections, but can still do alright at preventing totally
+    # mangling an article as they edit it.
+    key = models.CharField(
+        max_length=255,
+        blank=False,
+        null=False,
+        help_text="Section ordering key in its article.",
+    )
+
+    # Kept up to date on save, and usable as a version or ETag of the section.
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        null=False,
+        editable=False,
+        default="",
+        help_text="The sha256 of the section's canonical JSON body and key.",
+    )
+
+    # Rendered on save, so that articles are sent ready to display.
+    html = models.TextField(
+        blank=True,
+        null=False,
+        editable=False,
+        default="",
+        help_text="The body rendered to HTML.",
+    )
 
     objects: RoleTargetManager[Section] = RoleTargetManager()
 
@@ -112,12 +374,26 @@ class Section(RoleTargetBase, models.Model):
     def __repr__(self):
         return f"<Section: {self.body!r}>"
 
+    def move_between(self, previous: Section | None, next: Section | None) -> None:
+        """Move this section between two others, writing only its own row.
+
+        None means the start of the article for previous and the end for next.
+        If the new key is too long, the whole article's keys are rebalanced.
+        """
+        self.key = generate_key_between(
+            None if previous is None else previous.key,
+            None if next is None else next.key,
+        )
+        self.save(update_fields=("key", "content_hash"))
+        if self.article._rebalance_long_keys((self.key,)):
+            self.refresh_from_db(fields=("key", "content_hash"))
+
     class Meta(RoleTargetBase.Meta):
         indexes = [
-            models.Index(fields=("article", "order")),
+            models.Index(fields=("article", "key")),
         ]
 
-        ordering = ("article", "order")
+        ordering = ("article", "key")
 
 class ArticleBase(models.Model):
     """An abstract base that gives an article field to a model."""
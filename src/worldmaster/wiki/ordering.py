@@ -0,0 +1,192 @@
+"""Fractional indexing keys for ordering sections.
+
+A key is a variable-length base62 string, and keys sort in the order they are
+meant to be in when compared bytewise, as SQLite does by default.  There is
+always room for another key between any two keys, so a section can be inserted
+or moved by writing only its own key, however many sections are around it.
+
+Keys are an integer part, whose length is given by its first character, and a
+fractional part that never ends in the zero digit.  This is the same format as
+the widely used fractional-indexing JavaScript package, so keys from either are
+interchangeable.
+"""
+from __future__ import annotations
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+_ZERO = DIGITS[0]
+
+# The smallest integer part, which can't be decremented.
+_SMALLEST_INTEGER = "A" + _ZERO * 26
+
+def _midpoint(a: str, b: str | None) -> str:
+    """Get a fraction between the fractions a and b, where None is the end."""
+    if b is not None and a >= b:
+        msg = f"{a!r} is not less than {b!r}"
+        raise ValueError(msg)
+    if a[-1:] == _ZERO or (b is not None and b[-1:] == _ZERO):
+        msg = "Fractions can't end in the zero digit"
+        raise ValueError(msg)
+
+    if b:
+        # Keep any common prefix, padding a with zeros.
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else _ZERO) == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+
+    digit_a = DIGITS.index(a[0]) if a else 0
+    digit_b = DIGITS.index(b[0]) if b else len(DIGITS)
+    if digit_b - digit_a > 1:
+        return DIGITS[(digit_a + digit_b + 1) // 2]
+
+    # The first digits are consecutive.
+    if b is not None and len(b) > 1:
+        return b[:1]
+    return DIGITS[digit_a] + _midpoint(a[1:], None)
+
+def _integer_length(head: str) -> int:
+    if "a" <= head <= "z":
+        return ord(head) - ord("a") + 2
+    if "A" <= head <= "Z":
+        return ord("Z") - ord(head) + 2
+    msg = f"Invalid key head {head!r}"
+    raise ValueError(msg)
+
+def _split(key: str) -> tuple[str, str]:
+    """Split a key into its integer and fractional parts."""
+    length = _integer_length(key[:1])
+    if length > len(key):
+        msg = f"Invalid key {key!r}"
+        raise ValueError(msg)
+    return key[:length], key[length:]
+
+def validate_key(key: str) -> None:
+    """Raise ValueError if the key is not a valid key."""
+    if not key or key == _SMALLEST_INTEGER:
+        msg = f"Invalid key {key!r}"
+        raise ValueError(msg)
+    _, fraction = _split(key)
+    if fraction[-1:] == _ZERO or any(digit not in DIGITS for digit in key[1:]):
+        msg = f"Invalid key {key!r}"
+        raise ValueError(msg)
+
+def _increment_integer(integer: str) -> str | None:
+    """Get the next integer part, or None if this is the largest."""
+    head, digits = integer[0], list(integer[1:])
+    for i in reversed(range(len(digits))):
+        digit = DIGITS.index(digits[i]) + 1
+        if digit < len(DIGITS):
+            digits[i] = DIGITS[digit]
+            return head + "".join(digits)
+        digits[i] = _ZERO
+
+    # Every digit carried, so the integer part gets a digit longer.
+    if head == "Z":
+        return "a" + _ZERO
+    if head == "z":
+        return None
+    head = chr(ord(head) + 1)
+    if head > "a":
+        digits.append(_ZERO)
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+def _decrement_integer(integer: str) -> str | None:
+    """Get the previous integer part, or None if this is the smallest."""
+    head, digits = integer[0], list(integer[1:])
+    for i in reversed(range(len(digits))):
+        digit = DIGITS.index(digits[i]) - 1
+        if digit >= 0:
+            digits[i] = DIGITS[digit]
+            return head + "".join(digits)
+        digits[i] = DIGITS[-1]
+
+    # Every digit borrowed, so the integer part gets a digit shorter.
+    if head == "a":
+        return "Z" + DIGITS[-1]
+    if head == "A":
+        return None
+    head = chr(ord(head) - 1)
+    if head < "Z":
+        digits.append(DIGITS[-1])
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+def generate_key_between(a: str | None, b: str | None) -> str:
+    """Generate a key that sorts after a and before b.
+
+    None means the start for a and the end for b, so generate_key_between(None,
+    None) is the first key of an empty list.
+    """
+    if a is not None:
+        validate_key(a)
+    if b is not None:
+        validate_key(b)
+    if a is not None and b is not None and a >= b:
+        msg = f"{a!r} is not less than {b!r}"
+        raise ValueError(msg)
+
+    if a is None:
+        return "a" + _ZERO if b is None else _key_before(b)
+
+    integer_a, fraction_a = _split(a)
+    incremented = _increment_integer(integer_a)
+    if b is None:
+        return integer_a + _midpoint(fraction_a, None) if incremented is None else incremented
+
+    integer_b, fraction_b = _split(b)
+    if integer_a == integer_b:
+        return integer_a + _midpoint(fraction_a, fraction_b)
+    if incremented is not None and incremented < b:
+        return incremented
+    return integer_a + _midpoint(fraction_a, None)
+
+def _key_before(b: str) -> str:
+    integer_b, fraction_b = _split(b)
+    if integer_b == _SMALLEST_INTEGER:
+        return integer_b + _midpoint("", fraction_b)
+    if integer_b < b:
+        return integer_b
+    decremented = _decrement_integer(integer_b)
+    if decremented is None:
+        msg = "Can't generate a key before the smallest key"
+        raise ValueError(msg)
+    return decremented
+
+def generate_n_keys_between(a: str | None, b: str | None, n: int) -> list[str]:
+    """Generate n ascending keys after a and before b.
+
+    Keys are spread out between a and b where both are given, so that they stay
+    short.
+    """
+    if n <= 0:
+        return []
+    if n == 1:
+        return [generate_key_between(a, b)]
+
+    keys: list[str] = []
+    if b is None:
+        key = a
+        for _ in range(n):
+            key = generate_key_between(key, None)
+            keys.append(key)
+        return keys
+    if a is None:
+        key = b
+        for _ in range(n):
+            key = generate_key_between(None, key)
+            keys.append(key)
+        keys.reverse()
+        return keys
+
+    middle = n // 2
+    key = generate_key_between(a, b)
+    return [
+        *generate_n_keys_between(a, key, middle),
+        key,
+        *generate_n_keys_between(key, b, n - middle - 1),
+    ]
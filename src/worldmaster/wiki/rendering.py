@@ -0,0 +1,112 @@
+"""Server-side rendering of Tiptap section bodies.
+
+render_html turns the JSON document of a section into the same HTML that
+Tiptap's generateHTML produces with the StarterKit extensions, so articles can
+be sent already rendered.  Unknown nodes render only their content, and unknown
+marks are left out, rather than failing the whole section.
+"""
+from __future__ import annotations
+
+from typing import Any
+
+# The tags of nodes that only wrap their content.
+_BLOCKS = {
+    "blockquote": "blockquote",
+    "bulletList": "ul",
+    "listItem": "li",
+    "paragraph": "p",
+}
+
+# Nodes without content.
+_VOID = {
+    "hardBreak": "<br>",
+    "horizontalRule": "<hr>",
+}
+
+_MARKS = {
+    "bold": "strong",
+    "code": "code",
+    "italic": "em",
+    "strike": "s",
+}
+
+_HEADING_LEVELS = range(1, 7)
+
+_TEXT_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", "\u00a0": "&nbsp;"})
+
+_ATTRIBUTE_ESCAPES = str.maketrans({"&": "&amp;", '"': "&quot;", "\u00a0": "&nbsp;"})
+
+def render_html(body: Any) -> str:
+    """Render a Tiptap JSON document to HTML.
+
+    Anything that isn't a JSON object, like the empty list of a new section,
+    renders to nothing.
+    """
+    if not isinstance(body, dict):
+        return ""
+    out: list[str] = []
+    _render_node(body, out)
+    return "".join(out)
+
+def _attribute(name: str, value: Any) -> str:
+    return f' {name}="{str(value).translate(_ATTRIBUTE_ESCAPES)}"'
+
+def _render_node(node: dict[str, Any], out: list[str]) -> None:
+    type = node.get("type")
+    attrs = node.get("attrs") or {}
+
+    if type == "text":
+        out.append(str(node.get("text", "")).translate(_TEXT_ESCAPES))
+        return
+
+    if type in _VOID:
+        out.append(_VOID[type])
+        return
+
+    start_tag = end_tag = ""
+    if type in _BLOCKS:
+        tag = _BLOCKS[type]
+        start_tag, end_tag = f"<{tag}>", f"</{tag}>"
+    elif type == "heading":
+        level = attrs.get("level")
+        if level not in _HEADING_LEVELS:
+            level = _HEADING_LEVELS[0]
+        start_tag, end_tag = f"<h{level}>", f"</h{level}>"
+    elif type == "orderedList":
+        start = attrs.get("start", 1)
+        start_tag = "<ol>" if start in (1, None) else f"<ol{_attribute('start', start)}>"
+        end_tag = "</ol>"
+    elif type == "codeBlock":
+        language = attrs.get("language")
+        start_tag = f"<pre><code{_attribute('class', f'language-{language}') if language else ''}>"
+        end_tag = "</code></pre>"
+
+    out.append(start_tag)
+    _render_content(node.get("content") or (), out)
+    out.append(end_tag)
+
+def _render_content(nodes: Any, out: list[str]) -> None:
+    """Render a list of sibling nodes.
+
+    Like ProseMirror's DOMSerializer, marks shared by adjacent nodes stay open
+    rather than being closed and reopened.
+    """
+    active: list[str] = []
+    for node in nodes:
+        if not isinstance(node, dict):
+            continue
+        marks = [
+            mark["type"]
+            for mark in node.get("marks") or ()
+            if isinstance(mark, dict) and mark.get("type") in _MARKS
+        ]
+
+        keep = 0
+        while keep < min(len(active), len(marks)) and active[keep] == marks[keep]:
+            keep += 1
+        out.extend(f"</{_MARKS[mark]}>" for mark in reversed(active[keep:]))
+        out.extend(f"<{_MARKS[mark]}>" for mark in marks[keep:])
+        active = marks
+
+        _render_node(node, out)
+    out.extend(f"</{_MARKS[mark]}>" for mark in reversed(active))
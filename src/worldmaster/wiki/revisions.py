@@ -0,0 +1,214 @@
+"""Revision history of section bodies, stored as snapshots and JSON Patch deltas.
+
+Every write that changes a section's body records a SectionRevision, numbered
+from 0 per section.  Every WORLDMASTER_WIKI_SNAPSHOT_INTERVAL-th revision,
+and the first, stores the whole body, and the rest store a wiki.jsonpatch
+delta from the revision before them, so storage grows with the size of edits
+rather than the size of sections.  The model is defined here, so this module
+needs nothing from wiki.models at import time, and wiki.models re-exports it.
+
+Reconstructing a revision reads its nearest snapshot and the deltas after it
+in one query, so it never replays more than an interval's worth of deltas.
+compact_revisions thins out old history by merging each run of old deltas
+after a snapshot into a single delta.
+"""
+from __future__ import annotations
+
+from itertools import groupby
+from typing import TYPE_CHECKING, Any
+
+from django.conf import settings
+from django.db import models, transaction
+
+from . import jsonpatch
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from datetime import datetime
+
+    from django.contrib.auth.models import AbstractUser, AnonymousUser
+
+    from worldmaster.worldmaster.models import User
+
+    from .models import Section
+
+# How many revisions are written or deleted per query.
+_BATCH_SIZE = 500
+
+def _snapshot_interval() -> int:
+    return getattr(settings, "WORLDMASTER_WIKI_SNAPSHOT_INTERVAL", 20)
+
+class SectionRevision(models.Model):
+    """A revision of a section's body, as a snapshot or a delta from the previous revision."""
+
+    id: int | None
+
+    section: models.ForeignKey[Section, Section] = models.ForeignKey(
+        "Section",
+        on_delete=models.CASCADE,
+        related_name="revisions",
+        related_query_name="revision",
+    )
+
+    number = models.PositiveIntegerField(
+        help_text="The revision number, counting from 0 for each section.",
+    )
+
+    user: models.ForeignKey[User | None, User | None] = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="+",
+        help_text="The user who made the revision, if known.",
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    snapshot = models.JSONField(
+        blank=True,
+        null=True,
+        default=None,
+        help_text="The whole body, for snapshot revisions.",
+    )
+
+    delta = models.JSONField(
+        blank=True,
+        null=True,
+        default=None,
+        help_text="A JSON Patch from the previous revision's body, for delta revisions.",
+    )
+
+    def __str__(self) -> str:
+        kind = "snapshot" if self.snapshot is not None else "delta"
+        return f"<SectionRevision: {self.section_id} {self.number} {kind}>"
+
+    __repr__ = __str__
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["section", "number"], name="unique_section_revision_number"),
+        ]
+
+        ordering = ("section", "number")
+
+def record_revisions(
+    changes: Iterable[tuple[Section, Any]],
+    user: AbstractUser | AnonymousUser | None = None,
+) -> None:
+    """Record new revisions of sections, given as (section, previous body) pairs.
+
+    The previous body is the one that was last stored, or None for a new
+    section.  Sections are given after they have been saved, and ones whose
+    body hasn't changed are skipped.
+    """
+    changes = list(changes)
+    if not changes:
+        return
+
+    latest = dict(
+        SectionRevision.objects
+        .filter(section_id__in={section.id for section, _ in changes})
+        .values("section_id")
+        .annotate(latest=models.Max("number"))
+        .values_list("section_id", "latest"),
+    )
+    interval = _snapshot_interval()
+    revision_user = user if user is not None and user.is_authenticated else None
+
+    revisions: list[SectionRevision] = []
+    for section, previous in changes:
+        # A section with no revisions yet may predate revision history, so its
+        # previous body can't be a base for a delta.
+        if section.id not in latest or previous is None:
+            number = 0 if section.id not in latest else latest[section.id] + 1
+            revision = SectionRevision(section=section, number=number, snapshot=section.body)
+        else:
+            delta = jsonpatch.diff(previous, section.body)
+            if not delta:
+                continue
+            number = latest[section.id] + 1
+            if number % interval == 0:
+                revision = SectionRevision(section=section, number=number, snapshot=section.body)
+            else:
+                revision = SectionRevision(section=section, number=number, delta=delta)
+        revision.user = revision_user
+        revisions.append(revision)
+        latest[section.id] = number
+    SectionRevision.objects.bulk_create(revisions, batch_size=_BATCH_SIZE)
+
+def body_at(section: Section, number: int | None = None) -> Any:
+    """Reconstruct the body of a section at a revision, by default its latest one.
+
+    Raises SectionRevision.DoesNotExist if the section has no such revision.
+    """
+    revisions = SectionRevision.objects.filter(section=section)
+    if number is not None:
+        revisions = revisions.filter(number__lte=number)
+    snapshot = (
+        revisions
+        .filter(snapshot__isnull=False)
+        .order_by("-number")
+        .values("number")[:1]
+    )
+    chain = list(
+        revisions
+        .filter(number__gte=models.Subquery(snapshot))
+        .order_by("number")
+        .values_list("number", "snapshot", "delta"),
+    )
+    if not chain or (number is not None and chain[-1][0] != number):
+        msg = "SectionRevision matching query does not exist."
+        raise SectionRevision.DoesNotExist(msg)
+
+    _, body, _ = chain[0]
+    for _, _, delta in chain[1:]:
+        body = jsonpatch.apply(body, delta)
+    return body
+
+def compact_revisions(before: datetime) -> int:
+    """Merge the deltas of revisions created before a time, and return how many revisions were removed.
+
+    For each snapshot, the old deltas after it are replaced by a single delta
+    from the snapshot to the last of them, so later revisions still apply on
+    top of it.  Snapshots themselves and newer revisions are left alone.
+    """
+    removed = 0
+    old = (
+        SectionRevision.objects
+        .filter(created_at__lt=before)
+        .order_by("section_id", "number")
+        .values_list("id", "section_id", "snapshot", "delta")
+    )
+    with transaction.atomic():
+        merged: list[SectionRevision] = []
+        obsolete: list[int] = []
+        for _, revisions in groupby(old.iterator(chunk_size=_BATCH_SIZE), key=lambda revision: revision[1]):
+            for window in _windows(revisions):
+                (_, _, base, _), *deltas = window
+                if len(deltas) <= 1:
+                    continue
+                body = base
+                for _, _, _, delta in deltas:
+                    body = jsonpatch.apply(body, delta)
+                last_id = deltas[-1][0]
+                merged.append(SectionRevision(id=last_id, delta=jsonpatch.diff(base, body)))
+                obsolete.extend(id for id, *_ in deltas[:-1])
+
+        SectionRevision.objects.bulk_update(merged, ("delta",), batch_size=_BATCH_SIZE)
+        for start in range(0, len(obsolete), _BATCH_SIZE):
+            removed += SectionRevision.objects.filter(id__in=obsolete[start:start + _BATCH_SIZE]).delete()[0]
+    return removed
+
+def _windows(revisions: Iterable[tuple[int, int, Any, Any]]) -> Iterable[list[tuple[int, int, Any, Any]]]:
+    """Split a section's revisions into runs that start with a snapshot."""
+    window: list[tuple[int, int, Any, Any]] = []
+    for revision in revisions:
+        if revision[2] is not None:
+            if window:
+                yield window
+            window = [revision]
+        elif window:
+            window.append(revision)
+    if window:
+        yield window
@@ -0,0 +1,139 @@
+"""Full-text search over wiki sections with SQLite FTS5.
+
+The plain text of every section is kept in the wiki_section_search FTS5 table,
+with the section id as its rowid.  The wiki signals and update_sections keep it
+in sync, and the rebuild_search_index command refills it from scratch.
+
+search_sections joins the table onto an ordinary Section queryset, so results
+are filtered by RoleTargetManager.visible_to, ranked, and snippeted all in the
+same query.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+from django.db import connection, transaction
+from django.utils.html import escape
+from django.utils.safestring import SafeString, mark_safe
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from django.contrib.auth.models import AbstractUser, AnonymousUser
+
+    from worldmaster.roles.models import RoleTarget, RoleTargetQuerySet
+
+    from .models import Section
+
+TABLE = "wiki_section_search"
+
+# Control characters around matches in snippets, which can't appear in
+# escaped HTML, so the snippet can be escaped before they become tags.
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+
+# How many tokens a snippet has.
+_SNIPPET_TOKENS = 16
+
+# How many sections are read and indexed at a time when rebuilding.
+_REBUILD_BATCH_SIZE = 2000
+
+def section_text(body: Any) -> str:
+    """Extract the plain text of a Tiptap JSON document, with a line per block."""
+    parts: list[str] = []
+    _collect_text(body, parts)
+    return "".join(parts).strip()
+
+def _collect_text(node: Any, parts: list[str]) -> None:
+    if not isinstance(node, dict):
+        return
+    type = node.get("type")
+    if type == "text":
+        parts.append(str(node.get("text", "")))
+    elif type == "hardBreak":
+        parts.append("\n")
+    else:
+        for child in node.get("content") or ():
+            _collect_text(child, parts)
+        parts.append("\n")
+
+def index_sections(sections: Iterable[tuple[int, Any]]) -> None:
+    """Index or reindex sections, given as (id, body) pairs."""
+    rows = [(id, section_text(body)) for id, body in sections]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(id,) for id, _ in rows])
+        cursor.executemany(f"INSERT INTO {TABLE} (rowid, text) VALUES (%s, %s)", rows)
+
+def unindex_sections(ids: Iterable[int]) -> None:
+    """Remove sections from the index."""
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(id,) for id in ids])
+
+def rebuild_search_index() -> int:
+    """Reindex every section from scratch, and return how many there are."""
+    # Imported here because .models imports this module.
+    from .models import Section  # noqa: PLC0415
+
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        batch: list[tuple[int, str]] = []
+        for id, body in Section.objects.values_list("id", "body").iterator(chunk_size=_REBUILD_BATCH_SIZE):
+            batch.append((id, section_text(body)))
+            if len(batch) >= _REBUILD_BATCH_SIZE:
+                cursor.executemany(f"INSERT INTO {TABLE} (rowid, text) VALUES (%s, %s)", batch)
+                count += len(batch)
+                batch.clear()
+        cursor.executemany(f"INSERT INTO {TABLE} (rowid, text) VALUES (%s, %s)", batch)
+        count += len(batch)
+        # Merge the index's b-trees, which makes queries faster.
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return count
+
+def _match_expression(query: str) -> str:
+    """Turn user input into an FTS5 query that matches every word.
+
+    Every word is quoted, so FTS5 syntax in the input is searched for literally
+    rather than being able to make the query invalid.
+    """
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+def search_sections(
+    user: AbstractUser | AnonymousUser,
+    query: str,
+    *,
+    under: RoleTarget | None = None,
+) -> RoleTargetQuerySet[Section]:
+    """Find the sections visible to the user that match every word of the query, best first.
+
+    Each section is annotated with its bm25 rank and a snippet, which should be
+    displayed through highlight().  If under is given, only sections in its
+    subtree are searched.
+    """
+    # Imported here because .models imports this module.
+    from .models import Section  # noqa: PLC0415
+
+    match = _match_expression(query)
+    sections = Section.objects.visible_to(user)
+    if not match:
+        return sections.none()
+    if under is not None:
+        sections = sections.under(under)
+
+    return sections.extra(
+        select={
+            "rank": f"{TABLE}.rank",
+            "snippet": f"snippet({TABLE}, 0, %s, %s, %s, %s)",
+        },
+        select_params=(_MATCH_START, _MATCH_END, "…", _SNIPPET_TOKENS),
+        tables=(TABLE,),
+        where=(f"{TABLE}.rowid = {Section._meta.db_table}.id", f"{TABLE} MATCH %s"),
+        params=(match,),
+        order_by=("rank",),
+    )
+
+def highlight(snippet: str) -> SafeString:
+    """Escape a search snippet, and wrap its matches in <mark>."""
+    return mark_safe(escape(snippet).replace(_MATCH_START, "<mark>").replace(_MATCH_END, "</mark>"))
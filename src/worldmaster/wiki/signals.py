@@ -1,11 +1,16 @@
 from typing import Any
 
 from django.db import models
-from django.db.models.signals import post_delete, pre_save
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
 from django.dispatch import receiver
 from worldmaster.roles.models import RoleTarget
 
-from .models import Article, ArticleBase, Section
+from .models import Article, ArticleBase, Section, content_hash, deleting_in_bulk
+from .ordering import generate_key_between
+from .rendering import render_html
+from .revisions import record_revisions
+from .search import index_sections, unindex_sections
 
 
 @receiver(pre_save, sender=Article)
@@ -35,6 +40,107 @@ def add_section_role_target(
             parent=instance.article.role_target,
         )
 
+@receiver(pre_save, sender=Section)
+def update_section_content(
+    sender: type[models.Model],
+    instance: Section,
+    raw: bool,
+    **kwargs: Any,
+) -> None:
+    """Keep the content hash and rendered HTML in line with the body and key.
+
+    New sections without a key are put at the end of their article.
+    """
+    if not raw:
+        if not instance.key:
+            last = Section.objects.filter(article_id=instance.article_id).aggregate(last=Max("key"))["last"]
+            instance.key = generate_key_between(last, None)
+        instance.content_hash = content_hash(instance.body, instance.key)
+        instance.html = render_html(instance.body)
+
+@receiver(post_init, sender=Section)
+def section_post_init(
+    sender: type[models.Model],
+    instance: Section,
+    **kwargs: Any,
+) -> None:
+    """Remember the loaded content, so that saves can tell whether the body changed.
+
+    This avoids reloading the section before every save.
+    """
+    fields = instance.__dict__
+    if instance.pk is None or not {"content_hash", "key", "body"} <= fields.keys():
+        instance._loaded_content = None
+    else:
+        instance._loaded_content = (fields["content_hash"], fields["key"], fields["body"])
+
+@receiver(post_save, sender=Section)
+def record_section_revision(
+    sender: type[models.Model],
+    instance: Section,
+    created: bool,
+    raw: bool,
+    update_fields: frozenset[str] | None,
+    **kwargs: Any,
+) -> None:
+    """Record a revision if the section's body changed.
+
+    The body may have been changed in place, so the loaded body is only used as
+    the base of a delta if it still matches the loaded content hash.  Otherwise,
+    or if the body wasn't loaded, a snapshot is recorded.
+    """
+    if raw or (update_fields is not None and "body" not in update_fields):
+        return
+    loaded = instance._loaded_content
+    instance._loaded_content = (instance.content_hash, instance.key, instance.body)
+    if created or loaded is None:
+        record_revisions(((instance, None),))
+        return
+
+    loaded_hash, loaded_key, loaded_body = loaded
+    if content_hash(instance.body, loaded_key) == loaded_hash:
+        return
+    previous = loaded_body if content_hash(loaded_body, loaded_key) == loaded_hash else None
+    record_revisions(((instance, previous),))
+
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+def invalidate_rendered_article(
+    sender: type[models.Model],
+    instance: Section,
+    **kwargs: Any,
+) -> None:
+    """Invalidate the cached renders of the section's article.
+
+    update_sections does this itself for the sections it deletes.
+    """
+    if not deleting_in_bulk():
+        Article.bump_versions((instance.article_id,))
+
+@receiver(post_save, sender=Section)
+def index_section(
+    sender: type[models.Model],
+    instance: Section,
+    raw: bool,
+    **kwargs: Any,
+) -> None:
+    """Keep the section's search text up to date."""
+    if not raw:
+        index_sections(((instance.pk, instance.body),))
+
+@receiver(post_delete, sender=Section)
+def unindex_section(
+    sender: type[models.Model],
+    instance: Section,
+    **kwargs: Any,
+) -> None:
+    """Remove the section from search.
+
+    update_sections does this itself for the sections it deletes.
+    """
+    if not deleting_in_bulk():
+        unindex_sections((instance.pk,))
+
 # Automatically set up article deletion.
 # This will not catch any classes that do not exist before this signal is
 # registered, or articles that are manually set up without using ArticleBase.
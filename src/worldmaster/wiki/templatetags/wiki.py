@@ -1,8 +1,23 @@
 from json import dumps
 
 from django import template
+from django.utils.safestring import mark_safe
+
+from worldmaster.wiki.fragment_cache import rendered_article as _rendered_article
+from worldmaster.wiki.search import highlight
 
 register = template.Library()
 
 json = register.simple_tag(name="json")(dumps)
 
+register.filter(name="highlight")(highlight)
+
+@register.simple_tag
+def rendered_article(user, article):
+    """Render the sections of the article that the user can see, from the cache where possible."""
+    return mark_safe(_rendered_article(user, article))
+
+@register.simple_tag
+def sections_for(user, article):
+    """Get the sections of the article that the user can see, annotated with is_editor."""
+    return article.sections_for(user)
@@ -1,6 +1,18 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
+from worldmaster.roles.offboarding import remove_user_roles
+
 from .models import User
 
-admin.site.register(User, UserAdmin)
+
+@admin.action(description="Remove all roles of selected users")
+def remove_roles(modeladmin, request, queryset):
+    """Remove the selected users' roles in bulk, keeping the users."""
+    for user in queryset:
+        modeladmin.message_user(request, f"Removed {remove_user_roles(user)} from {user}")
+
+class WorldmasterUserAdmin(UserAdmin):
+    actions = (remove_roles,)
+
+admin.site.register(User, WorldmasterUserAdmin)
@@ -11,6 +11,7 @@ urlpatterns = [
     path("wm-new/", views.NewWorldView.as_view(), name="new-world"),
     path("<slug:world_slug>/", views.WorldView.as_view(), name="world"),
     path("<slug:world_slug>/edit/", views.EditWorldView.as_view(), name="edit-world"),
+    path("<slug:world_slug>/search/", views.SearchView.as_view(), name="search"),
     path("<slug:world_slug>/planes/", views.PlanesView.as_view(), name="planes"),
     path("<slug:world_slug>/planes/wm-new/", views.NewPlaneView.as_view(), name="new-plane"),
     path("<slug:world_slug>/planes/<slug:plane_slug>/", views.PlaneView.as_view(), name="plane"),
@@ -8,6 +8,7 @@ from django.db import transaction
 from django.urls import reverse
 from django.views.generic import CreateView, DetailView, ListView, UpdateView
 
+from worldmaster.roles.deferred import deferred_role_rebuild
 from worldmaster.roles.models import Role
 from worldmaster.worlds.forms import PlaneForm
 from worldmaster.worlds.models import Plane, World
@@ -88,6 +89,7 @@ class NewPlaneView(LoginRequiredMixin, CreateView):
         return response
 
     @transaction.atomic
+    @deferred_role_rebuild()
     def post(self, *args, **kwargs) -> HttpResponse:
         return super().post(*args, **kwargs)
 
@@ -113,6 +115,7 @@ class EditPlaneView(LoginRequiredMixin, UpdateView):
         return data
 
     @transaction.atomic
+    @deferred_role_rebuild()
     def post(self, *args, **kwargs) -> HttpResponse:
         return super().post(*args, **kwargs)
 
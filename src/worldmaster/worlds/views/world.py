@@ -9,9 +9,12 @@ from django.http import HttpResponse
 from django.urls import reverse
 from django.views.generic import CreateView, DetailView, ListView, UpdateView
 
+from worldmaster.roles.deferred import deferred_role_rebuild
 from worldmaster.roles.models import Role
+from worldmaster.wiki.models import Section
+from worldmaster.wiki.search import search_sections
 from worldmaster.worlds.forms import WorldForm
-from worldmaster.worlds.models import World
+from worldmaster.worlds.models import Plane, World
 
 User = cast(type[AbstractUser], get_user_model())
 
@@ -32,6 +35,48 @@ class WorldView(DetailView):
         """Get the visible worlds for the given user."""
         return World.objects.visible_to(cast(AbstractUser | AnonymousUser, self.request.user))
 
+class SearchView(ListView):
+    """Search the wiki sections of a world that the user can see."""
+
+    template_name = "worlds/world/search.html"
+
+    # How many results are shown.
+    limit = 50
+
+    def setup(self, request, *args, world_slug, **kwargs) -> None:
+        super().setup(request, *args, world_slug=world_slug, **kwargs)
+        self.__world = World.objects.visible_to(
+            cast(AbstractUser | AnonymousUser, self.request.user),
+        ).filter(slug=world_slug).get()
+
+    def get_queryset(self) -> list[Section]:
+        """Get the best matching sections, each with the url of the page it is on, if it has one."""
+        sections = list(search_sections(
+            cast(AbstractUser | AnonymousUser, self.request.user),
+            self.request.GET.get("q", ""),
+            under=self.__world.role_target,
+        )[:self.limit])
+
+        article_ids = {section.article_id for section in sections}
+        urls: dict[int, str] = {}
+        if self.__world.article_id in article_ids:
+            urls[self.__world.article_id] = reverse("worlds:world", args=(self.__world.slug,))
+        for article_id, slug in Plane.objects.filter(
+            world=self.__world,
+            article_id__in=article_ids,
+        ).values_list("article_id", "slug"):
+            urls[article_id] = reverse("worlds:plane", args=(self.__world.slug, slug))
+
+        for section in sections:
+            section.url = urls.get(section.article_id)
+        return sections
+
+    def get_context_data(self, **kwargs) -> dict[str, Any]:
+        context = super().get_context_data(**kwargs)
+        context["world"] = self.__world
+        context["query"] = self.request.GET.get("q", "")
+        return context
+
 class NewWorldView(LoginRequiredMixin, CreateView):
     model = World
     form_class = WorldForm
@@ -53,6 +98,7 @@ class NewWorldView(LoginRequiredMixin, CreateView):
         return response
 
     @transaction.atomic
+    @deferred_role_rebuild()
     def post(self, *args, **kwargs) -> HttpResponse:
         return super().post(*args, **kwargs)
 
@@ -74,6 +120,7 @@ class EditWorldView(LoginRequiredMixin, UpdateView):
         return data
 
     @transaction.atomic
+    @deferred_role_rebuild()
     def post(self, *args, **kwargs) -> HttpResponse:
         return super().post(*args, **kwargs)
 
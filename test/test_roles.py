@@ -1,13 +1,38 @@
 from __future__ import annotations
 
+import json
+from datetime import timedelta
+from io import StringIO
 from typing import TYPE_CHECKING, cast
+from unittest.mock import patch
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
-from django.core.exceptions import ValidationError
-from django.test import TestCase
-from worldmaster.roles.models import Role, RoleTarget
-from worldmaster.wiki.models import Article
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import connection
+from django.http import Http404, QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from worldmaster.roles import permission_cache
+from worldmaster.roles.cache import role_cache
+from worldmaster.roles.deferred import deferred_role_rebuild
+from worldmaster.roles.models import (
+    EffectiveRole,
+    Role,
+    RolePropagationJob,
+    RoleRebuildCheckpoint,
+    RoleTarget,
+    RoleTargetAncestor,
+)
+from worldmaster.roles.matrix import permission_matrix
+from worldmaster.roles.offboarding import remove_user_roles
+from worldmaster.roles.tree import role_tree, verify_tree
+from worldmaster.roles.verify import verify_roles
+from worldmaster.wiki.models import Article, Section, content_hash
 from worldmaster.worlds.models import Plane, World
 
 if TYPE_CHECKING:
@@ -15,8 +40,19 @@ if TYPE_CHECKING:
 
 User = cast(type["worldmaster.User"], get_user_model())
 
+def _shared_cache_client() -> LocMemCache:
+    """Open another client of the default cache, as another process would.
+
+    LocMemCaches with the same location share their storage, like clients of
+    one Memcached or Redis server.
+    """
+    return LocMemCache(settings.CACHES["default"].get("LOCATION", ""), {})
+
 class RoleTestCase(TestCase):
     def setUp(self) -> None:
+        # Cached roles outlive the rolled-back test transactions.
+        cache.clear()
+
         self.user = User.objects.create(username="test")
         self.user.set_unusable_password()
 
@@ -861,3 +897,686 @@ class RoleTestCase(TestCase):
         role.save()
 
 
+    def _role_rows(self) -> set[tuple[int, int | None, int, bool]]:
+        return set(Role.objects.values_list("target_id", "user_id", "type", "explicit"))
+
+    def test_propagation_matches_rebuild(self):
+        entity = self.world.entity_set.create(
+            slug="entity",
+            name="Entity",
+        )
+        section = self.article.sections.create(body=[])
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.world_target.roles.create(user=None, type=Role.Type.VIEWER)
+        section.role_target.roles.create(user=self.other_user, type=Role.Type.EDITOR)
+        self.plane_target.roles.create(user=self.other_user, type=Role.Type.MASTER)
+        entity.role_target.roles.create(user=None, type=Role.Type.MASTER)
+
+        self.plane_target.roles.get(user=self.other_user, type=Role.Type.MASTER).delete()
+        role = section.role_target.roles.get(user=self.other_user, type=Role.Type.EDITOR)
+        role.target = self.plane_target
+        role.save()
+
+        propagated = self._role_rows()
+        masks = self._effective_rows()
+        Role.rebuild()
+        self.assertEqual(propagated, self._role_rows())
+        self.assertEqual(masks, self._effective_rows())
+
+    def _effective_rows(self) -> set[tuple[int, int | None, int]]:
+        return set(EffectiveRole.objects.values_list("target_id", "user_id", "mask"))
+
+    def test_effective_roles_match_roles(self):
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.plane_target.roles.create(user=None, type=Role.Type.VIEWER)
+        self.article_target.roles.create(user=self.other_user, type=Role.Type.EDITOR)
+
+        masks: dict[tuple[int, int | None], int] = {}
+        for target_id, user_id, type, _ in self._role_rows():
+            masks[(target_id, user_id)] = masks.get((target_id, user_id), 0) | (1 << type)
+        self.assertEqual(
+            {(target_id, user_id, mask) for (target_id, user_id), mask in masks.items()},
+            self._effective_rows(),
+        )
+        self.assertEqual(
+            EffectiveRole.objects.get(target=self.plane_target, user=self.user).types,
+            {Role.Type.MASTER, Role.Type.EDITOR, Role.Type.VIEWER},
+        )
+
+        self.world_target.roles.get(user=self.user, explicit=True).delete()
+        self.assertFalse(EffectiveRole.objects.filter(user=self.user).exists())
+
+    def test_propagation_is_incremental(self):
+        self.world_target.roles.create(user=self.other_user, type=Role.Type.MASTER)
+        other_ids = set(Role.objects.filter(user=self.other_user).values_list("id", flat=True))
+
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.world_target.roles.get(user=self.user, type=Role.Type.MASTER).delete()
+
+        self.assertEqual(
+            other_ids,
+            set(Role.objects.filter(user=self.other_user).values_list("id", flat=True)),
+        )
+        self.assertFalse(Role.objects.filter(user=self.user).exists())
+
+    def test_rebuild_restores_implicit_roles(self):
+        self.world.entity_set.create(
+            slug="entity",
+            name="Entity",
+        )
+        self.article.sections.create(body=[])
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.plane_target.roles.create(user=None, type=Role.Type.EDITOR)
+
+        expected = self._role_rows()
+        Role.objects.filter(explicit=False).delete()
+        Role.rebuild()
+        self.assertEqual(expected, self._role_rows())
+
+    def _ancestry(self) -> set[tuple[int, int, int]]:
+        return set(RoleTargetAncestor.objects.values_list("ancestor_id", "descendant_id", "depth"))
+
+    def test_ancestry(self):
+        section = self.article.sections.create(body=[])
+        section_target = section.role_target
+
+        self.assertEqual(
+            list(section_target.ancestors()),
+            [section_target, self.plane_target, self.world_target],
+        )
+        self.assertEqual(
+            set(self.world_target.descendants()),
+            {self.world_target, self.plane_target, section_target},
+        )
+        self.assertTrue(section_target.is_descendant_of(self.world_target))
+        self.assertFalse(self.world_target.is_descendant_of(section_target))
+        self.assertIn(self.plane, Plane.objects.under(self.world_target))
+
+        self.plane_target.parent = None
+        self.plane_target.save()
+        self.assertFalse(section_target.is_descendant_of(self.world_target))
+        self.assertTrue(section_target.is_descendant_of(self.plane_target))
+
+        self.plane_target.parent = self.world_target
+        self.plane_target.save()
+        expected = self._ancestry()
+        RoleTargetAncestor.rebuild()
+        self.assertEqual(expected, self._ancestry())
+
+        with self.assertRaises(ValueError):
+            self.world_target.parent = section_target
+            self.world_target.save()
+
+    def test_reparent_moves_inherited_roles(self):
+        other_world = World.objects.create(slug="other", name="Other")
+        other_world.role_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.world_target.roles.create(user=self.other_user, type=Role.Type.MASTER)
+
+        self.plane_target.parent = other_world.role_target
+        self.plane_target.save()
+
+        self.assertTrue(self.plane_target.user_is_master(self.user))
+        self.assertFalse(self.plane_target.user_is_master(self.other_user))
+
+    def test_move_to_only_propagates_changed_users(self):
+        other_world = World.objects.create(slug="other", name="Other")
+        # Both worlds give this user the same roles.
+        both = User.objects.create(username="both")
+        self.world_target.roles.create(user=both, type=Role.Type.MASTER)
+        other_world.role_target.roles.create(user=both, type=Role.Type.MASTER)
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        other_world.role_target.roles.create(user=self.other_user, type=Role.Type.MASTER)
+
+        with patch.object(
+            RoleTarget,
+            "_propagate_roles",
+            autospec=True,
+            side_effect=RoleTarget._propagate_roles,
+        ) as propagate:
+            self.plane_target.move_to(other_world.role_target)
+        propagate.assert_called_once_with(self.plane_target, {self.user.id, self.other_user.id})
+
+        self.assertTrue(self.plane_target.user_is_master(self.other_user))
+        self.assertFalse(self.plane_target.user_is_master(self.user))
+        self.assertTrue(self.plane_target.user_is_master(both))
+        self.assertFalse(verify_roles())
+
+        with self.assertRaises(ValueError):
+            other_world.role_target.move_to(self.plane_target)
+
+    def test_move_refreshes_new_tree(self):
+        other_world = World.objects.create(slug="other", name="Other")
+        self.plane_target.roles.create(user=self.user, type=Role.Type.VIEWER)
+        self.assertEqual(set(permission_matrix(other_world.role_target).tree.index), {other_world.role_target.id})
+        self.assertFalse(other_world.role_target.user_is_viewer(self.user))
+
+        # Nobody inherits anything from either world, so nothing is propagated.
+        with patch.object(RoleTarget, "_propagate_roles") as propagate:
+            self.plane_target.move_to(other_world.role_target)
+        propagate.assert_not_called()
+
+        matrix = permission_matrix(other_world.role_target)
+        self.assertIn(self.plane_target.id, matrix.tree.index)
+        self.assertEqual(matrix.target_ids(matrix.bits(self.user.id, Role.Type.VIEWER)), [self.plane_target.id])
+        self.assertEqual(verify_tree(role_tree(other_world.role_target), (self.user,)), [])
+        self.assertNotIn(self.plane_target.id, role_tree(self.world_target).index)
+
+    def test_unchanged_saves_skip_rebuilds(self):
+        role = self.plane_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        with patch.object(RoleTarget, "_propagate_roles") as propagate:
+            self.plane_target.save()
+        propagate.assert_not_called()
+
+        # Moving a role only reads its target back when it changed.
+        with self.assertNumQueries(1), patch.object(RoleTarget, "_propagate_roles"):
+            role.save()
+        other_world = World.objects.create(slug="other", name="Other")
+        role.target = other_world.role_target
+        role.save()
+        self.assertTrue(other_world.role_target.user_is_master(self.user))
+        self.assertFalse(self.plane_target.user_is_master(self.user))
+
+    def test_role_cache(self):
+        with role_cache() as cache:
+            self.assertFalse(self.plane_target.user_is_master(self.user))
+            self.assertFalse(self.plane_target.user_is_editor(self.user))
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            with self.assertNumQueries(0):
+                self.assertFalse(self.plane_target.user_is_viewer(self.user))
+
+            self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+            self.assertTrue(self.plane_target.user_is_master(self.user))
+
+            cache.prefetch(self.anonymous_user, (self.world_target.id, self.plane_target.id))
+            with self.assertNumQueries(0):
+                self.assertFalse(self.world_target.user_is_viewer(self.anonymous_user))
+                self.assertFalse(self.plane_target.user_is_viewer(self.anonymous_user))
+
+    def test_permission_cache(self):
+        other_world = World.objects.create(slug="other", name="Other")
+
+        self.assertFalse(self.plane_target.user_is_master(self.user))
+        with self.assertNumQueries(0):
+            self.assertFalse(self.plane_target.user_is_master(self.user))
+
+        other_world.role_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        with self.assertNumQueries(0):
+            self.assertFalse(self.plane_target.user_is_master(self.user))
+
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.assertTrue(self.plane_target.user_is_master(self.user))
+
+        self.assertEqual(
+            permission_cache.root_ids((self.plane_target.id, other_world.role_target.id)),
+            {
+                self.plane_target.id: self.world_target.id,
+                other_world.role_target.id: other_world.role_target.id,
+            },
+        )
+
+        self.plane_target.parent = other_world.role_target
+        self.plane_target.save()
+        self.world_target.roles.get(user=self.user, type=Role.Type.MASTER).delete()
+        self.assertTrue(self.plane_target.user_is_master(self.user))
+        other_world.role_target.roles.get(user=self.user, type=Role.Type.MASTER).delete()
+        self.assertFalse(self.plane_target.user_is_master(self.user))
+
+    def test_permission_cache_across_processes(self):
+        self.assertFalse(self.plane_target.user_is_master(self.user))
+
+        # Another process, like the worker, has its own client of the shared
+        # cache.
+        other_process = _shared_cache_client()
+        with patch.object(permission_cache, "_cache", return_value=other_process):
+            self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.assertTrue(self.plane_target.user_is_master(self.user))
+
+        with patch.object(permission_cache, "_cache", return_value=other_process):
+            self.world_target.roles.get(user=self.user, type=Role.Type.MASTER).delete()
+        self.assertFalse(self.plane_target.user_is_master(self.user))
+
+    def test_roles_for(self):
+        self.world_target.roles.create(user=self.user, type=Role.Type.EDITOR)
+        self.plane_target.roles.create(user=None, type=Role.Type.VIEWER)
+        superuser = User.objects.create(username="super", is_superuser=True)
+
+        # The roots are cached by the grants, so only the roles are loaded.
+        with self.assertNumQueries(1):
+            roles = RoleTarget.roles_for(self.user, (self.world_target, self.plane_target.id))
+        self.assertEqual(
+            roles,
+            {
+                self.world_target.id: {Role.Type.EDITOR, Role.Type.VIEWER},
+                self.plane_target.id: {Role.Type.VIEWER},
+            },
+        )
+        self.assertEqual(
+            RoleTarget.roles_for(self.anonymous_user, (self.world_target, self.plane_target)),
+            {
+                self.world_target.id: set(),
+                self.plane_target.id: {Role.Type.VIEWER},
+            },
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                RoleTarget.roles_for(superuser, (self.world_target,)),
+                {self.world_target.id: set(Role.Type)},
+            )
+
+    def test_annotate_roles(self):
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.world_target.roles.create(user=None, type=Role.Type.VIEWER)
+
+        # Both the user and the public can view, but the world is only listed once.
+        self.assertEqual(World.objects.visible_to(self.user).count(), 1)
+
+        with self.assertNumQueries(1):
+            flags = {
+                (world.is_master, world.is_editor, world.is_viewer)
+                for world in World.objects.annotate_roles(self.user)
+            }
+        self.assertEqual(flags, {(True, True, True)})
+
+        world = World.objects.annotate_roles(self.other_user).get()
+        self.assertEqual((world.is_master, world.is_editor, world.is_viewer), (False, False, True))
+        plane = Plane.objects.visible_to(self.user).annotate_roles(self.anonymous_user).get()
+        self.assertEqual((plane.is_master, plane.is_editor, plane.is_viewer), (False, False, False))
+
+    def test_deferred_role_rebuild(self):
+        with patch.object(RoleTarget, "_subtree_levels", autospec=True, side_effect=RoleTarget._subtree_levels) as levels:
+            with self.captureOnCommitCallbacks(execute=True), deferred_role_rebuild():
+                self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+                section = self.article.sections.create(body=[])
+                section.role_target.roles.create(user=self.other_user, type=Role.Type.EDITOR)
+                self.plane_target.roles.create(user=None, type=Role.Type.VIEWER)
+
+                # Nothing is propagated yet, but checks see the explicit roles.
+                self.assertFalse(EffectiveRole.objects.filter(target=self.plane_target, user=self.user).exists())
+                self.assertTrue(self.plane_target.user_is_master(self.user))
+
+            # Everything was under the world, so only its subtree was loaded.
+            self.assertEqual(levels.call_count, 1)
+
+        self.assertTrue(section.role_target.user_is_master(self.user))
+        self.assertTrue(section.role_target.user_is_viewer(self.other_user))
+        propagated = self._role_rows()
+        masks = self._effective_rows()
+        Role.rebuild()
+        self.assertEqual(propagated, self._role_rows())
+        self.assertEqual(masks, self._effective_rows())
+
+    def test_async_propagation(self):
+        with override_settings(WORLDMASTER_ASYNC_ROLE_PROPAGATION=True):
+            self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+            self.assertTrue(RolePropagationJob.objects.exists())
+            self.assertFalse(self.plane_target.roles.filter(user=self.user).exists())
+
+            # Pending jobs make checks fall back to the explicit roles.
+            self.assertTrue(self.plane_target.user_is_master(self.user))
+            self.assertTrue(self.plane_target.user_is_viewer(self.user))
+            self.assertFalse(self.plane_target.user_is_master(self.other_user))
+
+            call_command("worker", once=True, stdout=StringIO())
+
+        self.assertFalse(RolePropagationJob.objects.exists())
+        self.assertTrue(self.plane_target.user_is_master(self.user))
+        propagated = self._role_rows()
+        masks = self._effective_rows()
+        Role.rebuild()
+        self.assertEqual(propagated, self._role_rows())
+        self.assertEqual(masks, self._effective_rows())
+
+    def test_async_propagation_querysets(self):
+        section = self.world.article.sections.create()
+        role = self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+
+        with override_settings(WORLDMASTER_ASYNC_ROLE_PROPAGATION=True):
+            # The revocation is pending, so the stale implicit roles must not
+            # count.
+            role.delete()
+            self.assertTrue(RolePropagationJob.objects.exists())
+            self.assertTrue(EffectiveRole.objects.filter(target=self.plane_target, user=self.user).exists())
+            self.assertFalse(Plane.objects.visible_to(self.user).exists())
+            self.assertFalse(Section.objects.editable_by(self.user).exists())
+            self.assertFalse(Plane.objects.annotate_roles(self.user).get().is_master)
+
+            # Explicit roles still count, on the target and through inheritance.
+            editor = User.objects.create(username="editor")
+            section.role_target.roles.create(user=editor, type=Role.Type.EDITOR)
+            self.plane_target.roles.create(user=None, type=Role.Type.VIEWER)
+            self.world_target.roles.create(user=self.other_user, type=Role.Type.MASTER)
+            self.assertEqual(list(Section.objects.editable_by(editor)), [section])
+            self.assertFalse(Section.objects.mastered_by(editor).exists())
+            self.assertEqual(list(Plane.objects.visible_to(self.anonymous_user)), [self.plane])
+            self.assertEqual(list(Section.objects.mastered_by(self.other_user)), [section])
+            plane = Plane.objects.annotate_roles(self.other_user).get()
+            self.assertEqual((plane.is_master, plane.is_editor, plane.is_viewer), (True, True, True))
+
+            while RolePropagationJob.objects.exists():
+                call_command("worker", once=True, stdout=StringIO())
+            self.assertFalse(Plane.objects.mastered_by(self.user).exists())
+            self.assertEqual(list(Section.objects.editable_by(editor)), [section])
+            self.assertEqual(list(Section.objects.mastered_by(self.other_user)), [section])
+
+    def test_async_propagation_across_processes(self):
+        # The web process caches an answer before the grant.
+        self.assertFalse(self.plane_target.user_is_master(self.user))
+        worker_cache = _shared_cache_client()
+
+        with override_settings(WORLDMASTER_ASYNC_ROLE_PROPAGATION=True):
+            role = self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+            self.assertTrue(self.plane_target.user_is_master(self.user))
+            with patch.object(permission_cache, "_cache", return_value=worker_cache):
+                call_command("worker", once=True, stdout=StringIO())
+            # The job is gone, and the worker's bump reached this process.
+            self.assertFalse(RolePropagationJob.objects.exists())
+            self.assertTrue(self.plane_target.user_is_master(self.user))
+
+            role.delete()
+            self.assertFalse(self.plane_target.user_is_master(self.user))
+            with patch.object(permission_cache, "_cache", return_value=worker_cache):
+                call_command("worker", once=True, stdout=StringIO())
+            self.assertFalse(self.plane_target.user_is_master(self.user))
+
+    def test_job_claim(self):
+        job = RolePropagationJob.objects.create(target=self.world_target)
+        self.assertEqual(RolePropagationJob.claim("a", timedelta(minutes=1)), job)
+        self.assertIsNone(RolePropagationJob.claim("b", timedelta(minutes=1)))
+        # An abandoned job may be claimed again.
+        self.assertEqual(RolePropagationJob.claim("b", timedelta(0)), job)
+
+    def test_rebuild_roles_command(self):
+        other_world = World.objects.create(slug="other", name="Other")
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        other_world.role_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        rows = self._role_rows()
+        Role.objects.filter(explicit=False).delete()
+
+        # An interrupted run resumes without touching finished roots.
+        RoleRebuildCheckpoint.objects.create(run="default", target=other_world.role_target)
+        call_command("rebuild_roles", stdout=StringIO())
+        self.assertTrue(self.plane_target.user_is_master(self.user))
+        self.assertFalse(other_world.role_target.roles.filter(explicit=False).exists())
+        self.assertFalse(RoleRebuildCheckpoint.objects.exists())
+
+        call_command("rebuild_roles", stdout=StringIO())
+        self.assertEqual(rows, self._role_rows())
+
+    def test_verify_roles(self):
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.plane_target.roles.create(user=self.other_user, type=Role.Type.EDITOR)
+        rows = self._role_rows()
+        masks = self._effective_rows()
+        self.assertFalse(verify_roles())
+
+        self.plane_target.roles.filter(user=self.user, type=Role.Type.EDITOR).delete()
+        extra = self.plane_target.roles.create(user=None, type=Role.Type.VIEWER, explicit=False)
+        EffectiveRole.objects.filter(target=self.plane_target, user=self.other_user).update(mask=0)
+
+        discrepancies = verify_roles()
+        self.assertEqual(
+            discrepancies.missing_roles,
+            [(self.plane_target.id, self.user.id, Role.Type.EDITOR)],
+        )
+        self.assertEqual(
+            discrepancies.extra_roles,
+            [(extra.id, self.plane_target.id, None, Role.Type.VIEWER)],
+        )
+        self.assertEqual(len(discrepancies.masks), 1)
+
+        with self.assertRaises(CommandError):
+            call_command("verify_roles", stdout=StringIO())
+        call_command("verify_roles", repair=True, stdout=StringIO())
+        self.assertFalse(verify_roles())
+        self.assertEqual(rows, self._role_rows())
+        self.assertEqual(masks, self._effective_rows())
+
+    def test_role_tree(self):
+        section = self.article.sections.create(body=[])
+        self.world_target.roles.create(user=self.user, type=Role.Type.EDITOR)
+        section.role_target.roles.create(user=None, type=Role.Type.VIEWER)
+        self.plane_target.roles.create(user=self.other_user, type=Role.Type.MASTER)
+        users = (self.user, self.other_user, AnonymousUser())
+
+        tree = role_tree(section.role_target)
+        self.assertEqual(tree.root_id, self.world_target.id)
+        self.assertTrue(tree.user_is_viewer(AnonymousUser(), section.role_target))
+        self.assertFalse(tree.user_is_editor(self.user, self.plane_target))
+        self.assertTrue(tree.user_is_editor(self.other_user, self.plane_target))
+        self.assertEqual(verify_tree(tree, users), [])
+
+        with self.assertNumQueries(0):
+            self.assertIs(role_tree(self.plane_target), tree)
+            tree.user_is_master(self.user, self.world_target)
+
+        # Role changes drop the tree.
+        self.world_target.roles.create(user=self.other_user, type=Role.Type.MASTER)
+        tree = role_tree(self.world_target)
+        self.assertTrue(tree.user_is_master(self.other_user, section.role_target))
+        self.assertEqual(verify_tree(tree, users), [])
+
+    def test_remove_user_roles(self):
+        section = self.article.sections.create(body=[])
+        section.role_target.roles.create(user=self.user, type=Role.Type.EDITOR)
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.world_target.roles.create(user=self.other_user, type=Role.Type.MASTER)
+        self.assertTrue(section.role_target.user_is_master(self.user))
+        other_rows = {row for row in self._role_rows() if row[1] != self.user.id}
+
+        removed = remove_user_roles(self.user)
+        self.assertEqual(removed.explicit, 2)
+        self.assertEqual(removed.root_ids, {self.world_target.id})
+        self.assertFalse(Role.objects.filter(user=self.user).exists())
+        self.assertFalse(EffectiveRole.objects.filter(user=self.user).exists())
+        self.assertFalse(section.role_target.user_is_master(self.user))
+        self.assertEqual(other_rows, self._role_rows())
+        self.assertFalse(verify_roles())
+
+    def test_delete_user_removes_roles(self):
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.plane_target.roles.create(user=self.other_user, type=Role.Type.EDITOR)
+        # Nothing is propagated, however many roles the user had.
+        with patch.object(RoleTarget, "_propagate_roles_now") as propagate:
+            self.user.delete()
+        propagate.assert_not_called()
+        self.assertFalse(Role.objects.filter(user_id=self.user.id).exists())
+        self.assertFalse(verify_roles())
+
+        stdout = StringIO()
+        call_command("offboard_user", self.other_user.username, delete=True, stdout=stdout)
+        self.assertIn("1 explicit roles", stdout.getvalue())
+        self.assertFalse(User.objects.filter(id=self.other_user.id).exists())
+        self.assertFalse(Role.objects.filter(user__isnull=False).exists())
+
+    def test_permission_matrix(self):
+        section = self.article.sections.create(body=[])
+        self.world_target.roles.create(user=self.user, type=Role.Type.MASTER)
+        self.plane_target.roles.create(user=self.other_user, type=Role.Type.VIEWER)
+        section.role_target.roles.create(user=None, type=Role.Type.VIEWER)
+        self.plane_target.roles.create(user=None, type=Role.Type.VIEWER)
+
+        matrix = permission_matrix(self.plane_target)
+        self.assertEqual(
+            set(matrix.target_ids(matrix.bits(self.user.id, Role.Type.EDITOR))),
+            {self.world_target.id, self.plane_target.id, section.role_target.id},
+        )
+        public_only = matrix.bits(None, Role.Type.VIEWER) & ~matrix.bits(self.other_user.id, Role.Type.VIEWER)
+        self.assertEqual(matrix.target_ids(public_only), [section.role_target.id])
+        self.assertEqual(
+            matrix.bits(self.other_user.id, Role.Type.VIEWER, include_public=True),
+            matrix.bits(None, Role.Type.VIEWER),
+        )
+
+        for target_id, user_id, types in matrix.rows():
+            user = AnonymousUser() if user_id is None else User.objects.get(id=user_id)
+            self.assertEqual(RoleTarget.objects.get(id=target_id).roles.filter(user=user_id).count(), len(types))
+            self.assertTrue(types <= RoleTarget.roles_for(user, (target_id,))[target_id])
+
+        stdout = StringIO()
+        call_command("permission_matrix", self.world_target.id, stdout=stdout, stderr=StringIO())
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], "target_id,user_id,master,editor,viewer")
+        self.assertIn(f"{section.role_target.id},,0,0,1", lines)
+
+        stdout = StringIO()
+        call_command("permission_matrix", self.world_target.id, format="ndjson", stdout=stdout, stderr=StringIO())
+        self.assertEqual(len(stdout.getvalue().splitlines()), len(list(matrix.rows())))
+
+    def _section_data(self, *sections: tuple[int | None, str, list]) -> QueryDict:
+        data = QueryDict(mutable=True)
+        data.setlist("wiki-section-id", ["" if id is None else str(id) for id, _, _ in sections])
+        data.setlist("wiki-section-key", [key for _, key, _ in sections])
+        data.setlist("wiki-section-body", [json.dumps(body) for _, _, body in sections])
+        return data
+
+    def test_update_sections(self):
+        mine = self.article.sections.create(body=["mine"], key="a0")
+        theirs = self.article.sections.create(body=["theirs"], key="a1")
+        kept = self.article.sections.create(body=["kept"], key="a2")
+        self.article_target.roles.create(user=self.user, type=Role.Type.EDITOR)
+        mine.role_target.roles.create(user=self.user, type=Role.Type.EDITOR)
+        self.world_target.roles.create(user=self.other_user, type=Role.Type.MASTER)
+
+        with self.assertRaises(PermissionDenied):
+            self.article.update_sections(self.anonymous_user, self._section_data())
+        with self.assertRaises(Http404):
+            self.article.update_sections(self.user, self._section_data((0, "a0", [])))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.update_sections(self.user, self._section_data(
+                (mine.id, "a0", ["changed"]),
+                (None, "", ["new"]),
+                (theirs.id, "a3", ["ignored"]),
+            ))
+
+        mine.refresh_from_db()
+        theirs.refresh_from_db()
+        self.assertEqual((mine.body, mine.key), (["changed"], "a0"))
+        self.assertEqual((theirs.body, theirs.key), (["theirs"], "a1"))
+        self.assertTrue(Section.objects.filter(id=kept.id).exists())
+        new = self.article.sections.get(body=["new"])
+        # New sections go between their neighbours without renumbering them.
+        self.assertEqual(list(self.article.sections.all()), [mine, new, theirs, kept])
+        self.assertEqual(new.role_target.parent_id, self.article_target.id)
+        self.assertTrue(new.role_target.roles.filter(user=self.user, type=Role.Type.EDITOR, explicit=True).exists())
+        self.assertTrue(new.role_target.user_is_master(self.other_user))
+        self.assertFalse(verify_roles())
+        self.assertEqual(mine.content_hash, content_hash(["changed"], "a0"))
+        self.assertEqual(new.content_hash, content_hash(["new"], new.key))
+
+        # Reposting unchanged sections writes nothing.
+        with CaptureQueriesContext(connection) as captured:
+            self.article.update_sections(self.user, self._section_data(
+                (mine.id, "a0", ["changed"]),
+                (new.id, new.key, ["new"]),
+                (theirs.id, "a1", ["theirs"]),
+                (kept.id, "a2", ["kept"]),
+            ))
+        self.assertFalse([query for query in captured if not query["sql"].startswith("SELECT")])
+
+        # Moving a section only writes its own key.
+        kept.move_between(None, mine)
+        self.assertEqual(list(self.article.sections.all()), [kept, mine, new, theirs])
+
+        # Removing sections deletes them and their role targets.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.update_sections(self.user, self._section_data((new.id, new.key, ["new"])))
+        self.assertFalse(Section.objects.filter(id=mine.id).exists())
+        self.assertFalse(RoleTarget.objects.filter(id=mine.role_target_id).exists())
+        self.assertEqual(set(self.article.sections.values_list("id", flat=True)), {new.id, theirs.id, kept.id})
+        self.assertFalse(verify_roles())
+
+        # The number of queries doesn't depend on the number of sections, either
+        # created or deleted.  Each update replaces all of the previous one's
+        # sections, once the roles of the sections it created are rebuilt.
+        queries = []
+        for count in (1, 1, 10, 50, 1):
+            data = self._section_data(*((None, "", []) for _ in range(count)))
+            with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as captured:
+                self.article.update_sections(self.other_user, data)
+            queries.append(len(captured))
+        self.assertEqual(len(set(queries[1:])), 1, queries)
+        self.assertEqual(self.article.sections.count(), 1)
+        self.assertFalse(verify_roles())
+
+    def test_update_sections_as_master(self):
+        # A MASTER inherits EDITOR on the sections it adds, so it gets no
+        # explicit role there that would outlive its MASTER role.
+        master_role = self.world_target.roles.create(user=self.other_user, type=Role.Type.MASTER)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.update_sections(self.other_user, self._section_data((None, "", ["mine"])))
+        section = self.article.sections.get()
+        self.assertTrue(section.role_target.user_is_editor(self.other_user))
+        self.assertFalse(section.role_target.roles.filter(user=self.other_user, explicit=True).exists())
+
+        master_role.delete()
+        self.assertFalse(section.role_target.user_is_editor(self.other_user))
+        self.assertFalse(verify_roles())
+
+    def test_deferred_explicit_role(self):
+        # Checks within a deferred block fall back to the explicit roles where
+        # propagation is deferred, so a new MASTER may edit right away.
+        with self.captureOnCommitCallbacks(execute=True), deferred_role_rebuild():
+            role = self.world_target.roles.create(user=self.other_user, type=Role.Type.MASTER)
+            self.assertFalse(EffectiveRole.objects.filter(target=self.plane_target, user=self.other_user).exists())
+            self.assertTrue(self.plane_target.user_is_master(self.other_user))
+            self.assertEqual(list(Plane.objects.mastered_by(self.other_user)), [self.plane])
+            self.article.update_sections(self.other_user, self._section_data((None, "", ["new"])))
+        section = self.article.sections.get()
+        self.assertTrue(section.role_target.user_is_editor(self.other_user))
+
+        with self.captureOnCommitCallbacks(execute=True), deferred_role_rebuild():
+            role.delete()
+            self.assertFalse(section.role_target.user_is_editor(self.other_user))
+            self.assertFalse(Section.objects.editable_by(self.other_user).exists())
+            with self.assertRaises(PermissionDenied):
+                self.article.update_sections(self.other_user, self._section_data())
+        self.assertFalse(section.role_target.user_is_editor(self.other_user))
+        self.assertFalse(verify_roles())
+
+class RoleTransactionTestCase(TransactionTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
+        self.world: World = World.objects.create(slug="world", name="World")
+        self.plane: Plane = self.world.plane_set.create(slug="plane", name="Plane")
+
+    def test_move_under_own_subtree(self):
+        # Without a surrounding transaction, nothing may be written before the
+        # move is refused.
+        world_target = self.world.role_target
+        with self.assertRaises(ValueError):
+            world_target.move_to(self.plane.role_target)
+        self.assertIsNone(RoleTarget.objects.get(id=world_target.id).parent_id)
+
+        world_target = RoleTarget.objects.get(id=world_target.id)
+        world_target.parent = self.plane.role_target
+        with self.assertRaises(ValueError):
+            world_target.save()
+        self.assertIsNone(RoleTarget.objects.get(id=world_target.id).parent_id)
+        self.assertFalse(RoleTargetAncestor.objects.filter(descendant=world_target).exclude(depth=0).exists())
+
+    def test_benchmark_roles(self):
+        cache.set("unrelated", "kept")
+        stdout = StringIO()
+        call_command(
+            "benchmark_roles",
+            planes=1,
+            entities=1,
+            sections=1,
+            users=1,
+            repeat=1,
+            stdout=stdout,
+            stderr=StringIO(),
+        )
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report.keys(), {"shape", "repeat", "database", "operations"})
+        self.assertEqual(report["shape"], {"worlds": 1, "planes": 1, "entities": 1, "sections": 1, "users": 1})
+        self.assertIn("role_tree", report["operations"])
+        for result in report["operations"].values():
+            self.assertEqual(result.keys(), {"seconds", "queries", "median_seconds", "min_seconds"})
+        # The benchmark clears only a cache of its own.
+        self.assertEqual(cache.get("unrelated"), "kept")
+        # The throwaway database is gone, and this one is still in use.
+        self.assertTrue(World.objects.filter(id=self.world.id).exists())
@@ -0,0 +1,428 @@
+from __future__ import annotations
+
+import json
+from io import StringIO
+from itertools import pairwise
+from typing import TYPE_CHECKING, cast
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import connection
+from django.http import QueryDict
+from django.template.loader import render_to_string
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from worldmaster.roles.models import Role
+from worldmaster.wiki import jsonpatch
+from worldmaster.wiki.fragment_cache import rendered_article
+from worldmaster.wiki.models import _REBALANCE_KEY_LENGTH, Section, SectionRevision, content_hash
+from worldmaster.wiki.ordering import generate_key_between, generate_n_keys_between, validate_key
+from worldmaster.wiki.rendering import render_html
+from worldmaster.wiki.revisions import body_at
+from worldmaster.wiki.search import highlight, search_sections, section_text
+from worldmaster.worlds.models import World
+
+if TYPE_CHECKING:
+    from worldmaster.worldmaster import models as worldmaster
+
+User = cast(type["worldmaster.User"], get_user_model())
+
+def _doc(*content: dict) -> dict:
+    return {"type": "doc", "content": list(content)}
+
+def _text(text: str, *marks: str) -> dict:
+    node: dict = {"type": "text", "text": text}
+    if marks:
+        node["marks"] = [{"type": mark} for mark in marks]
+    return node
+
+class RenderingTestCase(SimpleTestCase):
+    def test_empty(self):
+        self.assertEqual(render_html([]), "")
+        self.assertEqual(render_html(_doc()), "")
+        self.assertEqual(render_html(_doc({"type": "paragraph"})), "<p></p>")
+
+    def test_blocks(self):
+        self.assertEqual(
+            render_html(_doc(
+                {"type": "heading", "attrs": {"level": 2}, "content": [_text("Title")]},
+                {"type": "bulletList", "content": [
+                    {"type": "listItem", "content": [{"type": "paragraph", "content": [_text("one")]}]},
+                ]},
+                {"type": "orderedList", "attrs": {"start": 1}, "content": []},
+                {"type": "orderedList", "attrs": {"start": 3}, "content": []},
+                {"type": "blockquote", "content": [{"type": "paragraph"}]},
+                {"type": "codeBlock", "attrs": {"language": None}, "content": [_text("x < y")]},
+                {"type": "codeBlock", "attrs": {"language": "py"}, "content": [_text("pass")]},
+                {"type": "horizontalRule"},
+                {"type": "paragraph", "content": [_text("a"), {"type": "hardBreak"}, _text("b")]},
+            )),
+            "<h2>Title</h2>"
+            "<ul><li><p>one</p></li></ul>"
+            "<ol></ol>"
+            '<ol start="3"></ol>'
+            "<blockquote><p></p></blockquote>"
+            "<pre><code>x &lt; y</code></pre>"
+            '<pre><code class="language-py">pass</code></pre>'
+            "<hr>"
+            "<p>a<br>b</p>",
+        )
+
+    def test_marks(self):
+        self.assertEqual(
+            render_html(_doc({"type": "paragraph", "content": [
+                _text("plain "),
+                _text("bold", "bold"),
+                _text(" both", "bold", "italic"),
+                _text(" italic", "italic"),
+                _text(" code & ", "code"),
+                _text("gone", "unknown", "strike"),
+            ]})),
+            "<p>plain <strong>bold<em> both</em></strong><em> italic</em>"
+            "<code> code &amp; </code><s>gone</s></p>",
+        )
+
+    def test_unknown_nodes(self):
+        self.assertEqual(
+            render_html(_doc({"type": "mystery", "content": [{"type": "paragraph", "content": [_text("<b>")]}]})),
+            "<p>&lt;b&gt;</p>",
+        )
+
+class OrderingTestCase(SimpleTestCase):
+    def test_known_keys(self):
+        self.assertEqual(generate_key_between(None, None), "a0")
+        self.assertEqual(generate_key_between("a0", None), "a1")
+        self.assertEqual(generate_key_between(None, "a0"), "Zz")
+        self.assertEqual(generate_key_between("a0", "a1"), "a0V")
+        self.assertEqual(generate_key_between("az", None), "b00")
+        self.assertEqual(generate_n_keys_between(None, None, 3), ["a0", "a1", "a2"])
+
+    def test_invalid_keys(self):
+        for key in ("", "a", "a00", "a0!", "A00000000000000000000000000"):
+            with self.subTest(key=key), self.assertRaises(ValueError):
+                validate_key(key)
+        with self.assertRaises(ValueError):
+            generate_key_between("a1", "a0")
+
+    def test_repeated_inserts(self):
+        keys = ["a0"]
+        for i in range(500):
+            # Alternate between inserting at the start, at the end, and in
+            # the same crowded spot.
+            index = (0, len(keys), 1)[i % 3]
+            previous = keys[index - 1] if index > 0 else None
+            next = keys[index] if index < len(keys) else None
+            keys.insert(index, generate_key_between(previous, next))
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), len(keys))
+
+        between = generate_n_keys_between(keys[0], keys[1], 20)
+        self.assertEqual(between, sorted(between))
+        self.assertTrue(keys[0] < between[0] and between[-1] < keys[1])
+
+class JsonPatchTestCase(SimpleTestCase):
+    def test_round_trip(self):
+        cases = [
+            ({"a": 1, "b": [1, 2, 3]}, {"a": 1, "b": [1, 4, 2, 3], "c/~": None}),
+            ([1, 2, 3, 4, 5], [1, 5]),
+            ([{"x": 1}, {"x": 2}], [{"x": 1}, {"x": 3, "y": [True]}]),
+            ({"a": 1}, [1]),
+            ({"a": 1}, {"a": True}),
+        ]
+        for a, b in cases:
+            with self.subTest(a=a, b=b):
+                patch = jsonpatch.diff(a, b)
+                self.assertEqual(json.dumps(jsonpatch.apply(a, patch)), json.dumps(b))
+
+    def test_small_edits(self):
+        a = _doc(*({"type": "paragraph", "content": [_text(str(i))]} for i in range(100)))
+        b = json.loads(json.dumps(a))
+        b["content"].insert(50, {"type": "paragraph"})
+        self.assertEqual(jsonpatch.diff(a, b), [{"op": "add", "path": "/content/50", "value": {"type": "paragraph"}}])
+        self.assertEqual(jsonpatch.diff(a, a), [])
+        with self.assertRaises(ValueError):
+            jsonpatch.apply(a, [{"op": "move", "from": "/content/0", "path": "/content/1"}])
+
+def _paragraph(text: str) -> dict:
+    return _doc({"type": "paragraph", "content": [_text(text)]})
+
+class SectionTestCase(TestCase):
+    def setUp(self) -> None:
+        # Cached roles and renders outlive the rolled-back test transactions.
+        cache.clear()
+
+        self.world: World = World.objects.create(slug="world", name="World")
+
+    def test_html_rendered_on_save(self):
+        article = self.world.article
+        section = article.sections.create(body=_doc({"type": "paragraph", "content": [_text("hi")]}))
+        self.assertEqual(Section.objects.get(id=section.id).html, "<p>hi</p>")
+
+        section.body = _doc()
+        section.save()
+        self.assertEqual(Section.objects.get(id=section.id).html, "")
+
+    def test_render_sections(self):
+        article = self.world.article
+        section = article.sections.create(body=_paragraph("hi"))
+        article.sections.create(body=[])
+        # As for sections from before HTML was rendered on save.
+        Section.objects.filter(id=section.id).update(html="")
+        section.role_target.roles.create(user=None, type=Role.Type.VIEWER)
+        self.assertNotIn("hi", rendered_article(AnonymousUser(), article))
+
+        stdout = StringIO()
+        call_command("render_sections", stdout=stdout)
+        self.assertIn("Rendered 2 sections, 1 changed", stdout.getvalue())
+        self.assertEqual(Section.objects.get(id=section.id).html, "<p>hi</p>")
+        self.assertIn("<p>hi</p>", rendered_article(AnonymousUser(), article))
+
+    def test_new_sections_go_last(self):
+        article = self.world.article
+        first = article.sections.create(body=[])
+        second = article.sections.create(body=[])
+        self.assertEqual((first.key, second.key), ("a0", "a1"))
+
+    def test_long_keys(self):
+        article = self.world.article
+        for _ in range(3):
+            article.sections.create(body=[])
+        superuser = User.objects.create(username="admin", is_superuser=True)
+
+        # Moving sections into the same gap over and over makes each key
+        # longer than the last, until the article's keys are rebalanced.
+        lengths = []
+        for _ in range(1000):
+            first, second, last = article.sections.all()
+            last.move_between(first, second)
+            self.assertEqual(list(article.sections.all()), [first, last, second])
+            lengths.append(len(last.key))
+        # A key that would be longer is rebalanced away as soon as it is written.
+        self.assertEqual(max(lengths), _REBALANCE_KEY_LENGTH)
+        self.assertTrue(any(after < before for before, after in pairwise(lengths)))
+
+        first, second, last = article.sections.all()
+        data = QueryDict(mutable=True)
+        data.setlist("wiki-section-id", [str(first.id), str(second.id), str(last.id)])
+        data.setlist("wiki-section-body", [json.dumps([])] * 3)
+        # A key too long to store is replaced, and one that fits is rebalanced.
+        data.setlist("wiki-section-key", ["a0", "a0" + "V" * 300, "a1"])
+        article.update_sections(superuser, data)
+        self.assertEqual(list(article.sections.all()), [first, second, last])
+        data.setlist("wiki-section-key", ["a0", "a0" + "V" * 200, "a1"])
+        article.update_sections(superuser, data)
+        self.assertEqual(list(article.sections.all()), [first, second, last])
+        self.assertEqual(list(article.sections.values_list("key", flat=True)), ["a0", "a1", "a2"])
+        second.refresh_from_db()
+        self.assertEqual(second.content_hash, content_hash([], "a1"))
+
+    def test_posted_keys(self):
+        article = self.world.article
+        first, second, third = (article.sections.create(body=[]) for _ in range(3))
+        superuser = User.objects.create(username="admin", is_superuser=True)
+
+        def post(sections: list[Section], keys: list[str]) -> None:
+            data = QueryDict(mutable=True)
+            data.setlist("wiki-section-id", [str(section.id) for section in sections])
+            data.setlist("wiki-section-key", keys)
+            data.setlist("wiki-section-body", [json.dumps([])] * len(sections))
+            article.update_sections(superuser, data)
+
+        # Sections posted out of order, with an invalid key, or without one get
+        # new keys where they were posted.
+        post([third, first, second], ["a2", "a0", "a00"])
+        self.assertEqual(list(article.sections.all()), [third, first, second])
+        self.assertEqual(article.sections.get(id=third.id).key, "a2")
+
+        post([second, first, third], ["", "", ""])
+        self.assertEqual(list(article.sections.all()), [second, first, third])
+        for key in article.sections.values_list("key", flat=True):
+            validate_key(key)
+
+    def test_rendered_article(self):
+        article = self.world.article
+        master = User.objects.create(username="master")
+        player = User.objects.create(username="player")
+        self.world.role_target.roles.create(user=master, type=Role.Type.MASTER)
+        public = article.sections.create(body=_doc({"type": "paragraph", "content": [_text("public")]}))
+        secret = article.sections.create(body=_doc({"type": "paragraph", "content": [_text("secret")]}))
+        public.role_target.roles.create(user=None, type=Role.Type.VIEWER)
+
+        self.assertInHTML("<section><p>public</p></section>", rendered_article(AnonymousUser(), article))
+        self.assertNotIn("secret", rendered_article(AnonymousUser(), article))
+        self.assertIn("secret", rendered_article(master, article))
+
+        # Users who can see the same sections share a cached render.
+        with patch("worldmaster.wiki.fragment_cache.render_to_string", wraps=render_to_string) as render:
+            # Only the article version is read.
+            with self.assertNumQueries(1):
+                rendered_article(AnonymousUser(), article)
+            self.assertNotIn("secret", rendered_article(player, article))
+            render.assert_not_called()
+
+        # Edits and permission changes show up right away.
+        public.body = _doc({"type": "paragraph", "content": [_text("edited")]})
+        public.save()
+        self.assertIn("edited", rendered_article(player, article))
+        secret.role_target.roles.create(user=player, type=Role.Type.VIEWER)
+        self.assertIn("secret", rendered_article(player, article))
+
+        # So do edits from other processes, which have their own LocMemCache.
+        with patch("worldmaster.wiki.fragment_cache._cache", return_value=LocMemCache("other-process", {})):
+            public.body = _paragraph("elsewhere")
+            public.save()
+        self.assertIn("elsewhere", rendered_article(player, article))
+
+    def test_section_text(self):
+        self.assertEqual(
+            section_text(_doc(
+                {"type": "heading", "content": [_text("Title")]},
+                {"type": "paragraph", "content": [_text("a", "bold"), {"type": "hardBreak"}, _text("b")]},
+            )),
+            "Title\na\nb",
+        )
+        self.assertEqual(section_text([]), "")
+
+    def test_search(self):
+        plane = self.world.plane_set.create(slug="plane", name="Plane")
+        viewer = User.objects.create(username="viewer")
+        dragon = plane.article.sections.create(body=_paragraph("The red dragon sleeps under the mountain."))
+        secret = self.world.article.sections.create(body=_paragraph("The dragon is secretly a <wizard>."))
+        self.world.article.sections.create(body=_paragraph("Nothing to see here."))
+        dragon.role_target.roles.create(user=None, type=Role.Type.VIEWER)
+        secret.role_target.roles.create(user=viewer, type=Role.Type.VIEWER)
+
+        self.assertEqual(list(search_sections(AnonymousUser(), "dragon")), [dragon])
+        self.assertEqual({section.id for section in search_sections(viewer, "dragon")}, {dragon.id, secret.id})
+        self.assertEqual(list(search_sections(viewer, "dragon wizard")), [secret])
+        self.assertEqual(list(search_sections(viewer, "dragon", under=plane.role_target)), [dragon])
+        self.assertEqual(list(search_sections(viewer, "")), [])
+        # FTS5 syntax is searched for literally.
+        self.assertEqual(list(search_sections(viewer, 'wizard" OR "')), [])
+
+        result = search_sections(viewer, "wizard").get()
+        self.assertEqual(highlight(result.snippet), "The dragon is secretly a &lt;<mark>wizard</mark>&gt;.")
+
+        # Writes keep the index up to date, including bulk ones.
+        dragon.body = _paragraph("The red wyrm sleeps.")
+        dragon.save()
+        self.assertEqual(list(search_sections(viewer, "dragon")), [secret])
+        data = QueryDict(mutable=True)
+        data.setlist("wiki-section-id", [str(secret.id)])
+        data.setlist("wiki-section-key", [secret.key])
+        data.setlist("wiki-section-body", [json.dumps(_paragraph("The wizard left."))])
+        superuser = User.objects.create(username="admin", is_superuser=True)
+        self.world.article.update_sections(superuser, data)
+        self.assertEqual(list(search_sections(viewer, "dragon")), [])
+        self.assertEqual(list(search_sections(superuser, "here")), [])
+        self.assertEqual(list(search_sections(viewer, "left")), [secret])
+
+        stdout = StringIO()
+        call_command("rebuild_search_index", stdout=stdout)
+        self.assertIn("Indexed 2 sections", stdout.getvalue())
+        self.assertEqual(list(search_sections(AnonymousUser(), "wyrm")), [dragon])
+
+        self.world.role_target.roles.create(user=None, type=Role.Type.VIEWER)
+        response = self.client.get(reverse("worlds:search", args=(self.world.slug,)), {"q": "wyrm"})
+        self.assertContains(response, "<mark>wyrm</mark>")
+        self.assertContains(response, reverse("worlds:plane", args=(self.world.slug, plane.slug)))
+
+    @override_settings(WORLDMASTER_WIKI_SNAPSHOT_INTERVAL=3)
+    def test_revisions(self):
+        article = self.world.article
+        section = article.sections.create(body=_paragraph("0"))
+        for i in range(1, 5):
+            section.body = _paragraph(str(i))
+            section.save()
+        # Moving a section doesn't change its body.
+        section.move_between(None, None)
+
+        data = QueryDict(mutable=True)
+        data.setlist("wiki-section-id", [str(section.id), ""])
+        data.setlist("wiki-section-key", [section.key, ""])
+        data.setlist("wiki-section-body", [json.dumps(_paragraph("5")), json.dumps(_paragraph("new"))])
+        superuser = User.objects.create(username="admin", is_superuser=True)
+        article.update_sections(superuser, data)
+
+        revisions = list(section.revisions.all())
+        self.assertEqual([revision.number for revision in revisions], list(range(6)))
+        self.assertEqual([revision.snapshot is not None for revision in revisions], [True, False, False, True, False, False])
+        self.assertEqual(revisions[-1].user, superuser)
+        for number in range(6):
+            self.assertEqual(body_at(section, number), _paragraph(str(number)))
+        self.assertEqual(body_at(section), _paragraph("5"))
+        new = article.sections.exclude(id=section.id).get()
+        self.assertEqual(body_at(new), _paragraph("new"))
+
+        # Reconstruction only reads from the nearest snapshot.
+        with self.assertNumQueries(1):
+            body_at(section, 5)
+
+        stdout = StringIO()
+        call_command("compact_revisions", days=0, stdout=stdout)
+        self.assertIn("Removed 2 revisions", stdout.getvalue())
+        self.assertEqual(list(section.revisions.values_list("number", flat=True)), [0, 2, 3, 5])
+        for number in (0, 2, 3, 5):
+            self.assertEqual(body_at(section, number), _paragraph(str(number)))
+        with self.assertRaises(SectionRevision.DoesNotExist):
+            body_at(section, 1)
+
+        # New revisions still apply on top of compacted ones.
+        section.body = _paragraph("6")
+        section.save()
+        self.assertEqual(body_at(section), _paragraph("6"))
+        self.assertEqual(timezone.now().date(), section.revisions.last().created_at.date())
+
+        # Saves compare against the body as it was loaded, rather than reloading
+        # it.
+        section = Section.objects.get(id=section.id)
+        section.body = _paragraph("7")
+        with CaptureQueriesContext(connection) as captured:
+            section.save()
+        self.assertFalse([query for query in captured if 'FROM "wiki_section" ' in query["sql"]])
+        self.assertEqual(section.revisions.last().delta, jsonpatch.diff(_paragraph("6"), _paragraph("7")))
+        # Saving an unchanged body records nothing.
+        section.save()
+        self.assertEqual(section.revisions.count(), 6)
+        # A body changed in place has nothing left to diff against, so it gets
+        # a snapshot.
+        section.body["content"].append({"type": "paragraph"})
+        section.save()
+        self.assertEqual(section.revisions.last().snapshot, section.body)
+        self.assertEqual(body_at(section), section.body)
+
+    def test_sections_for(self):
+        article = self.world.article
+        editor = User.objects.create(username="editor")
+        self.world.role_target.roles.create(user=editor, type=Role.Type.EDITOR)
+        readable = article.sections.create(body=_paragraph("readable"))
+        editable = article.sections.create(body=_paragraph("editable"))
+        article.sections.create(body=_paragraph("secret"))
+        public = article.sections.create(body=_paragraph("public"))
+        readable.role_target.roles.create(user=editor, type=Role.Type.VIEWER)
+        editable.role_target.roles.create(user=editor, type=Role.Type.EDITOR)
+        public.role_target.roles.create(user=None, type=Role.Type.VIEWER)
+
+        with self.assertNumQueries(1):
+            sections = [(section.id, section.is_editor) for section in article.sections_for(editor)]
+        self.assertEqual(sections, [(readable.id, False), (editable.id, True), (public.id, False)])
+        self.assertEqual([section.id for section in article.sections_for(AnonymousUser())], [public.id])
+        superuser = User.objects.create(username="admin", is_superuser=True)
+        self.assertTrue(all(section.is_editor for section in article.sections_for(superuser)))
+        self.assertEqual(article.sections_for(superuser).count(), 4)
+
+        # Hidden sections aren't sent to the edit page at all.
+        self.client.force_login(editor)
+        response = self.client.get(reverse("worlds:edit-world", args=(self.world.slug,)))
+        self.assertContains(response, "editable")
+        self.assertContains(response, "readable")
+        self.assertNotContains(response, "secret")
+        self.assertContains(response, f'value="{readable.id}" disabled')
+        self.assertContains(response, f'value="{editable.id}">')
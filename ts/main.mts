@@ -1,3 +1,2 @@
 import './wiki/edit-wiki';
-import './wiki/display-wiki';
 import './worlds/edit-players';
@@ -3,7 +3,7 @@ import StarterKit from '@tiptap/starter-kit';
 
 export class SectionEditor {
   #id: HTMLInputElement;
-  #order: HTMLInputElement;
+  #key: HTMLInputElement;
   #body: HTMLInputElement;
   #editor_div: HTMLDivElement;
   #editor: Editor;
@@ -15,7 +15,7 @@ export class SectionEditor {
   public set disabled(disabled: boolean) {
     this.#disabled = disabled;
     this.#id.disabled = disabled;
-    this.#order.disabled = disabled;
+    this.#key.disabled = disabled;
     this.#body.disabled = disabled;
     this.#editor.setEditable(!disabled);
     if (disabled) {
@@ -27,7 +27,7 @@ export class SectionEditor {
 
   constructor(section: HTMLLIElement) {
     this.#id = section.querySelector('input.id') as HTMLInputElement;
-    this.#order = section.querySelector('input.order') as HTMLInputElement;
+    this.#key = section.querySelector('input.key') as HTMLInputElement;
     this.#body = section.querySelector('input.body') as HTMLInputElement;
     this.#disabled = this.#body.disabled;
 
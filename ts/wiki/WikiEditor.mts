@@ -47,30 +47,11 @@ export class WikiEditor {
     });
   }
 
-  static #get_order_from_section(li: Element | null): number | null {
-    if (li === null) {
-      return null;
-    }
-    const order_input = li.querySelector(".order") as HTMLInputElement;
-    return Number(order_input.value);
-  }
-
   /**
   * Create a new section and insert it in the place of the button.
   */
   #add_section(button: HTMLButtonElement) {
     const add_section_li = button.parentElement as HTMLLIElement;
-    const prev_section_order = WikiEditor.#get_order_from_section(add_section_li.previousElementSibling);
-    const next_section_order = WikiEditor.#get_order_from_section(add_section_li.nextElementSibling);
-    let order = 0;
-    if (prev_section_order !== null && next_section_order !== null) {
-      order = prev_section_order / 2 + next_section_order / 2;
-    } else if (prev_section_order !== null) {
-      order = prev_section_order + 1;
-    } else if (next_section_order !== null) {
-      order = next_section_order - 1;
-    }
-    // Otherwise this is the only section, and should stay 0 in order.
 
     const fragment = new DocumentFragment();
 
@@ -94,11 +75,13 @@ export class WikiEditor {
     // Leave the value empty to tell the server that it's creating a new section
     section_id.value = '';
 
-    const section_order = section_li.appendChild(document.createElement('input'));
-    section_order.hidden = true;
-    section_order.name = 'wiki-section-order';
-    section_order.classList.add('order');
-    section_order.value = order.toString();
+    // Leave the key empty too, so that the server generates one between the
+    // neighbouring sections
+    const section_key = section_li.appendChild(document.createElement('input'));
+    section_key.hidden = true;
+    section_key.name = 'wiki-section-key';
+    section_key.classList.add('key');
+    section_key.value = '';
 
     const section_body = section_li.appendChild(document.createElement('input'));
     section_body.hidden = true;